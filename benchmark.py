@@ -0,0 +1,395 @@
+# Benchmarks for the hot paths of the analysis. Synthetic NetCDF files with the layout of the real data are written to a
+# fixture directory, the benchmarks run inside of it (all modules read from './data/...'), so everything works offline.
+# Time and peak memory of every benchmark are measured for several date ranges and compared to stored baselines.
+# Baselines depend on the machine, benchmark_baselines.json is local (not in git) and created with --save-baseline.
+#
+#   python benchmark.py                      run all benchmarks and compare to benchmark_baselines.json
+#   python benchmark.py --save-baseline      run all benchmarks and store the results as new baseline
+#   python benchmark.py --sizes 7 31 --only cluster_leads get_budgets
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+import matplotlib
+import netCDF4 as nc
+import numpy as np
+
+matplotlib.use('Agg')
+
+# shapes of the real data
+lead_shape = (368, 368)             # 12.5 km lead fraction grid (and everything remapped to it)
+eumetsat_shape = (177, 119)         # 62.5 km EUMETSAT/OSI SAF drift grid (yc, xc)
+era5_shape = (161, 1440)            # 0.25 deg ERA5, 90N - 50N
+start_date = '20191201'
+
+default_sizes = [7, 14, 31]
+default_fixture_dir = './benchmark_data'
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.json')
+
+
+def date_list(date1, n_days):
+    dt_date = datetime.date(int(date1[:4]), int(date1[4:6]), int(date1[6:]))
+    return [(dt_date + datetime.timedelta(days=i)).strftime('%Y%m%d') for i in range(n_days)]
+
+
+def dt_from_string(date, hour=0):
+    return datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), hour)
+
+
+def polar_stereo_lonlat(shape, spacing):
+    # lon/lat of a grid centred on the north pole with the given spacing in km
+    y = (np.arange(shape[0]) - shape[0] / 2) * spacing
+    x = (np.arange(shape[1]) - shape[1] / 2) * spacing
+    xx, yy = np.meshgrid(x, y)
+    r = np.hypot(xx, yy)
+    lat = 90 - np.degrees(2 * np.arctan(r / (2 * 6371)))
+    lon = np.degrees(np.arctan2(xx, -yy)) - 45
+    return (lon + 180) % 360 - 180, lat, x, y
+
+
+def smooth_field(rng, shape, n_modes=4):
+    # cheap smooth random field in [0, 1]
+    y, x = np.linspace(0, 2 * np.pi, shape[0])[:, None], np.linspace(0, 2 * np.pi, shape[1])[None, :]
+    field = np.zeros(shape, dtype=np.float32)
+    for _ in range(n_modes):
+        ky, kx, phase = rng.integers(1, 5), rng.integers(1, 5), rng.uniform(0, 2 * np.pi)
+        field += np.sin(ky * y + phase) * np.cos(kx * x - phase)
+    return ((field - field.min()) / (field.max() - field.min())).astype(np.float32)
+
+
+def time_variable(ds, dates, units, hours):
+    # time axis with one time step per date and hour
+    ds.createDimension('time', None)
+    t = ds.createVariable('time', 'f8', ('time',))
+    t.units, t.calendar = units, 'standard'
+    t[:] = nc.date2num([dt_from_string(d, h) for d in dates for h in hours], units, 'standard')
+
+
+def write_lead_fixtures(rng, dates, ocean):
+    directory = './data/DailyArcticLeadFraction_12p5km_Rheinlaender/'
+    os.makedirs(directory + 'data', exist_ok=True)
+    lon, lat, _, _ = polar_stereo_lonlat(lead_shape, 12.5)
+    with nc.Dataset(directory + 'LeadFraction_12p5km_LatLonGrid_subset.nc', 'w') as ds:
+        ds.createDimension('y', lead_shape[0])
+        ds.createDimension('x', lead_shape[1])
+        ds.createVariable('lat', 'f4', ('y', 'x'))[:] = lat
+        ds.createVariable('lon', 'f4', ('y', 'x'))[:] = lon
+
+    for date in dates:
+        with nc.Dataset(f'{directory}data/LeadFraction_12p5km_{date[:4]}_{date[4:]}.nc', 'w') as ds:
+            ds.createDimension('y', lead_shape[0])
+            ds.createDimension('x', lead_shape[1])
+            lead = ds.createVariable('Lead Fraction', 'f4', ('y', 'x'), fill_value=-999.)
+            frac = rng.beta(.5, 8, lead_shape).astype(np.float32)
+            frac[rng.random(lead_shape) < .3] = np.nan   # clouds
+            lead[:] = np.ma.masked_where(~ocean | np.isnan(frac), frac)
+
+
+def write_cyc_sic_fixtures(rng, dates, ocean):
+    # remapped cyclone occurrence and SIC, one time step per day at 09:00, flattened grid like the remapped files
+    n = lead_shape[0] * lead_shape[1]
+    with nc.Dataset('./data/CO_2_remapbil.nc', 'w') as ds_cyc, \
+            nc.Dataset('./data/ERA5_SIC_2000_2019_remapbil.nc', 'w') as ds_sic:
+        for ds, name in [(ds_cyc, 'cyclone_occurence'), (ds_sic, 'siconc')]:
+            time_variable(ds, dates, 'hours since 1900-01-01 00:00:00', [9])
+            ds.createDimension('ncells', n)
+            ds.createVariable(name, 'f4', ('time', 'ncells'), fill_value=-32767.)
+
+        for t in range(len(dates)):
+            cyc = np.round(4 * smooth_field(rng, lead_shape) ** 3) / 4
+            ds_cyc['cyclone_occurence'][t] = cyc.ravel()
+            sic = np.clip(.85 + .2 * smooth_field(rng, lead_shape), 0, 1)
+            ds_sic['siconc'][t] = np.ma.masked_where(~ocean, sic).ravel()
+
+
+def write_drift_fixtures(rng, dates, ocean):
+    # EUMETSAT drift on the 62.5 km grid (one file per day) and the same drift remapped to the lead grid
+    directory, remap_directory = './data/ice drift/Eumetsat/2010-2022/', './data/ice drift/Eumetsat/2010-2022-remapbil/'
+    os.makedirs(directory, exist_ok=True)
+    os.makedirs(remap_directory, exist_ok=True)
+    lon, lat, xc, yc = polar_stereo_lonlat(eumetsat_shape, 62.5)
+
+    for date in dates:
+        dt_date = dt_from_string(date, 12)
+        date_p2 = (dt_date + datetime.timedelta(days=2)).strftime('%Y%m%d')
+        with nc.Dataset(f'{directory}ice_drift_nh_polstere-625_multi-oi_{date}1200-{date_p2}1200.nc', 'w') as ds:
+            ds.product_version = 1.4
+            ds.createDimension('time', 1)
+            ds.createDimension('yc', eumetsat_shape[0])
+            ds.createDimension('xc', eumetsat_shape[1])
+            t = ds.createVariable('time', 'f8', ('time',))
+            t.units = 'seconds since 1978-01-01 00:00:00'
+            t[:] = (dt_date + datetime.timedelta(days=1) - datetime.datetime(1978, 1, 1)).total_seconds()
+            ds.createVariable('xc', 'f4', ('xc',))[:] = xc
+            ds.createVariable('yc', 'f4', ('yc',))[:] = yc
+            ds.createVariable('lon', 'f4', ('yc', 'xc'))[:] = lon
+            ds.createVariable('lat', 'f4', ('yc', 'xc'))[:] = lat
+            for var in ['dX', 'dY']:
+                disp = 20 * (smooth_field(rng, eumetsat_shape) - .5)
+                ds.createVariable(var, 'f4', ('time', 'yc', 'xc'), fill_value=-1.e10)[0] = \
+                    np.ma.masked_where(lat < 65, disp)
+
+        date_m1 = (dt_date - datetime.timedelta(days=1)).strftime('%Y%m%d')
+        date_p1 = (dt_date + datetime.timedelta(days=1)).strftime('%Y%m%d')
+        with nc.Dataset(f'{remap_directory}remapbil_ice_drift_nh_polstere-625_multi-oi_{date_m1}1200-{date_p1}1200.nc',
+                        'w') as ds:
+            ds.createDimension('time', 1)
+            ds.createDimension('ncells', lead_shape[0] * lead_shape[1])
+            for var in ['dX', 'dY']:
+                disp = 20 * (smooth_field(rng, lead_shape) - .5)
+                ds.createVariable(var, 'f4', ('time', 'ncells'), fill_value=-1.e10)[0] = \
+                    np.ma.masked_where(~ocean, disp).ravel()
+
+
+def write_ice_budget_fixtures(rng, dates):
+    # 6-hourly SIC and daily drift on the 62.5 km grid as read by budgets.IceData
+    _, lat, xc, yc = polar_stereo_lonlat(eumetsat_shape, 62.5)
+    months = sorted(set(d[:6] for d in dates))
+    month_ends = [(dt_from_string(m + '01') + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+                  for m in months]
+
+    for path, hours, time_dates in [('./data/ERA5_METAs_remapbil_drift.nc', [0, 6, 12, 18], dates),
+                                    ('./data/ERA5_METAw_remapbil_drift.nc', [0, 6, 12, 18], dates),
+                                    ('./data/ERA5_avg_METAs_remapbil_drift.nc', [18], [d.strftime('%Y%m%d') for d in month_ends]),
+                                    ('./data/ERA5_avg_METAw_remapbil_drift.nc', [18], [d.strftime('%Y%m%d') for d in month_ends])]:
+        with nc.Dataset(path, 'w') as ds:
+            time_variable(ds, time_dates, 'hours since 1900-01-01 00:00:00', hours)
+            ds.createDimension('yc', eumetsat_shape[0])
+            ds.createDimension('xc', eumetsat_shape[1])
+            ds.createVariable('xc', 'f4', ('xc',))[:] = xc
+            ds.createVariable('yc', 'f4', ('yc',))[:] = yc
+            siconc = ds.createVariable('siconc', 'f4', ('time', 'yc', 'xc'), fill_value=-32767.)
+            for t in range(len(time_dates) * len(hours)):
+                siconc[t] = np.ma.masked_where(lat < 60, np.clip(.8 + .3 * smooth_field(rng, eumetsat_shape), 0, 1))
+
+    for path, time_dates, hour in [('./data/drift_combined.nc', date_list(dates[0], len(dates) + 1), 12),
+                                   ('./data/drift_maverage.nc', [d.strftime('%Y%m%d') for d in month_ends], 12)]:
+        with nc.Dataset(path, 'w') as ds:
+            # drift_combined.nc is indexed with noon of the day before the date
+            shifted = [(dt_from_string(d) - datetime.timedelta(days=1)).strftime('%Y%m%d') for d in time_dates] \
+                if path.endswith('combined.nc') else time_dates
+            time_variable(ds, shifted, 'hours since 1900-01-01 00:00:00', [hour])
+            ds.createDimension('yc', eumetsat_shape[0])
+            ds.createDimension('xc', eumetsat_shape[1])
+            for var in ['dX', 'dY']:
+                v = ds.createVariable(var, 'f4', ('time', 'yc', 'xc'), fill_value=-1.e10)
+                for t in range(len(shifted)):
+                    v[t] = np.ma.masked_where(lat < 65, 20 * (smooth_field(rng, eumetsat_shape) - .5))
+
+
+def write_era5_fixtures(rng, dates):
+    # 6-hourly ERA5 on the regular 0.25 deg grid
+    with nc.Dataset('./data/ERA5_METAs.nc', 'w') as ds:
+        time_variable(ds, dates, 'hours since 1900-01-01 00:00:00', [0, 6, 12, 18])
+        ds.createDimension('latitude', era5_shape[0])
+        ds.createDimension('longitude', era5_shape[1])
+        ds.createVariable('latitude', 'f4', ('latitude',))[:] = np.linspace(90, 50, era5_shape[0])
+        ds.createVariable('longitude', 'f4', ('longitude',))[:] = np.arange(era5_shape[1]) * .25
+        for var, offset, scale in [('msl', 98000, 5000), ('u10', -15, 30), ('v10', -15, 30)]:
+            v = ds.createVariable(var, 'f4', ('time', 'latitude', 'longitude'))
+            for t in range(4 * len(dates)):
+                v[t] = offset + scale * smooth_field(rng, era5_shape)
+
+
+def write_fixtures(fixture_dir, n_days, seed=0):
+    # Write all fixtures for n_days starting at start_date. Existing fixtures with enough days are reused.
+    stamp = os.path.join(fixture_dir, 'fixtures.json')
+    if os.path.isfile(stamp):
+        with open(stamp) as f:
+            if json.load(f)['n_days'] >= n_days:
+                return
+
+    cwd = os.getcwd()
+    os.makedirs(fixture_dir, exist_ok=True)
+    os.chdir(fixture_dir)
+    try:
+        rng = np.random.default_rng(seed)
+        # a week before start_date for the cyclone history of Analysis.delta_days and the drift files
+        dates = date_list((dt_from_string(start_date) - datetime.timedelta(days=7)).strftime('%Y%m%d'), n_days + 8)
+        _, lat, _, _ = polar_stereo_lonlat(lead_shape, 12.5)
+        ocean = lat > 65
+
+        print('writing lead fixtures')
+        write_lead_fixtures(rng, dates, ocean)
+        print('writing cyclone and sic fixtures')
+        write_cyc_sic_fixtures(rng, dates, ocean)
+        print('writing drift fixtures')
+        write_drift_fixtures(rng, dates, ocean)
+        print('writing ice budget fixtures')
+        write_ice_budget_fixtures(rng, dates)
+        print('writing ERA5 fixtures')
+        write_era5_fixtures(rng, dates)
+        for directory in ['./pickles', './plots/ice divergence', './plots/analysis']:
+            os.makedirs(directory, exist_ok=True)
+    finally:
+        os.chdir(cwd)
+
+    with open(stamp, 'w') as f:
+        json.dump({'n_days': n_days, 'start_date': start_date, 'seed': seed}, f)
+
+
+def coastlines_available():
+    # plot benchmarks need the Natural Earth coastlines in the cartopy cache, they are skipped otherwise (offline)
+    import cartopy
+    path = os.path.join(cartopy.config['data_dir'], 'shapefiles', 'natural_earth', 'physical', 'ne_50m_coastline.shp')
+    return os.path.isfile(path)
+
+
+# benchmarks, every function gets the list of dates and runs one hot path for them
+def bench_collect_leads_cycs(dates):
+    import lead_cyc_analysis
+    lead_cyc_analysis.Analysis(dates[0], dates[-1]).collect_leads_cycs()
+
+
+def bench_cluster_leads(dates):
+    import lead_cyc_analysis
+    lead_cyc_analysis.Analysis(dates[0], dates[-1]).cluster_leads()
+
+
+def bench_get_budgets(dates):
+    import budgets
+    budgets.IceData().get_budgets(dates[0], dates[-1])
+
+
+def bench_eumetsat_ice_div(dates):
+    import ice_divergence
+    import case_information as ci
+    E = ice_divergence.Eumetsat(ci.arctic_extent)
+    for date in dates:
+        E.ice_div(date)
+
+
+def bench_era5_daily_mean(dates):
+    import leads
+    msl = leads.Era5('msl')
+    for date in dates:
+        msl.get_variable(date)
+
+
+def bench_plot_div(dates):
+    import ice_divergence
+    import case_information as ci
+    ice_divergence.Eumetsat(ci.arctic_extent).plot_div(dates)
+
+
+benchmarks = {'collect_leads_cycs': bench_collect_leads_cycs, 'cluster_leads': bench_cluster_leads,
+              'get_budgets': bench_get_budgets, 'eumetsat_ice_div': bench_eumetsat_ice_div,
+              'era5_daily_mean': bench_era5_daily_mean, 'plot_div': bench_plot_div}
+# plots are expensive, they only run for the smallest size
+plot_benchmarks = ['plot_div']
+
+
+class _Quiet:
+    # the modules report progress with print, keep the benchmark output readable
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def measure(func, dates, repeat=1):
+    # An untraced first run warms up imports, the data catalog and the file cache. Then the peak of traced memory
+    # (numpy allocations included) of one run and the best wall time of repeat runs are measured.
+    with _Quiet():
+        func(dates)
+
+    tracemalloc.start()
+    with _Quiet():
+        func(dates)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        with _Quiet():
+            t0 = time.perf_counter()
+            func(dates)
+            times.append(time.perf_counter() - t0)
+
+    return {'time': min(times), 'peak_mb': peak / 2 ** 20}
+
+
+def compare(results, baselines, time_tol=.2, mem_tol=.1, min_delta=.05):
+    # List of regressions against the baseline. Times are compared with a relative tolerance of time_tol, differences
+    # below min_delta seconds are timer noise. Results without a baseline are reported, not compared.
+    regressions, missing = [], []
+    for name, sizes in results.items():
+        for size, res in sizes.items():
+            base = baselines.get(name, {}).get(size)
+            if not base:
+                missing.append(f'{name} ({size} days)')
+                continue
+            if res['time'] > base['time'] * (1 + time_tol) and res['time'] - base['time'] > min_delta:
+                regressions.append(f'{name} ({size} days): time {res["time"]:.2f}s vs. baseline {base["time"]:.2f}s')
+            if res['peak_mb'] > base['peak_mb'] * (1 + mem_tol):
+                regressions.append(f'{name} ({size} days): memory {res["peak_mb"]:.1f}MB vs. '
+                                   f'baseline {base["peak_mb"]:.1f}MB')
+    if missing:
+        print(f'no baseline for {", ".join(missing)}, not compared (store one with --save-baseline)')
+    return regressions
+
+
+def run(sizes=None, only=None, fixture_dir=default_fixture_dir, repeat=1, save_baseline=False, time_tol=.2,
+        mem_tol=.1):
+    sizes = sorted(sizes if sizes else default_sizes)
+    names = only if only else list(benchmarks)
+    if 'plot_div' in names and not coastlines_available():
+        print('Natural Earth coastlines are not cached, skip plot benchmarks')
+        names = [n for n in names if n not in plot_benchmarks]
+
+    write_fixtures(fixture_dir, max(sizes))
+    cwd = os.getcwd()
+    os.chdir(fixture_dir)
+    results = {}
+    try:
+        for name in names:
+            results[name] = {}
+            for size in (sizes[:1] if name in plot_benchmarks else sizes):
+                res = measure(benchmarks[name], date_list(start_date, size), repeat)
+                results[name][str(size)] = res
+                print(f'{name:<22} {size:>4} days {res["time"]:>9.2f} s {res["peak_mb"]:>9.1f} MB')
+    finally:
+        os.chdir(cwd)
+
+    baselines = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            baselines = json.load(f)
+    elif not save_baseline:
+        print(f'no baseline file {baseline_path}, nothing is compared (store one with --save-baseline)')
+
+    if save_baseline:
+        for name, res in results.items():
+            baselines.setdefault(name, {}).update(res)
+        with open(baseline_path, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f'saved baseline to {baseline_path}')
+        return results, []
+
+    regressions = compare(results, baselines, time_tol, mem_tol)
+    for regression in regressions:
+        print('REGRESSION:', regression)
+    return results, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks with synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='date range sizes in days')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks), help='run only these benchmarks')
+    parser.add_argument('--fixtures', default=default_fixture_dir, help='directory of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--time-tol', type=float, default=.2, help='allowed relative slow down')
+    parser.add_argument('--mem-tol', type=float, default=.1, help='allowed relative increase of peak memory')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    _, found = run(args.sizes, args.only, os.path.abspath(args.fixtures), args.repeat, args.save_baseline,
+                   args.time_tol, args.mem_tol)
+    sys.exit(1 if found else 0)
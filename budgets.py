@@ -9,7 +9,12 @@ import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import case_information as ci
 import plot
+import precision
+import prefetch
+import profiling
+import regions
 from calendar import monthrange
+from functools import partial
 from pandas import date_range
 
 
@@ -17,6 +22,12 @@ def max_matrix(cap, M):
     return max(cap, abs(np.nanmin(M)), np.nanmax(M))
 
 
+def load_budget_day(ice_data, day):
+    # sic (and drift) of a (date, with_drift) pair, read by the prefetch worker with its own IceData
+    date, with_drift = day
+    return ice_data.get_variable(date, 'siconc'), ice_data.get_drift(date) if with_drift else None
+
+
 class IceData:
     def __init__(self, extent=ci.arctic_extent):
         self.ds_spring = nc.Dataset('./data/ERA5_METAs_remapbil_drift.nc')
@@ -27,6 +38,8 @@ class IceData:
         self.ds_drift_monthly = nc.Dataset('./data/drift_maverage.nc')
 
         self.extent = extent
+        # only the box of the extent is read from the drift grid files (NaN outside), planned once per extent
+        self.region = regions.region('drift', extent, pad=2)
         self.nrows, self.ncols = 2, 4
         self.time = None
         self.xc = 1000 * self.ds_spring['xc'][:]
@@ -36,6 +49,7 @@ class IceData:
 
         self.advs, self.divs, self.ints, self.ress = [], [], [], []
         self.adv_cap, self.div_cap, self.int_cap, self.res_cap = 0, 0, 0, 0
+        self.prefetch_days = 4
 
     def get_variable(self, date, variable='siconc'):
         data_set = None
@@ -46,16 +60,15 @@ class IceData:
         elif d1.year == 2020:
             data_set = self.ds_spring
 
-        self.time = data_set['time']
-        var = data_set[variable][:]
-        t1, t2 = cftime.date2index([d1, d2], self.time)  # cftime nows unit from ds
-
-        mean_var = np.zeros(var[0].shape)
-        for t in range(t1, t2 + 1):
-            mean_var += var[t]
+        with profiling.span('IceData read variable', 'io'):
+            self.time = data_set['time']
+            t1, t2 = cftime.date2index([d1, d2], self.time)  # cftime nows unit from ds
+            # only the time steps of date are read
+            var = regions.read(data_set[variable], slice(t1, t2 + 1), self.region)
 
+        mean_var = np.sum(var, axis=0, dtype=precision.acc_dtype)
         mean_var[mean_var < 0.0] = np.nan
-        return .25 * mean_var
+        return precision.as_data(.25 * mean_var)
 
     def get_drift(self, date):
         d1 = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 12, 0, 0, 0) - datetime.timedelta(days=1)
@@ -63,7 +76,10 @@ class IceData:
         t1 = cftime.date2index(d1, self.time)
 
         # return drift speed in m/s
-        return 1000 * self.ds_drift['dX'][t1] / 172800, 1000 * self.ds_drift['dY'][t1] / 172800
+        with profiling.span('IceData read drift', 'io'):
+            dX = regions.read(self.ds_drift['dX'], t1, self.region)
+            dY = regions.read(self.ds_drift['dY'], t1, self.region)
+        return 1000 * dX / 172800, 1000 * dY / 172800
 
     def get_monthly(self, month, year):
         ds = None
@@ -76,13 +92,13 @@ class IceData:
             ds = self.ds_winter_monthly
 
         t_sic = cftime.date2index(datetime.datetime(year, month, day, 18, 0, 0), ds['time'])
-        siconc = ds['siconc'][t_sic]
+        siconc = regions.read(ds['siconc'], t_sic, self.region)
+        dX = regions.read(self.ds_drift_monthly['dX'], t, self.region)
+        dY = regions.read(self.ds_drift_monthly['dY'], t, self.region)
+        # the averaged drift marks missing values with -1e10 without declaring it as fill value
+        dX[dX == -10000000000.0], dY[dY == -10000000000.0] = np.nan, np.nan
 
-        siconc[siconc == -32767] = np.nan
-        self.ds_drift_monthly['dX'][t][self.ds_drift_monthly['dX'][t] == -10000000000.0] = np.nan
-        self.ds_drift_monthly['dY'][t][self.ds_drift_monthly['dY'][t] == -10000000000.0] = np.nan
-
-        return 1000 * self.ds_drift_monthly['dX'][t] / 172800, 1000 * self.ds_drift_monthly['dY'][t] / 172800, siconc
+        return 1000 * dX / 172800, 1000 * dY / 172800, siconc
 
 
 
@@ -104,7 +120,7 @@ class IceData:
             fig, axs = self.setup_plot()
             for ax in axs:
                 for a in ax:
-                    print(dates[count])
+                    profiling.progress(dates[count], len(dates))
                     im = a.pcolormesh(self.xc, self.yc, self.get_variable(dates[count]), vmin=0, vmax=1,
                                       transform=ccrs.NorthPolarStereo(-45), cmap='viridis')
                     a.set_title(str(ds.string_time_to_datetime(dates[count])), fontsize=20)
@@ -163,18 +179,24 @@ class IceData:
     def get_budgets(self, date1, date2):
         dates = ds.time_delta(date1, date2)
 
-        for date1, date2 in zip(dates[:-1], dates[1:]):
-            C1, C2 = self.get_variable(date1, 'siconc'), self.get_variable(date2, 'siconc')
-            ux, uy = self.get_drift(date2)
-
-            self.advs.append(self.advection(ux, uy, C2))
-            self.adv_cap = max_matrix(self.adv_cap, self.advs[-1])
-            self.divs.append(self.divergence(ux, uy, C2))
-            self.div_cap = max_matrix(self.div_cap, self.divs[-1])
-            self.ints.append(self.intensification(C1, C2))
-            self.int_cap = max_matrix(self.int_cap, self.ints[-1])
-            self.ress.append(self.ints[-1] - self.advs[-1] - self.divs[-1])
-            self.res_cap = max_matrix(self.res_cap, self.ress[-1])
+        # sic and drift of the next days are read ahead in a background process, every sic field is read once
+        # the drift of the first day is not needed
+        days = prefetch.prefetch([(dates[0], False)] + [(date, True) for date in dates[1:]], load_budget_day,
+                                 setup=partial(IceData, self.extent), ahead=self.prefetch_days)
+        _, (C2, _) = next(days)
+        for (date2, _), (C, (ux, uy)) in days:
+            C1, C2 = C2, C
+
+            with profiling.span('budget stencils', 'compute'):
+                self.advs.append(self.advection(ux, uy, C2))
+                self.adv_cap = max_matrix(self.adv_cap, self.advs[-1])
+                self.divs.append(self.divergence(ux, uy, C2))
+                self.div_cap = max_matrix(self.div_cap, self.divs[-1])
+                self.ints.append(self.intensification(C1, C2))
+                self.int_cap = max_matrix(self.int_cap, self.ints[-1])
+                self.ress.append(self.ints[-1] - self.advs[-1] - self.divs[-1])
+                self.res_cap = max_matrix(self.res_cap, self.ress[-1])
+            profiling.tick(date2, len(dates) - 1)
 
         return dates[1:]
 
@@ -197,7 +219,7 @@ class IceData:
                     if once:
                         months.append(int(month))
                     month = c_month
-                    monthly_avg.append(np.nanmean(np.array(buffer), axis=0))
+                    monthly_avg.append(precision.nanmean(precision.stack(buffer), axis=0))
                     buffer = []
                     buffer.append(var[i])
 
@@ -208,8 +230,10 @@ class IceData:
         return months
 
     def plot_budgets(self, date1, date2, monthly=False, average=False):
-        dates = self.get_budgets(date1, date2)
+        self.plot_budget_maps(self.get_budgets(date1, date2), monthly)
 
+    def plot_budget_maps(self, dates, monthly=False):
+        # maps of the budgets in self.advs, self.divs, ... of dates, two days per figure
         if monthly:
             dates = self.monthly_average(dates)
 
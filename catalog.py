@@ -0,0 +1,126 @@
+# Catalog of the available input data. All sources are scanned once and the per date availability is stored, so that
+# loops can skip (or mask) missing days up front instead of finding out by a failing nc.Dataset call.
+import datetime
+import os
+import pickle
+import cftime
+import netCDF4 as nc
+
+# paths of the multi year data used in leads.LeadAllY
+lead_dir = './data/DailyArcticLeadFraction_12p5km_Rheinlaender/data/'
+cyc_path = './data/CO_2_remapbil.nc'
+sic_path = './data/ERA5_SIC_2000_2019_remapbil.nc'
+drift_dir = './data/ice drift/Eumetsat/2010-2022-remapbil/'
+# lead data of the winter 2019/2020 used in leads.Lead
+lead_2020_dir = './data/leads/'
+
+catalog_path = './pickles/data_catalog.pkl'
+
+
+def shift_date(date, days):
+    dt_date = datetime.date(int(date[:4]), int(date[4:6]), int(date[6:])) + datetime.timedelta(days=days)
+    return f'{dt_date.year}{str(dt_date.month).zfill(2)}{str(dt_date.day).zfill(2)}'
+
+
+def lead_path(date):
+    return f'{lead_dir}LeadFraction_12p5km_{date[:4]}_{date[4:]}.nc'
+
+
+def drift_path(date):
+    # drift files cover 48h from noon of the day before to noon of the day after date
+    return f'{drift_dir}remapbil_ice_drift_nh_polstere-625_multi-oi_{shift_date(date, -1)}1200-{shift_date(date, 1)}1200.nc'
+
+
+def lead_2020_path(date):
+    return f'{lead_2020_dir}{date}.nc'
+
+
+def _time_stamp(path):
+    # modification time of a file or directory, None if it does not exist
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class DataCatalog:
+    _instance = None
+    sources = ['lead', 'cyc', 'sic', 'drift', 'lead_2020']
+
+    def __init__(self, path=catalog_path, rescan=False):
+        self.path = path
+        self.dates = {source: set() for source in self.sources}
+        self.stamps = None
+
+        if not rescan and os.path.isfile(path):
+            with open(path, 'rb') as pickle_in:
+                self.dates, self.stamps = pickle.load(pickle_in)
+
+        # scan again if any of the sources changed since the catalog was written
+        if self.stamps != self.current_stamps():
+            self.scan()
+
+    @classmethod
+    def get(cls):
+        # catalog shared by all loaders of this process
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def current_stamps():
+        return [_time_stamp(p) for p in [lead_dir, cyc_path, sic_path, drift_dir, lead_2020_dir]]
+
+    @staticmethod
+    def _list_dir(directory):
+        try:
+            return os.listdir(directory)
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _time_axis(path, hour=9):
+        # dates that have a time step at the given hour, this is the time step leads.LeadAllY picks
+        try:
+            time = nc.Dataset(path)['time']
+        except FileNotFoundError:
+            return set()
+        dt_dates = cftime.num2date(time[:], time.units, getattr(time, 'calendar', 'standard'))
+        return {f'{d.year}{str(d.month).zfill(2)}{str(d.day).zfill(2)}' for d in dt_dates if d.hour == hour}
+
+    def scan(self):
+        print('scanning data sources')
+        # LeadFraction_12p5km_2015_0101.nc
+        self.dates['lead'] = {f[20:24] + f[25:29] for f in self._list_dir(lead_dir)
+                              if f.startswith('LeadFraction_12p5km_') and len(f) == 32}
+        self.dates['cyc'] = self._time_axis(cyc_path)
+        self.dates['sic'] = self._time_axis(sic_path)
+        # remapbil_ice_drift_nh_polstere-625_multi-oi_201712311200-201801021200.nc, stored under the middle date
+        prefix = 'remapbil_ice_drift_nh_polstere-625_multi-oi_'
+        self.dates['drift'] = {shift_date(f[len(prefix):len(prefix) + 8], 1) for f in self._list_dir(drift_dir)
+                               if f.startswith(prefix) and f.endswith('.nc')}
+        self.dates['lead_2020'] = {f[:8] for f in self._list_dir(lead_2020_dir) if len(f) == 11 and f[:8].isdigit()}
+        self.stamps = self.current_stamps()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as filehandler:
+            pickle.dump((self.dates, self.stamps), filehandler)
+
+    def available(self, date, *sources):
+        # True if date is available in all given sources
+        return all(date in self.dates[source] for source in sources)
+
+    def missing(self, dates, *sources):
+        return [date for date in dates if not self.available(date, *sources)]
+
+    def filter(self, dates, *sources):
+        return [date for date in dates if self.available(date, *sources)]
+
+
+if __name__ == '__main__':
+    # import data_science as ds
+    # dates = ds.time_delta('20021101', '20220430')
+    # C = DataCatalog(rescan=True)
+    # for source in C.sources:
+    #     print(source, len(C.missing(dates, source)))
+    pass
@@ -0,0 +1,224 @@
+# Day of year climatologies. The record is streamed once, every day is added to per pixel sums, sums of squares and
+# counts of its day of year (366 days, 29 February has its own row). The accumulators are memmaps in ./pickles, so
+# they neither have to fit into memory nor get lost with the process. Mean and standard deviation are derived from them
+# afterwards, optionally smoothed with a running window over the days of the year (wrapping around the year end).
+# Anomalies then only need one row of the mean (and std) memmap per day. When new days arrive, Climatology.extend adds
+# only those days to the accumulators and refreshes mean and standard deviation.
+#
+#   clim = Climatology.get('lead_ally', 'leads')
+#   anomaly = clim.anomaly(leads.LeadAllY(date).lead_data, date, standardise=True)
+#   siconc_anomaly = AnomalyLoader(leads.Era5('siconc').get_variable, 'era5', 'siconc')(date)
+import datetime
+import os
+import pickle
+import cftime
+import numpy as np
+from scipy import ndimage
+import catalog
+import data_science as ds
+import leads
+import profiling
+
+n_days = 366
+
+
+def doy_index(date):
+    # row of date, the position of its month and day in a leap year
+    return (datetime.date(2000, int(date[4:6]), int(date[6:])) - datetime.date(2000, 1, 1)).days
+
+
+def prefix(name, field, path='./pickles'):
+    return f'{path}/climatology_{name}_{field}'
+
+
+def stored_meta(name, field, path='./pickles'):
+    # dates (and smoothing) of the accumulators of (name, field), empty if there are none
+    p = prefix(name, field, path)
+    if not os.path.isfile(f'{p}_meta.pkl'):
+        return {}
+    with open(f'{p}_meta.pkl', 'rb') as pickle_in:
+        return pickle.load(pickle_in)
+
+
+def accumulate(name, items, path='./pickles', extend=False):
+    # items: iterable of (date, {field: 2d array}), e.g. a generator over the record. Adds every day to the memmap
+    # accumulators of its fields, returns the field names. extend=True adds to existing accumulators and skips the days
+    # they already contain.
+    acc, dates, skip = {}, [], {}
+    for date, fields in items:
+        d = doy_index(date)
+        for field, data in fields.items():
+            if field not in acc:
+                p = prefix(name, field, path)
+                if extend and os.path.isfile(f'{p}_counts.npy'):
+                    acc[field] = [np.load(f'{p}_{kind}.npy', mmap_mode='r+') for kind in ['sums', 'sqsums', 'counts']]
+                    skip[field] = set(stored_meta(name, field, path)['dates'])
+                else:
+                    acc[field] = [np.lib.format.open_memmap(f'{p}_{kind}.npy', mode='w+', dtype=dtype,
+                                                            shape=(n_days,) + data.shape)
+                                  for kind, dtype in [('sums', np.float64), ('sqsums', np.float64),
+                                                      ('counts', np.int32)]]
+                    skip[field] = set()
+            if date in skip[field]:
+                continue
+            sums, sqsums, counts = acc[field]
+            data = np.asarray(data, dtype=np.float64)
+            valid = ~np.isnan(data)
+            np.add(sums[d], data, out=sums[d], where=valid)
+            np.add(sqsums[d], data ** 2, out=sqsums[d], where=valid)
+            counts[d] += valid
+        profiling.progress(date)
+        dates.append(date)
+
+    for field, arrays in acc.items():
+        for array in arrays:
+            array.flush()
+        meta = dict(stored_meta(name, field, path) if extend else {}, dates=sorted(skip[field] | set(dates)))
+        with open(f'{prefix(name, field, path)}_meta.pkl', 'wb') as filehandler:
+            pickle.dump(meta, filehandler)
+    return list(acc)
+
+
+def finalize(name, field, smoothing=0, path='./pickles', rows=16):
+    # Mean and standard deviation per day of year from the accumulators. smoothing: half width in days of the running
+    # window, sums and counts are smoothed before dividing. Done in slabs of rows grid rows.
+    p = prefix(name, field, path)
+    sums, sqsums, counts = [np.load(f'{p}_{kind}.npy', mmap_mode='r') for kind in ['sums', 'sqsums', 'counts']]
+    mean = np.lib.format.open_memmap(f'{p}_mean.npy', mode='w+', dtype=np.float32, shape=sums.shape)
+    std = np.lib.format.open_memmap(f'{p}_std.npy', mode='w+', dtype=np.float32, shape=sums.shape)
+
+    for r in range(0, sums.shape[1], rows):
+        s, sq, n = [np.array(a[:, r:r + rows], dtype=np.float64) for a in [sums, sqsums, counts]]
+        if smoothing:
+            # sums of the window instead of the mean of the window, so days with few counts get less weight
+            s, sq, n = [ndimage.uniform_filter1d(a, 2 * smoothing + 1, axis=0, mode='wrap') * (2 * smoothing + 1)
+                        for a in [s, sq, n]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m = s / n
+            var = (sq - s * m) / (n - 1)
+        m[n < .5] = np.nan
+        var[n < 1.5] = np.nan
+        mean[:, r:r + rows] = m
+        std[:, r:r + rows] = np.sqrt(np.maximum(var, 0))
+
+    mean.flush()
+    std.flush()
+    with open(f'{p}_meta.pkl', 'rb') as pickle_in:
+        meta = pickle.load(pickle_in)
+    meta['smoothing'] = smoothing
+    with open(f'{p}_meta.pkl', 'wb') as filehandler:
+        pickle.dump(meta, filehandler)
+
+
+def lead_ally_items(date1='20021101', date2='20220430', skip=()):
+    # lead fraction, cyclone occurrence, sic and drift divergence of the LeadAllY grid, days in skip are not read
+    for date in catalog.DataCatalog.get().filter(ds.time_delta(date1, date2), 'lead', 'cyc', 'sic'):
+        if date in skip:
+            continue
+        leadally = leads.LeadAllY(date)
+        yield date, {'leads': leadally.lead_data, 'cycs': leadally.cyc_data, 'sic': leadally.sic_data,
+                     'divs': leadally.ice_div.T}
+
+
+def era5_items(variables=('siconc', 'wind'), skip=()):
+    # daily means of the ERA5 variables for the whole time axis of the file
+    data_sets = {variable: leads.era5(variable) for variable in variables}
+    time = data_sets[variables[0]].time
+    first, last = [f'{d.year}{str(d.month).zfill(2)}{str(d.day).zfill(2)}'
+                   for d in cftime.num2date(time[[0, -1]], time.units, getattr(time, 'calendar', 'standard'))]
+    for date in ds.time_delta(first, last):
+        if date not in skip:
+            yield date, {variable: data_set.get_variable(date) for variable, data_set in data_sets.items()}
+
+
+def lead_change_items(skip=()):
+    # lead opening and closing of all 2020 lead files, the day before the first new day is only read for its change
+    files = sorted(catalog.DataCatalog.get().dates['lead_2020'])
+    dates = ds.time_delta(files[0], files[-1])
+    new = [date for date in dates if date not in skip]
+    if not new:
+        return
+    include_first = new[0] == dates[0]
+    first = new[0] if include_first else catalog.shift_date(new[0], -1)
+    for date, opening, closing in leads.lead_changes(ds.time_delta(first, dates[-1]), include_first=include_first):
+        if date not in skip:
+            yield date, {'opening': opening, 'closing': closing}
+
+
+# all fields of a source are accumulated in the same pass
+sources = {'lead_ally': lead_ally_items, 'era5': era5_items, 'lead_2020': lead_change_items}
+source_fields = {'lead_ally': ['leads', 'cycs', 'sic', 'divs'], 'era5': ['siconc', 'wind'],
+                 'lead_2020': ['opening', 'closing']}
+
+
+class Climatology:
+    _instances = {}
+
+    def __init__(self, name, field, path='./pickles'):
+        p = prefix(name, field, path)
+        with open(f'{p}_meta.pkl', 'rb') as pickle_in:
+            meta = pickle.load(pickle_in)
+        self.dates, self.smoothing = meta['dates'], meta.get('smoothing', 0)
+        self.mean = np.load(f'{p}_mean.npy', mmap_mode='r')
+        self.std = np.load(f'{p}_std.npy', mmap_mode='r')
+
+    @staticmethod
+    def exists(name, field, path='./pickles'):
+        return os.path.isfile(f'{prefix(name, field, path)}_mean.npy')
+
+    @staticmethod
+    def build(name, smoothing=7, path='./pickles'):
+        # stream the record of a source once and finalize all of its fields
+        for field in accumulate(name, sources[name](), path):
+            finalize(name, field, smoothing, path)
+
+    @classmethod
+    def extend(cls, name, smoothing=None, path='./pickles', **kwargs):
+        # Add the days of the source that are not in the accumulators yet (kwargs, e.g. date2, go to the source) and
+        # refresh mean and standard deviation. smoothing: the one of the last build by default.
+        skip = set.intersection(*[set(stored_meta(name, f, path).get('dates', [])) for f in source_fields[name]])
+        for field in accumulate(name, sources[name](skip=skip, **kwargs), path, extend=True):
+            finalize(name, field, smoothing if smoothing is not None else
+                     stored_meta(name, field, path).get('smoothing', 7), path)
+            cls._instances.pop((name, field), None)
+
+    @classmethod
+    def get(cls, name, field, smoothing=7):
+        # climatology shared by all loaders of this process, built if necessary
+        if (name, field) not in cls._instances:
+            if not cls.exists(name, field):
+                print('could not find climatology \n try to create climatology')
+                cls.build(name, smoothing)
+            cls._instances[(name, field)] = cls(name, field)
+        return cls._instances[(name, field)]
+
+    def day(self, date):
+        # mean and standard deviation of the day of year of date
+        d = doy_index(date)
+        return np.array(self.mean[d]), np.array(self.std[d])
+
+    def anomaly(self, data, date, standardise=False):
+        mean, std = self.day(date)
+        if standardise:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return ((data - mean) / std).astype(data.dtype)
+        return (data - mean).astype(data.dtype)
+
+
+class AnomalyLoader:
+    def __init__(self, get, name, field, standardise=False):
+        # wraps a loader get(date) -> field of the same grid as the climatology (name, field)
+        self.get = get
+        self.climatology = Climatology.get(name, field)
+        self.standardise = standardise
+
+    def __call__(self, date):
+        return self.climatology.anomaly(self.get(date), date, self.standardise)
+
+
+if __name__ == '__main__':
+    # Climatology.build('lead_ally')
+    # Climatology.build('era5')
+    # finalize('lead_ally', 'leads', smoothing=15)
+    # Climatology.extend('lead_ally', date2='20230430')
+    pass
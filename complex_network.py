@@ -1,20 +1,89 @@
-import leads
+# Climate networks on the lead grid. Every pixel is a node, two pixels are linked if the correlation of their daily
+# time series exceeds a threshold. The ~136k x 136k correlation matrix is never built: the time series of a field are
+# read tile by tile from its pixel store, standardised once and appended to a (pixels, time) memmap, then blocks of the
+# correlation matrix are formed from matrix products of the blocks and their valid masks (correlations over the common
+# valid days of two pixels) in a process pool and thresholded right away,
+# only the links are kept in a sparse adjacency matrix. The same blocks between two fields give the cross-network of
+# cyclone occurrence and lead fraction. EventSyncNetwork links pixels by the timing of events instead: a cyclone onset at
+# pixel i and a lead opening at pixel j within tau days.
+#
+#   net = CorrelationNetwork(OnlyLeadAllY('20191105', '20200430'), threshold=.5)
+#   net.build()
+#   net.plot_measures()
+import os
+import pickle
+import warnings
+from multiprocessing import Pool
 import netCDF4 as nc
+import numpy as np
+import scipy.sparse as sp
+from scipy.stats import binom
+import matplotlib.pyplot as plt
+import cartopy.crs as ccrs
+import case_information as ci
+import data_science as ds
+import leads
+import lead_cyc_analysis as lca
+import pixel_store as ps
 
 
 class OnlyLeadAllY:
-    def __init__(self):
-        pass
+    def __init__(self, date1, date2, sic_filter=95.):
+        # sic filtered lead fraction, NaN days and pixels are missing values
+        self.dates = ds.time_delta(date1, date2)
+        self.sic_filter = sic_filter
+        self.tag = f'leads_{sic_filter}'
+        self.fill_value = None
+
+    def store(self):
+        analysis = lca.Analysis(self.dates[0], self.dates[-1], collect_ice_div=False)
+        analysis.sic_filter = self.sic_filter
+        return analysis.pixel_store('leads')
+
+    @staticmethod
+    def detect_events(block, quantile=.9, min_increase=.1):
+        # lead openings: day to day increases of the lead fraction above the quantile of the pixel's increases
+        return exceedances(np.diff(block, axis=1, prepend=np.nan), quantile, min_increase)
 
 
 class DriftAllY:
-    def __init__(self):
-        pass
+    def __init__(self, date1, date2):
+        # ice divergence of the drift product
+        self.dates = ds.time_delta(date1, date2)
+        self.tag = 'divs'
+        self.fill_value = None
+
+    def store(self):
+        # extended by new days, see PixelStore.open
+        return ps.PixelStore.open({'divs': f'./pickles/pixel_store_divs_{self.dates[0]}'}, 'divs', self.dates,
+                                  ps.drift_fields)
+
+    @staticmethod
+    def detect_events(block, quantile=.9, min_increase=0.):
+        # strong divergence
+        return exceedances(block, quantile, min_increase)
 
 
 class CycAllY:
-    def __init__(self):
-        pass
+    def __init__(self, date1, date2, sic_filter=95.):
+        # cyclone occurrence as 1 (cyclone) / 0 (no cyclone)
+        self.dates = ds.time_delta(date1, date2)
+        self.sic_filter = sic_filter
+        self.tag = f'cycs_{sic_filter}'
+        self.fill_value = 0.
+
+    def store(self):
+        analysis = lca.Analysis(self.dates[0], self.dates[-1], collect_ice_div=False)
+        analysis.sic_filter = self.sic_filter
+        return analysis.pixel_store('cycs')
+
+    @staticmethod
+    def detect_events(block):
+        # cyclone onsets: first day of a cyclone passage at the pixel
+        present = block == 1
+        onset = present.copy()
+        onset[:, 1:] &= ~present[:, :-1]
+        return onset
 
 
 class CoordinateGridAllY:
@@ -24,4 +93,392 @@ class CoordinateGridAllY:
         ds_latlon = nc.Dataset(path_grid)
         # for remaped divergence this must be transposed
         self.lat = ds_latlon['lat'][:]
-        self.lon = ds_latlon['lon'][:]
\ No newline at end of file
+        self.lon = ds_latlon['lon'][:]
+
+
+def exceedances(block, quantile, minimum):
+    # (pixels, time) -> events where the value exceeds the pixel's quantile and minimum, NaN is never an event
+    with warnings.catch_warnings():
+        # pixels without data
+        warnings.simplefilter('ignore', RuntimeWarning)
+        threshold = np.maximum(np.nanquantile(block, quantile, axis=1), minimum)
+    with np.errstate(invalid='ignore'):
+        return block > threshold[:, None]
+
+
+def open_standardised(path):
+    # (pixels, time) memmap and flat grid indices of the pixels written by standardise
+    pixels = np.load(f'{path}_pixels.npy')
+    nt = os.path.getsize(f'{path}.dat') // (4 * max(pixels.size, 1))
+    return np.memmap(f'{path}.dat', dtype=np.float32, mode='r', shape=(pixels.size, nt)), pixels
+
+
+def standardise(store, path, fill_value=None, min_valid=.5):
+    # Write the time series of all usable pixels of a pixel store to '{path}.dat' (pixels, time), centred and scaled to
+    # unit norm over the valid days of the pixel, and their flat grid indices to '{path}_pixels.npy', one tile at a
+    # time. Missing values are set to fill_value first if given, otherwise they stay NaN: the correlation of two pixels
+    # is taken over their common days in _block_links, centring only keeps its sums well conditioned. Pixels with less
+    # than min_valid valid days or no variance are left out.
+    if os.path.isfile(f'{path}.dat') and os.path.isfile(f'{path}_pixels.npy'):
+        return open_standardised(path)
+
+    nt = len(store.dates)
+    pixels = []
+    with open(f'{path}.dat', 'wb') as out:
+        for rows, cols, block in store.tiles():
+            block = block.reshape(-1, nt)
+            if fill_value is not None:
+                block[np.isnan(block)] = fill_value
+            valid = ~np.isnan(block)
+            n = valid.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(valid, block, 0).sum(axis=1, dtype=np.float64) / n
+                anomaly = block - mean[:, None]
+                norm = np.sqrt(np.sum(np.where(valid, anomaly, 0) ** 2, axis=1, dtype=np.float64))
+            use = (n >= min_valid * nt) & (norm > 0)
+
+            grid_rows, grid_cols = np.meshgrid(np.arange(rows.start, rows.stop), np.arange(cols.start, cols.stop),
+                                               indexing='ij')
+            pixels.append(np.ravel_multi_index((grid_rows.ravel()[use], grid_cols.ravel()[use]), store.shape))
+            out.write((anomaly[use] / norm[use, None]).astype(np.float32).tobytes())
+
+    np.save(f'{path}_pixels.npy', np.concatenate(pixels))
+    return open_standardised(path)
+
+
+def pairwise_correlation(a, b, min_overlap):
+    # Pearson correlation of every row of a with every row of b over the days both rows are valid (not NaN), NaN for
+    # pairs with less than min_overlap common days. All sums over the common days are matrix products of the valid masks
+    # m and the zero filled data x.
+    m_a, m_b = ~np.isnan(a), ~np.isnan(b)
+    x_a, x_b = np.where(m_a, a, 0).astype(np.float64), np.where(m_b, b, 0).astype(np.float64)
+    if m_a.all() and m_b.all():
+        # no gaps: the rows are centred and of unit norm already
+        return x_a @ x_b.T
+    m_a, m_b = m_a.astype(np.float64), m_b.astype(np.float64)
+
+    n = m_a @ m_b.T
+    sx, sy = x_a @ m_b.T, m_a @ x_b.T
+    sxx, syy = (x_a ** 2) @ m_b.T, m_a @ (x_b ** 2).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = (n * (x_a @ x_b.T) - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    corr[n < min_overlap] = np.nan
+    return corr
+
+
+def _block_links(args):
+    # correlations of the row blocks a and b of the standardised memmaps, thresholded to (rows, cols, correlation)
+    path_a, path_b, block_a, block_b, threshold, absolute, upper, min_overlap = args
+    z_a, z_b = open_standardised(path_a)[0], open_standardised(path_b)[0]
+    corr = pairwise_correlation(np.asarray(z_a[block_a]), np.asarray(z_b[block_b]), min_overlap)
+    with np.errstate(invalid='ignore'):
+        links = np.abs(corr) >= threshold if absolute else corr >= threshold
+    if upper:
+        # diagonal block of a symmetric network, every pair once and no self links
+        links = np.triu(links, 1)
+    rows, cols = np.nonzero(links)
+    return (rows + block_a.start).astype(np.int32), (cols + block_b.start).astype(np.int32), corr[rows, cols]
+
+
+def correlation_links(path_a, n_a, path_b=None, n_b=None, threshold=.5, absolute=True, block=2048, processes=None,
+                      min_overlap=30):
+    # Sparse matrix of all correlations >= threshold between the rows of the standardised memmaps, pairs need
+    # min_overlap common valid days. Without path_b the network of a with itself (upper triangle blocks only,
+    # symmetrised at the end). Blocks of block x block correlations are computed in a process pool, the six dense
+    # sums of a block are the only large arrays of a worker.
+    symmetric = path_b is None
+    path_b, n_b = (path_a, n_a) if symmetric else (path_b, n_b)
+    blocks_a = [slice(i, min(i + block, n_a)) for i in range(0, n_a, block)]
+    blocks_b = [slice(j, min(j + block, n_b)) for j in range(0, n_b, block)]
+    tasks = [(path_a, path_b, a, b, threshold, absolute, symmetric and i == j, min_overlap)
+             for i, a in enumerate(blocks_a) for j, b in enumerate(blocks_b) if not symmetric or j >= i]
+
+    rows, cols, values = [], [], []
+
+    def collect(results):
+        for n, (r, c, v) in enumerate(results):
+            rows.append(r)
+            cols.append(c)
+            values.append(v)
+            if n % 100 == 0:
+                print(f'block {n + 1} of {len(tasks)}')
+
+    if processes == 1:
+        collect(map(_block_links, tasks))
+    else:
+        with Pool(processes) as pool:
+            collect(pool.imap_unordered(_block_links, tasks))
+
+    rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+    if symmetric:
+        rows, cols, values = np.concatenate([rows, cols]), np.concatenate([cols, rows]), np.concatenate([values, values])
+    return sp.csr_matrix((values, (rows, cols)), shape=(n_a, n_b))
+
+
+def great_circle(lon1, lat1, lon2, lat2):
+    # distance in km
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371. * np.arcsin(np.sqrt(a))
+
+
+class CorrelationNetwork:
+    def __init__(self, field, other=None, threshold=.5, absolute=True, block=2048, processes=None, min_overlap=30):
+        # field (and other for a cross-network) are OnlyLeadAllY, CycAllY or DriftAllY of the same dates. Two pixels are
+        # linked if their Pearson correlation over their common valid days reaches threshold and they share at least
+        # min_overlap days.
+        self.field, self.other = field, other
+        self.threshold, self.absolute = threshold, absolute
+        self.block, self.processes, self.min_overlap = block, processes, min_overlap
+
+        grid = leads.CoordinateGridAllY()
+        self.lon, self.lat = np.ma.filled(grid.lon, np.nan), np.ma.filled(grid.lat, np.nan)
+        self.extent = ci.arctic_extent
+        name = field.tag if other is None else f'{field.tag}_{other.tag}'
+        self.path = f'./pickles/network_{name}_{threshold}_{min_overlap}_{field.dates[0]}_{field.dates[-1]}'
+        self.adjacency, self.pixels, self.pixels_other = None, None, None
+
+    def _standardised(self, field):
+        # the series keep their gaps as NaN
+        path = f'./pickles/centred_{field.tag}_{field.dates[0]}_{field.dates[-1]}'
+        z, pixels = standardise(field.store(), path, field.fill_value)
+        return path, z.shape[0], pixels
+
+    def build(self):
+        # sparse adjacency (links carry the correlation), rows are the pixels of field, columns those of other
+        if os.path.isfile(f'{self.path}.pkl'):
+            with open(f'{self.path}.pkl', 'rb') as pickle_in:
+                self.adjacency, self.pixels, self.pixels_other = pickle.load(pickle_in)
+            return self.adjacency
+
+        path_a, n_a, self.pixels = self._standardised(self.field)
+        path_b, n_b = None, None
+        if self.other is not None:
+            path_b, n_b, self.pixels_other = self._standardised(self.other)
+        else:
+            self.pixels_other = self.pixels
+
+        self.adjacency = correlation_links(path_a, n_a, path_b, n_b, self.threshold, self.absolute, self.block,
+                                           self.processes, self.min_overlap)
+        print(f'{self.adjacency.nnz} links, link density {self.adjacency.nnz / (n_a * (n_b if n_b else n_a)):.2e}')
+        with open(f'{self.path}.pkl', 'wb') as filehandler:
+            pickle.dump((self.adjacency, self.pixels, self.pixels_other), filehandler)
+        return self.adjacency
+
+    def to_map(self, values, pixels=None):
+        # node values -> grid, NaN for pixels that are no nodes
+        pixels = self.pixels if pixels is None else pixels
+        grid = np.full(self.lat.shape, np.nan)
+        grid.flat[pixels] = values
+        return grid
+
+    def degree(self, area_weighted=False):
+        # number of links per node, area_weighted: sum of the relative cell areas of the linked nodes instead
+        links = self.adjacency.astype(bool).astype(np.float64)
+        if area_weighted:
+            return links @ np.nan_to_num(lca.area_weights(self.lat.flat[self.pixels_other]))
+        return np.asarray(links.sum(axis=1)).ravel()
+
+    def cross_degree(self):
+        # for a cross-network: degree of the nodes of field and of other
+        links = self.adjacency.astype(bool).astype(np.float64)
+        return np.asarray(links.sum(axis=1)).ravel(), np.asarray(links.sum(axis=0)).ravel()
+
+    def clustering(self, block=8192):
+        # local clustering coefficient, triangles of block rows at a time to limit the size of A @ A
+        links = self.adjacency.astype(bool).astype(np.float64).tocsr()
+        degree = np.asarray(links.sum(axis=1)).ravel()
+        triangles = np.zeros(links.shape[0])
+        for start in range(0, links.shape[0], block):
+            rows = links[start:start + block]
+            triangles[start:start + block] = np.asarray((rows @ links).multiply(rows).sum(axis=1)).ravel()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return triangles / (degree * (degree - 1))
+
+    def link_distance(self, bins=np.arange(0, 4001, 100)):
+        # mean great circle length of the links of every node and the histogram of all link lengths
+        coo = self.adjacency.tocoo()
+        lon, lat = self.lon.ravel(), self.lat.ravel()
+        a, b = self.pixels[coo.row], self.pixels_other[coo.col]
+        dist = great_circle(lon[a], lat[a], lon[b], lat[b])
+        counts = np.bincount(coo.row, minlength=coo.shape[0])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(coo.row, dist, minlength=coo.shape[0]) / counts
+        return mean, np.histogram(dist, bins)
+
+    def plot_measures(self):
+        measures = {'degree': self.degree(), 'mean link distance in km': self.link_distance()[0]}
+        if self.other is None:
+            measures['clustering'] = self.clustering()
+
+        fig, axs = plt.subplots(1, len(measures), subplot_kw={"projection": ccrs.NearsidePerspective(-45, 90)})
+        fig.set_size_inches(10 * len(measures), 10)
+        for ax, (name, values) in zip(np.atleast_1d(axs), measures.items()):
+            ax.coastlines(resolution='50m')
+            ax.set_extent(self.extent, crs=ccrs.PlateCarree())
+            im = ax.pcolormesh(self.lon, self.lat, self.to_map(values), transform=ccrs.PlateCarree())
+            ax.set_title(name, fontsize=20)
+            fig.colorbar(im, ax=ax, shrink=.7)
+        plt.savefig(f'./plots/network_{os.path.basename(self.path)}.png', bbox_inches='tight')
+        plt.close(fig)
+
+
+def event_times(store, detect, min_events=1):
+    # Event days of all pixels of a pixel store in CSR form: the sorted day indices of pixel n are
+    # times[indptr[n]:indptr[n + 1]], pixels holds the flat grid index of every row. detect(block) maps the (pixels,
+    # time) series of a tile to a boolean event array. Pixels with less than min_events events are left out.
+    times, counts, pixels = [], [], []
+    for rows, cols, block in store.tiles():
+        events = detect(block.reshape(-1, block.shape[-1]))
+        n = events.sum(axis=1)
+        use = n >= min_events
+        grid_rows, grid_cols = np.meshgrid(np.arange(rows.start, rows.stop), np.arange(cols.start, cols.stop),
+                                           indexing='ij')
+        pixels.append(np.ravel_multi_index((grid_rows.ravel()[use], grid_cols.ravel()[use]), store.shape))
+        # nonzero runs row by row, so the days are sorted within every pixel
+        times.append(np.nonzero(events[use])[1].astype(np.int32))
+        counts.append(n[use])
+    counts = np.concatenate(counts)
+    return {'indptr': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), 'times': np.concatenate(times),
+            'pixels': np.concatenate(pixels), 'n_days': len(store.dates)}
+
+
+_source, _target = None, None
+
+
+def _init_events(source, target):
+    # the event arrays are sent once per worker instead of with every task
+    global _source, _target
+    _source, _target = source, target
+
+
+def _sync_block(args):
+    # Synchronisation of the source pixels a and the target pixels b: for every target event the number of source
+    # events 0..tau days before is found with two searchsorted calls on offset keys. The source events of all pixels of
+    # the block are one sorted array of keys n * (n_days + tau) + tau + day, so the windows of all (source, target
+    # event) pairs are searched at once. Sources are handled in chunks that fit into memory_mb.
+    block_a, block_b, tau, alpha, min_count, memory_mb = args
+    src_ptr, tgt_ptr = _source['indptr'], _target['indptr']
+    n_days = _source['n_days']
+
+    src_times = _source['times'][src_ptr[block_a.start]:src_ptr[block_a.stop]].astype(np.int64)
+    n_src = np.diff(src_ptr[block_a.start:block_a.stop + 1])
+    offset = n_days + tau
+    keys = np.repeat(np.arange(n_src.size), n_src) * offset + tau + src_times
+
+    tgt_times = _target['times'][tgt_ptr[block_b.start]:tgt_ptr[block_b.stop]].astype(np.int64)
+    n_tgt = np.diff(tgt_ptr[block_b.start:block_b.stop + 1])
+    starts = np.concatenate([[0], np.cumsum(n_tgt)[:-1]])
+
+    chunk = max(1, int(memory_mb * 2 ** 20 // max(1, 24 * tgt_times.size)))
+    rows, cols, values = [], [], []
+    for c in range(0, n_src.size, chunk):
+        base = (np.arange(c, min(c + chunk, n_src.size)) * offset)[:, None]
+        lower = np.searchsorted(keys, base + tgt_times, side='left')
+        upper = np.searchsorted(keys, base + tgt_times + tau, side='right')
+        counts = np.add.reduceat(upper > lower, starts, axis=1, dtype=np.int64)
+
+        # probability that a target event is preceded by one of n_i randomly timed source events
+        n_i = n_src[c:c + chunk, None]
+        p0 = 1 - (1 - (tau + 1) / n_days) ** n_i
+        pvalues = binom.sf(counts - 1, n_tgt[None, :], p0)
+        r, t = np.nonzero((counts >= min_count) & (pvalues < alpha))
+        rows.append(r + c + block_a.start)
+        cols.append(t + block_b.start)
+        values.append(counts[r, t] / np.sqrt(n_i[r, 0] * n_tgt[t]))
+
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+
+def synchronisation_links(source, target, tau=3, alpha=1e-3, min_count=2, block=2048, memory_mb=256,
+                          processes=None):
+    # Sparse directed adjacency source pixel -> target pixel. A link means that significantly many target events
+    # happen 0..tau days after a source event (binomial test against randomly timed source events), its value is the
+    # event synchronisation strength count / sqrt(n_source * n_target).
+    n_a, n_b = source['indptr'].size - 1, target['indptr'].size - 1
+    tasks = [(slice(a, min(a + block, n_a)), slice(b, min(b + block, n_b)), tau, alpha, min_count, memory_mb)
+             for a in range(0, n_a, block) for b in range(0, n_b, block)]
+
+    rows, cols, values = [], [], []
+
+    def collect(results):
+        for n, (r, c, v) in enumerate(results):
+            rows.append(r)
+            cols.append(c)
+            values.append(v)
+            if n % 100 == 0:
+                print(f'block {n + 1} of {len(tasks)}')
+
+    if processes == 1:
+        _init_events(source, target)
+        collect(map(_sync_block, tasks))
+    else:
+        with Pool(processes, initializer=_init_events, initargs=(source, target)) as pool:
+            collect(pool.imap_unordered(_sync_block, tasks))
+
+    return sp.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(n_a, n_b))
+
+
+class EventSyncNetwork(CorrelationNetwork):
+    def __init__(self, source, target, tau=3, alpha=1e-3, min_count=2, block=2048, memory_mb=256, processes=None):
+        # directed network from the events of source (e.g. CycAllY) to the events of target (e.g. OnlyLeadAllY), the
+        # fields define their events with detect_events
+        super().__init__(source, target, block=block, processes=processes)
+        self.tau, self.alpha, self.min_count, self.memory_mb = tau, alpha, min_count, memory_mb
+        self.path = f'./pickles/event_sync_{source.tag}_{target.tag}_{tau}_{alpha}_{source.dates[0]}_' \
+                    f'{source.dates[-1]}'
+
+    @staticmethod
+    def events(field):
+        path = f'./pickles/events_{field.tag}_{field.dates[0]}_{field.dates[-1]}.pkl'
+        try:
+            with open(path, 'rb') as pickle_in:
+                return pickle.load(pickle_in)
+        except FileNotFoundError:
+            print('could not find event times \n try to extract event times')
+        events = event_times(field.store(), field.detect_events)
+        with open(path, 'wb') as filehandler:
+            pickle.dump(events, filehandler)
+        return events
+
+    def build(self):
+        if os.path.isfile(f'{self.path}.pkl'):
+            with open(f'{self.path}.pkl', 'rb') as pickle_in:
+                self.adjacency, self.pixels, self.pixels_other = pickle.load(pickle_in)
+            return self.adjacency
+
+        source, target = self.events(self.field), self.events(self.other)
+        self.pixels, self.pixels_other = source['pixels'], target['pixels']
+        self.adjacency = synchronisation_links(source, target, self.tau, self.alpha, self.min_count, self.block,
+                                               self.memory_mb, self.processes)
+        print(f'{self.adjacency.nnz} links')
+        with open(f'{self.path}.pkl', 'wb') as filehandler:
+            pickle.dump((self.adjacency, self.pixels, self.pixels_other), filehandler)
+        return self.adjacency
+
+    def plot_measures(self):
+        # out-degree of the source pixels and in-degree of the target pixels
+        out_degree, in_degree = self.cross_degree()
+        fig, axs = plt.subplots(1, 2, subplot_kw={"projection": ccrs.NearsidePerspective(-45, 90)})
+        fig.set_size_inches(20, 10)
+        for ax, values, pixels, name in zip(axs, [out_degree, in_degree], [self.pixels, self.pixels_other],
+                                            ['out-degree', 'in-degree']):
+            ax.coastlines(resolution='50m')
+            ax.set_extent(self.extent, crs=ccrs.PlateCarree())
+            im = ax.pcolormesh(self.lon, self.lat, self.to_map(values, pixels), transform=ccrs.PlateCarree())
+            ax.set_title(name, fontsize=20)
+            fig.colorbar(im, ax=ax, shrink=.7)
+        plt.savefig(f'./plots/network_{os.path.basename(self.path)}.png', bbox_inches='tight')
+        plt.close(fig)
+
+
+if __name__ == '__main__':
+    # net = CorrelationNetwork(OnlyLeadAllY('20191105', '20200430'), threshold=.5)
+    # net.build()
+    # net.plot_measures()
+    # cross = CorrelationNetwork(CycAllY('20191105', '20200430'), OnlyLeadAllY('20191105', '20200430'), threshold=.3)
+    # cross.build()
+    # sync = EventSyncNetwork(CycAllY('20191105', '20200430'), OnlyLeadAllY('20191105', '20200430'), tau=3)
+    # sync.build()
+    # sync.plot_measures()
+    pass
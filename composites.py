@@ -0,0 +1,93 @@
+# Conditional composites of daily fields. Every day adds its fields to per (field, condition) sums, sums of squares and
+# counts where the condition holds and the field is not NaN. Nothing is copied per condition, the masked additions go
+# straight into the accumulators, so new conditions (sic bins, wind thresholds, divergence sign, ...) only cost one
+# boolean grid per day.
+#
+#   comp = Composite()
+#   for date in dates:
+#       comp.add({'leads': lead, 'divs': div}, {'cyc': ~np.isnan(cyc), 'div>0': div > 0})
+#   comp.mean('leads', 'cyc'), comp.count('leads', 'div>0'), comp.variance('divs', 'cyc')
+#
+# Composites of consecutive periods are merged, so a composite is extended by the composite of the new days only.
+# Welch t-tests between two conditions or two composites only need the accumulators as well.
+import numpy as np
+from scipy.stats import ttest_ind_from_stats
+import precision
+
+
+class Composite:
+    def __init__(self, pairs=None):
+        # pairs: list of (field, condition) to accumulate, all combinations of the added fields and conditions if None
+        self.pairs = list(pairs) if pairs is not None else None
+        self.sums, self.sqsums, self.counts = {}, {}, {}
+        self.days = 0
+
+    def _accumulators(self, key, shape):
+        if key not in self.sums:
+            self.sums[key] = np.zeros(shape, dtype=precision.acc_dtype)
+            self.sqsums[key] = np.zeros(shape, dtype=precision.acc_dtype)
+            self.counts[key] = np.zeros(shape, dtype=np.int32)
+        return self.sums[key], self.sqsums[key], self.counts[key]
+
+    def add(self, fields, conditions):
+        # fields: {name: 2d array}, conditions: {name: 2d boolean array}, both for the same day
+        pairs = self.pairs if self.pairs is not None else [(f, c) for f in fields for c in conditions]
+        valid, squares = {}, {}
+
+        for field, condition in pairs:
+            if field not in fields or condition not in conditions:
+                continue
+            data = fields[field]
+            if field not in valid:
+                valid[field] = ~np.isnan(data)
+                squares[field] = np.square(data, dtype=precision.acc_dtype)
+            where = valid[field] & conditions[condition]
+            sums, sqsums, counts = self._accumulators((field, condition), data.shape)
+            np.add(sums, data, out=sums, where=where)
+            np.add(sqsums, squares[field], out=sqsums, where=where)
+            counts += where
+        self.days += 1
+
+    def merge(self, other):
+        # add the accumulators of another composite (e.g. from a worker process or a later period)
+        for key in other.sums:
+            sums, sqsums, counts = self._accumulators(key, other.sums[key].shape)
+            sums += other.sums[key]
+            sqsums += other.sqsums[key]
+            counts += other.counts[key]
+        self.days += other.days
+        return self
+
+    def count(self, field, condition):
+        return self.counts[(field, condition)]
+
+    def mean(self, field, condition):
+        # NaN where no data point fulfilled the condition
+        counts = self.counts[(field, condition)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return precision.as_data(self.sums[(field, condition)] / counts)
+
+    def variance(self, field, condition, ddof=1):
+        counts = self.counts[(field, condition)]
+        sums = self.sums[(field, condition)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = (self.sqsums[(field, condition)] - sums ** 2 / counts) / (counts - ddof)
+        var[counts <= ddof] = np.nan
+        return precision.as_data(np.maximum(var, 0))
+
+    def ttest(self, field, condition, other_condition=None, other=None):
+        # Welch t-test of the mean of (field, condition) against (field, other_condition) of other (self by default),
+        # returns the statistic and p-value maps, NaN where one of the samples has less than two values
+        other = other if other is not None else self
+        other_condition = other_condition if other_condition else condition
+        with np.errstate(invalid='ignore', divide='ignore'):
+            res = ttest_ind_from_stats(self.mean(field, condition), np.sqrt(self.variance(field, condition)),
+                                       self.count(field, condition), other.mean(field, other_condition),
+                                       np.sqrt(other.variance(field, other_condition)),
+                                       other.count(field, other_condition), equal_var=False)
+        return res.statistic, res.pvalue
+
+    def results(self):
+        # {(field, condition): {'mean', 'count', 'var'}} of all accumulated pairs
+        return {key: {'mean': self.mean(*key), 'count': self.counts[key], 'var': self.variance(*key)}
+                for key in self.sums}
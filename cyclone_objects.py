@@ -0,0 +1,262 @@
+# Cyclones as space-time objects. The cyclone occurrence (daily at 09:00 or all 6-hourly steps) is thresholded and
+# labelled with scipy.ndimage.label in (time, y, x), so every storm gets one id over its whole lifetime. The cube is
+# read in chunks of time steps per run of consecutive steps (a season without missing days), objects that continue
+# over a chunk border are stitched together with a union-find over the labels of the touching slices. Per object the
+# centroid, area and lifetime are computed from bincounts of the labels, the daily track of the centroid allows
+# composites of lead fraction and ice divergence in a storm-centred frame.
+import datetime
+import pickle
+import cftime
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from scipy import ndimage
+import catalog
+import composites
+import data_science as ds
+import leads
+import lead_cyc_analysis as lca
+import loaders
+import profiling
+
+
+def season(date):
+    # winter season (Nov - Apr) a date belongs to, named by the year of its November
+    return int(date[:4]) if int(date[4:6]) >= 7 else int(date[:4]) - 1
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = []
+
+    def add(self, n):
+        # n new ids, each its own root
+        self.parent += list(range(len(self.parent), len(self.parent) + n))
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parent))], dtype=np.int64)
+
+
+class CycloneObjects:
+    def __init__(self, date1, date2, threshold=.25, hourly=False, chunk_steps=60, structure=None):
+        # structure: connectivity in (time, y, x), default connects a pixel to its 4 spatial neighbours and to the same
+        # pixel in the previous and next time step
+        self.dates = ds.time_delta(date1, date2)
+        self.threshold = threshold
+        self.hourly = hourly
+        self.chunk_steps = chunk_steps
+        self.structure = structure if structure is not None else ndimage.generate_binary_structure(3, 1)
+
+        grid = leads.CoordinateGridAllY()
+        self.lon, self.lat = np.ma.filled(grid.lon, np.nan), np.ma.filled(grid.lat, np.nan)
+        # true area of the 12.5 km polar stereographic cells in km^2
+        self.cell_area = 12.5 ** 2 * lca.area_weights(self.lat)
+        self.cell_area[np.isnan(self.cell_area)] = 0
+
+        self.times = []
+        self.objects, self.tracks = None, None
+
+    def time_steps(self, ds_cyc):
+        # Indices and datetimes of the cyclone time steps, split into runs of consecutive steps (one day, or the step of
+        # the file if hourly). A new run starts with every season and after missing steps, objects never continue from
+        # one run to the next.
+        time = ds_cyc['time']
+        dt_times = cftime.num2date(time[:], time.units, getattr(time, 'calendar', 'standard'))
+        step = min(np.diff(dt_times)) if self.hourly else datetime.timedelta(days=1)
+        dates = set(catalog.DataCatalog.get().filter(self.dates, 'cyc'))
+        runs = []
+        for i, t in enumerate(dt_times):
+            date = f'{t.year}{str(t.month).zfill(2)}{str(t.day).zfill(2)}'
+            if date in dates and (self.hourly or t.hour == 9):
+                t = datetime.datetime(t.year, t.month, t.day, t.hour)
+                last = runs[-1][-1][1] if runs else None
+                if last is None or t - last != step or season(date) != season(last.strftime('%Y%m%d')):
+                    runs.append([])
+                runs[-1].append((i, t))
+        return runs
+
+    def label(self):
+        # label all cyclone objects, fills self.objects (one row per object) and self.tracks (one row per object and
+        # time step)
+        ds_cyc = nc.Dataset(catalog.cyc_path)
+        var = ds_cyc['cyclone_occurence']
+        ny, nx = self.lat.shape
+        rows, cols = np.indices((ny, nx))
+        # spatial offsets of the pixels in the previous time step a pixel is connected to
+        offsets = [(dy - 1, dx - 1) for dy in range(3) for dx in range(3) if self.structure[0, dy, dx]]
+
+        # id 0 is the background
+        uf = UnionFind()
+        uf.add(1)
+        records = []
+        self.times = []
+        runs = self.time_steps(ds_cyc)
+        n_chunks = sum(-(-len(run) // self.chunk_steps) for run in runs)
+        for run in runs:
+            prev = None
+            for c0 in range(0, len(run), self.chunk_steps):
+                chunk = run[c0:c0 + self.chunk_steps]
+                # progress in chunks of time steps
+                profiling.progress(f'{chunk[0][1].date()} - {chunk[-1][1].date()}', n_chunks)
+                with profiling.span('read cyclone cube', 'io'):
+                    cube = loaders.read(var, [i for i, _ in chunk]).reshape(len(chunk), ny, nx)
+                    profiling.add_bytes(cube)
+
+                with profiling.span('label cyclone objects', 'compute'):
+                    labels, n = ndimage.label(cube > self.threshold, structure=self.structure)
+                    offset = len(uf.parent) - 1
+                    uf.add(n)
+                    labels[labels > 0] += offset
+
+                    # stitch the first slice of the chunk to the last slice of the previous chunk
+                    if prev is not None:
+                        for dy, dx in offsets:
+                            cur = labels[0, max(0, -dy):ny - max(0, dy), max(0, -dx):nx - max(0, dx)]
+                            old = prev[max(0, dy):ny - max(0, -dy), max(0, dx):nx - max(0, -dx)]
+                            touching = (cur > 0) & (old > 0)
+                            for i, j in np.unique(np.stack([cur[touching], old[touching]]), axis=1).T:
+                                uf.union(int(i), int(j))
+                    prev = labels[-1].copy()
+
+                    # area, area weighted position and pixel count per (label, time step) from one bincount each
+                    t_idx, r_idx, c_idx = np.nonzero(labels)
+                    lab = labels[t_idx, r_idx, c_idx]
+                    key = (lab - offset - 1).astype(np.int64) * len(chunk) + t_idx
+                    key_unique, key_inv = np.unique(key, return_inverse=True)
+                    area = self.cell_area[r_idx, c_idx]
+                    sums = [np.bincount(key_inv, weights=w) for w in [area, area * rows[r_idx, c_idx],
+                                                                     area * cols[r_idx, c_idx]]]
+                    npix = np.bincount(key_inv)
+                    records.append(np.column_stack([key_unique // len(chunk) + offset + 1,
+                                                    key_unique % len(chunk) + len(self.times)] + sums + [npix]))
+                self.times += [t for _, t in chunk]
+
+        if not records:
+            self.objects, self.tracks = pd.DataFrame(), pd.DataFrame()
+            return self.objects, self.tracks
+
+        records = np.concatenate(records)
+        roots = uf.roots()
+        tracks = pd.DataFrame({'object': roots[records[:, 0].astype(np.int64)], 'step': records[:, 1].astype(np.int64),
+                               'area': records[:, 2], 'row_sum': records[:, 3], 'col_sum': records[:, 4],
+                               'npix': records[:, 5].astype(np.int64)})
+        tracks = tracks.groupby(['object', 'step'], as_index=False).sum()
+        # consecutive object numbers
+        tracks['object'] = pd.factorize(tracks['object'], sort=True)[0]
+        tracks['row'] = tracks['row_sum'] / tracks['area']
+        tracks['col'] = tracks['col_sum'] / tracks['area']
+        r, c = np.rint(tracks['row']).astype(int), np.rint(tracks['col']).astype(int)
+        tracks['lat'], tracks['lon'] = self.lat[r, c], self.lon[r, c]
+        tracks['time'] = [self.times[s] for s in tracks['step']]
+        tracks['date'] = [t.strftime('%Y%m%d') for t in tracks['time']]
+        self.tracks = tracks.drop(columns=['row_sum', 'col_sum'])
+
+        grouped = self.tracks.groupby('object')
+        objects = pd.DataFrame({'start': grouped['time'].min(), 'end': grouped['time'].max(),
+                                'steps': grouped['step'].count(), 'max_area': grouped['area'].max(),
+                                'mean_area': grouped['area'].mean(), 'pixel_steps': grouped['npix'].sum()})
+        # area weighted centroid over the whole lifetime
+        weights = self.tracks['area']
+        for name in ['row', 'col']:
+            objects[name] = (self.tracks[name] * weights).groupby(self.tracks['object']).sum() / grouped['area'].sum()
+        r, c = np.rint(objects['row']).astype(int), np.rint(objects['col']).astype(int)
+        objects['lat'], objects['lon'] = self.lat[r, c], self.lon[r, c]
+        objects['lifetime_days'] = (objects['end'] - objects['start']).dt.total_seconds() / 86400 + \
+                                   (.25 if self.hourly else 1.)
+        self.objects = objects
+        return self.objects, self.tracks
+
+    def cases(self, n=4, min_lifetime=3., margin=5.):
+        # dates and extent of the n largest long lived storms, in the format of case_information.case1/extent1
+        if self.objects is None:
+            self.label()
+        largest = self.objects[self.objects['lifetime_days'] >= min_lifetime].nlargest(n, 'max_area')
+        cases = []
+        for obj in largest.index:
+            track = self.tracks[self.tracks['object'] == obj]
+            extent = [min(track['lon'].max() + margin, 180), max(track['lon'].min() - margin, -180),
+                      min(track['lat'].max() + margin, 90), max(track['lat'].min() - margin, 60)]
+            cases.append((sorted(set(track['date'])), [float(e) for e in extent]))
+        return cases
+
+    def export(self, path=None):
+        path = path if path else f'./pickles/cyclone_objects_{self.hourly}_{self.threshold}_{self.dates[0]}_' \
+                                 f'{self.dates[-1]}.pkl'
+        with open(path, 'wb') as filehandler:
+            pickle.dump((self.objects, self.tracks), filehandler)
+
+    def load(self, path=None):
+        path = path if path else f'./pickles/cyclone_objects_{self.hourly}_{self.threshold}_{self.dates[0]}_' \
+                                 f'{self.dates[-1]}.pkl'
+        with open(path, 'rb') as pickle_in:
+            self.objects, self.tracks = pickle.load(pickle_in)
+        return self.objects, self.tracks
+
+    def storm_composite(self, radius=40, min_lifetime=2., min_area=0., sic_filter=95.):
+        # Lead fraction and ice divergence in a (2 radius + 1)^2 pixel window centred on the daily storm centroid.
+        # Conditions: 'all' pixels of the window and 'cyc' pixels with cyclone occurrence above the threshold.
+        if self.tracks is None:
+            self.label()
+        keep = self.objects.index[(self.objects['lifetime_days'] >= min_lifetime) &
+                                  (self.objects['max_area'] >= min_area)]
+        tracks = self.tracks[self.tracks['object'].isin(keep)]
+        # one centre per object and day (6-hourly steps are averaged)
+        centres = tracks.groupby(['object', 'date'], as_index=False)[['row', 'col']].mean()
+
+        comp = composites.Composite()
+        data_catalog = catalog.DataCatalog.get()
+        size = 2 * radius + 1
+        for date, day in centres.groupby('date'):
+            if not data_catalog.available(date, 'lead', 'cyc', 'sic'):
+                continue
+            profiling.progress(date)
+            leadally = leads.LeadAllY(date, data_catalog=data_catalog)
+            lead = leadally.lead_data
+            lead[100 * leadally.sic_data <= sic_filter] = np.nan
+            fields = {name: np.pad(data, radius, constant_values=np.nan)
+                      for name, data in [('leads', lead), ('divs', leadally.ice_div.T)]}
+            cyc = np.pad(leadally.cyc_data > self.threshold, radius, constant_values=False)
+
+            with profiling.span('storm composite', 'compute'):
+                for r, c in zip(np.rint(day['row']).astype(int), np.rint(day['col']).astype(int)):
+                    window = (slice(r, r + size), slice(c, c + size))
+                    comp.add({name: data[window] for name, data in fields.items()},
+                             {'all': np.ones((size, size), dtype=bool), 'cyc': cyc[window]})
+        return comp
+
+    def plot_storm_composite(self, comp, radius=40):
+        fig, axs = plt.subplots(2, 2, figsize=(12, 10))
+        extent = [-radius * 12.5, radius * 12.5, radius * 12.5, -radius * 12.5]
+        for ax, (field, condition), kwargs in zip(axs.flatten(), [('leads', 'all'), ('leads', 'cyc'), ('divs', 'all'),
+                                                                  ('divs', 'cyc')],
+                                                  [{'vmin': 0, 'vmax': .2}] * 2 +
+                                                  [{'vmin': -3.e-7, 'vmax': 3.e-7, 'cmap': 'bwr'}] * 2):
+            im = ax.imshow(comp.mean(field, condition), extent=extent, **kwargs)
+            ax.set_title(f'{field} ({condition}), {comp.days} storm days')
+            ax.set_xlabel('km from storm centre')
+            fig.colorbar(im, ax=ax)
+        plt.tight_layout()
+        plt.savefig(f'./plots/analysis/storm_composite_{self.threshold}_{self.dates[0]}_{self.dates[-1]}.png')
+        plt.close(fig)
+
+
+if __name__ == '__main__':
+    # C = CycloneObjects('20141101', '20150430')
+    # objects, tracks = C.label()
+    # C.export()
+    # C.plot_storm_composite(C.storm_composite())
+    pass
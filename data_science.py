@@ -1,10 +1,13 @@
 import leads
 import numpy as np
+import prefetch
+import regions
 import matplotlib.pyplot as plt
 from datetime import date, timedelta
 import scipy
 import scipy.ndimage
 import scipy.optimize as opt
+from functools import partial
 
 
 def append_dates(dates, shape, to_end=False):
@@ -98,11 +101,9 @@ def two_lead_diff(lead1, lead2):
 
 
 def new_leads(date1, date2):
-    lead1 = leads.Lead(date1).lead_data
-    lead2 = leads.Lead(date2).lead_data
-    new_lead = lead2 - lead1
-
-    return new_lead.clip(min=0)
+    # lead opening from date1 to date2 as fraction, the dates need not be consecutive
+    opening, _ = leads.lead_change(leads.read_lead_data(date1), leads.read_lead_data(date2))
+    return opening / 100
 
 
 def clear_matrix(matrix, rows, cols):
@@ -139,6 +140,18 @@ def select_area(grid, lead, matrix, points):
     return lon, lat, matrix, mask
 
 
+def regrid_setup(variable, extent=None):
+    # only the box of extent is read from the regridded ERA5 and the lead files
+    region = regions.region('lead', extent)
+    return leads.era5(variable, True, region), leads.CoordinateGrid(), region
+
+
+def load_regrid_day(context, date, extent=None):
+    # regridded ERA5 variable of date within extent and where the lead data has entries
+    regrid, grid, region = context
+    return select_area(grid, leads.Lead(date, region), regrid.get_variable(date), extent)[2]
+
+
 def variable_average(date1, date2, extent, variable, filter_data=False):
     # This Method calculates the average of the cyclone_occurence matrix within the range of date1,2.
     # Optionally the data can be filtered via Gaussian. You may want to set different sigma values
@@ -147,11 +160,10 @@ def variable_average(date1, date2, extent, variable, filter_data=False):
     cum_var = np.full(grid.lon.shape, np.nan)
     count_values = np.zeros(grid.lon.shape)
 
-    for date in dates:
-        lead = leads.Lead(date)
-        var = leads.Era5Regrid(lead, variable)
-        var = var.get_variable(date)
-        var = select_area(grid, lead, var, extent)[2]
+    # the regridded days are read (and cut to extent) ahead in a background process
+    days = prefetch.prefetch(dates, partial(load_regrid_day, extent=extent),
+                             setup=partial(regrid_setup, variable, extent))
+    for date, var in days:
         cum_var = sum_nan_arrays(cum_var, var)
         row, col = np.where(~np.isnan(var))
         count_values[row, col] += 1
@@ -168,8 +180,9 @@ def lead_average(date1, date2, extent):
     cum_leads = np.full(grid.lon.shape, np.nan)
     count_values = np.zeros(grid.lon.shape)
 
+    region = regions.region('lead', extent)
     for date in dates:
-        lead = leads.Lead(date)
+        lead = leads.Lead(date, region)
         lead = select_area(grid, lead, 100 * lead.lead_data, extent)[2]
         cum_leads = sum_nan_arrays(cum_leads, lead)
         row, col = np.where(~np.isnan(lead))
@@ -189,8 +202,9 @@ def lead_monthly_average(year, month, extent):
     count_values = np.zeros(grid.lon.shape)
     N = len(dates)
 
+    region = regions.region('lead', extent)
     for date in dates:
-        lead = leads.Lead(date)
+        lead = leads.Lead(date, region)
         lead = select_area(grid, lead, lead.lead_data, extent)[2]
         row, col = np.where(~np.isnan(lead))
         count_values[row, col] += 1
@@ -1,3 +1,4 @@
+import collections
 import netCDF4 as nc
 import numpy as np
 import os
@@ -10,9 +11,21 @@ import datetime
 import case_information as ci
 import data_science as dscience
 import cftime
+import loaders
+import prefetch
+import profiling
+import regions
+from functools import partial
+from multiprocessing import Pool
 
 
 
+def path_start(path):
+    # start of the drift period of a CMEMS file name
+    date1 = path[36:48]
+    return datetime.datetime(int(date1[:4]), int(date1[4:6]), int(date1[6:8]), int(date1[8:10]), int(date1[10:12]))
+
+
 def dt_from_path(path):
     date1, date2 = path[36:48], path[49:-3]
     datetime1 = datetime.datetime(int(date1[:4]), int(date1[4:6]), int(date1[6:8]), int(date1[8:10]), int(date1[10:12]))
@@ -54,91 +67,165 @@ def lonlat_mask(extent, lon, lat):
     return lon_mask1 & lon_mask2 & lat_mask1 & lat_mask2
 
 
+def _cmems_step(var, dtype=np.float64):
+    # CMEMS fields are (time, yc, xc) with a single time step
+    return loaders.read(var, 0 if var.ndim == 3 else slice(None), dtype)
+
+
+def cmems_fields(path, keep=(0,)):
+    # drift speed (m/s), divergence, vorticity and shear (1/s) of one CMEMS drift file. Cells whose data_status is not
+    # in keep and cells without displacement (-998) are NaN, so they never enter the differences of their neighbours.
+    dt = dt_from_path(os.path.basename(path))
+    with nc.Dataset(path) as ds:
+        status = np.ma.filled(ds['data_status'][0] if ds['data_status'].ndim == 3 else ds['data_status'][:], -1)
+        dX, dY = _cmems_step(ds['dX']), _cmems_step(ds['dY'])
+        # grid spacing in m, np.gradient takes care of descending coordinates
+        x, y = 1000 * ds['xc'][:].astype(np.float64), 1000 * ds['yc'][:].astype(np.float64)
+        lon, lat = ds['lon'][:], ds['lat'][:]
+
+    invalid = ~np.isin(status, keep) | np.isnan(dX) | np.isnan(dY) | (dX == -998.) | (dY == -998.)
+    u, v = 1000 * dX / dt, 1000 * dY / dt
+    u[invalid], v[invalid] = np.nan, np.nan
+
+    # differences along the rows (x) and columns (y) of the 2d grid
+    du_dx, du_dy = np.gradient(u, x, axis=1), np.gradient(u, y, axis=0)
+    dv_dx, dv_dy = np.gradient(v, x, axis=1), np.gradient(v, y, axis=0)
+    fields = {'div': du_dx + dv_dy, 'vort': dv_dx - du_dy,
+              'shear': np.sqrt((du_dx - dv_dy) ** 2 + (du_dy + dv_dx) ** 2)}
+    # the centred differences skip the cell itself, invalid cells are NaN in the derived fields too
+    for field in fields.values():
+        field[invalid] = np.nan
+    return dict(fields, start=path_start(os.path.basename(path)), dt=dt, x=x, y=y, lon=lon, lat=lat,
+                flag=status.astype(np.int8), u=u, v=v)
+
+
 class IceDivergence:
-    def __init__(self):
+    # The CMEMS drift files are turned into one product with all time steps first, the plots only read that product.
+    def __init__(self, product='./data/ice drift/CMEMS_divergence.nc'):
         self.dir = './data/ice drift/CMEMS'
-        self.path_list = os.listdir(self.dir)
+        self.path_list = sorted(path for path in os.listdir(self.dir) if path.endswith('.nc'))
+        self.product = product
 
         self.div = None
 
+    def build_product(self, keep=(0,), processes=None):
+        # Speed, divergence, vorticity, shear and data_status of all files in one (time, y, x) netCDF file with one
+        # chunk per time step. The files are read and differenced in a process pool, the main process only writes.
+        paths = [f'{self.dir}/{path}' for path in self.path_list]
+        try:
+            if processes == 1:
+                self.write_product(map(partial(cmems_fields, keep=keep), paths), paths, keep)
+            else:
+                with Pool(processes) as pool:
+                    self.write_product(pool.imap(partial(cmems_fields, keep=keep), paths), paths, keep)
+        except BaseException:
+            # no half written product is left behind
+            if os.path.isfile(f'{self.product}.tmp'):
+                os.remove(f'{self.product}.tmp')
+            raise
+        os.replace(f'{self.product}.tmp', self.product)
+
+    def write_product(self, results, paths, keep):
+        # write the cmems_fields results of paths (in order) to the temporary product file
+        with nc.Dataset(f'{self.product}.tmp', 'w') as out:
+            for n, fields in enumerate(results):
+                if n == 0:
+                    ny, nx = fields['div'].shape
+                    out.createDimension('time', None)
+                    out.createDimension('y', ny)
+                    out.createDimension('x', nx)
+                    out.createVariable('time', 'f8', ('time',)).units = 'seconds since 1978-01-01 00:00:00'
+                    out.createVariable('dt', 'f8', ('time',)).units = 's'
+                    out.createVariable('yc', 'f4', ('y',))[:] = fields['y'] / 1000
+                    out.createVariable('xc', 'f4', ('x',))[:] = fields['x'] / 1000
+                    out.createVariable('lat', 'f4', ('y', 'x'))[:] = fields['lat']
+                    out.createVariable('lon', 'f4', ('y', 'x'))[:] = fields['lon']
+                    for name, units in [('u', 'm/s'), ('v', 'm/s'), ('div', '1/s'), ('vort', '1/s'), ('shear', '1/s')]:
+                        out.createVariable(name, 'f4', ('time', 'y', 'x'), zlib=True, chunksizes=(1, ny, nx),
+                                           fill_value=np.float32(np.nan)).units = units
+                    flag = out.createVariable('flag', 'i1', ('time', 'y', 'x'), zlib=True, chunksizes=(1, ny, nx),
+                                              fill_value=np.int8(-1))
+                    flag.long_name = 'data_status of the drift file'
+                    out.keep = np.array(keep, dtype=np.int8)
+                elif fields['div'].shape != (ny, nx):
+                    raise ValueError(f'{paths[n]} is not on the grid of {paths[0]}')
+
+                out['time'][n] = nc.date2num(fields['start'], out['time'].units)
+                out['dt'][n] = fields['dt']
+                for name in ['u', 'v', 'div', 'vort', 'shear', 'flag']:
+                    out[name][n] = fields[name]
+                profiling.progress(fields['start'], len(paths))
+
+    def open_product(self):
+        if not os.path.isfile(self.product):
+            self.build_product()
+        return nc.Dataset(self.product)
+
+    def product_steps(self, product):
+        # (index, start, stop) of the time steps of the product
+        starts = cftime.num2date(product['time'][:], product['time'].units, only_use_cftime_datetimes=False,
+                                 only_use_python_datetimes=True)
+        for n, (start, dt) in enumerate(zip(starts, product['dt'][:])):
+            yield n, start, start + datetime.timedelta(seconds=float(dt))
+
     def ice_drift_correlation(self):
-        self.dir = './data/ice drift/CMEMS'
-        for path in self.path_list:
-            ds = nc.Dataset(self.dir + '/' + path)
-            fig, ax = pl.setup_plot(None)
-            dY = ds['dY'][:]
-            dY[dY == -998.] = 0
-            dX = ds['dX'][:]
-            dX[dX == -998.] = 0
-            im = ax.pcolormesh(ds['lon'][:], ds['lat'][:], ds['data_status'], transform=ccrs.PlateCarree(),
-                               cmap='Accent')
-            cbar = fig.colorbar(im)
-            # cbar.set_ticks([0, 1, 2, 4, 5])
-            # cbar.set_ticklabels(['valid', 'correlation less than min', 'drift speed larger than max', 'invalid',
-            # 'invalid (filter)'])
-            ax.set_title(f'dY-start:{ds.start_date} stop:{ds.stop_date}', fontsize=20)
-            plt.savefig(f'{ds.start_date}_to_{ds.stop_date}.png', bbox_inches='tight')
-            plt.close(fig)
-            print(ds.start_date, ds.stop_date)
+        with self.open_product() as product:
+            lon, lat = product['lon'][:], product['lat'][:]
+            for n, start, stop in self.product_steps(product):
+                fig, ax = pl.setup_plot(None)
+                im = ax.pcolormesh(lon, lat, product['flag'][n], transform=ccrs.PlateCarree(), cmap='Accent')
+                cbar = fig.colorbar(im)
+                # cbar.set_ticks([0, 1, 2, 4, 5])
+                # cbar.set_ticklabels(['valid', 'correlation less than min', 'drift speed larger than max', 'invalid',
+                # 'invalid (filter)'])
+                ax.set_title(f'dY-start:{start} stop:{stop}', fontsize=20)
+                plt.savefig(f'{start:%Y%m%d%H%M}_to_{stop:%Y%m%d%H%M}.png', bbox_inches='tight')
+                plt.close(fig)
+                profiling.progress(start, product['time'].size)
 
     def ice_div(self):
-        self.dir = './data/ice drift/CMEMS'
-        for path in self.path_list:
-            # calculate time difference
-            dt = dt_from_path(path)
-            # load dataset
-            ds = nc.Dataset(self.dir + '/' + path)
-
-            # data validity
-            validity = ds['data_status'][:]
-
-            # load displacement values (x and y direction) from ds and replace no data cells with nan
-            dY = ds['dY'][:]
-            dY[dY == -998.] = 0
-            dX = ds['dX'][:]
-            dX[dX == -998.] = 0
-            # x, y = ds['xc'][:], ds['yc'][:]
-            # x, y = np.tile(x, (np.size(y), 1)), np.transpose(np.tile(y, (np.size(x), 1)))
-
-            # calculate drift speed in the x and y direction in m/s
-            u, v = 1000 * dX / dt, 1000 * dY / dt
-
-            # calculate divergence values
-            du, dv = del_matrix_neighbour(u), del_matrix_neighbour(v)
-            # dx, dy = del_matrix_neighbour(x), del_matrix_neighbour(y)
-            div = (du + dv)/20000
-            div[validity == 4] = np.nan
-
-            # plot divergence
-            # fig, ax = pl.setup_plot(None)
-            fig, (ax1, ax2) = plt.subplots(1, 2, subplot_kw={"projection": ccrs.NorthPolarStereo(-45)},
-                                           constrained_layout=True)
-            fig.set_size_inches(32, 18)
-            cap = 2.e-06
-            im = ax1.pcolormesh(ds['lon'][:], ds['lat'][:], div, transform=ccrs.PlateCarree(), vmax=cap, vmin=-cap)
-            ax1.coastlines(resolution='50m')
-            ax1.set_extent(ci.barent_extent, crs=ccrs.PlateCarree())
-            cbar1 = fig.colorbar(im, ax=ax1)
-            cbar1.ax.tick_params(axis='both', labelsize=25)
-            ax1.set_title(f'ice divergence in 1/s \n start:{ds.start_date} stop:{ds.stop_date}', fontsize=25)
-
-            im2 = ax2.pcolormesh(ds['lon'][:], ds['lat'][:], ds['data_status'][:], transform=ccrs.PlateCarree(),
-                                 cmap='Accent')
-            cbar2 = fig.colorbar(im2, ax=ax2)
-            cbar2.set_ticks([0, 1, 2, 4, 5])
-            cbar2.set_ticklabels(['valid', 'correlation less than min', 'drift speed larger than max', 'invalid',
-                                  'invalid (filter)'])
-            cbar2.ax.tick_params(labelsize=25)
-            ax2.coastlines(resolution='50m')
-            ax2.set_extent(ci.barent_extent, crs=ccrs.PlateCarree())
-            ax2.set_title('data status, green means good', fontsize=25)
-            plt.savefig(f'./plots/ice divergence/divergence-{ds.start_date}_to_{ds.stop_date}.png', bbox_inches='tight')
-            plt.close(fig)
-            print(ds.start_date, ds.stop_date)
+        with self.open_product() as product:
+            lon, lat = product['lon'][:], product['lat'][:]
+            for n, start, stop in self.product_steps(product):
+                div = loaders.read(product['div'], n)
+
+                # plot divergence
+                # fig, ax = pl.setup_plot(None)
+                fig, (ax1, ax2) = plt.subplots(1, 2, subplot_kw={"projection": ccrs.NorthPolarStereo(-45)},
+                                               constrained_layout=True)
+                fig.set_size_inches(32, 18)
+                cap = 2.e-06
+                im = ax1.pcolormesh(lon, lat, div, transform=ccrs.PlateCarree(), vmax=cap, vmin=-cap)
+                ax1.coastlines(resolution='50m')
+                ax1.set_extent(ci.barent_extent, crs=ccrs.PlateCarree())
+                cbar1 = fig.colorbar(im, ax=ax1)
+                cbar1.ax.tick_params(axis='both', labelsize=25)
+                ax1.set_title(f'ice divergence in 1/s \n start:{start} stop:{stop}', fontsize=25)
+
+                im2 = ax2.pcolormesh(lon, lat, product['flag'][n], transform=ccrs.PlateCarree(), cmap='Accent')
+                cbar2 = fig.colorbar(im2, ax=ax2)
+                cbar2.set_ticks([0, 1, 2, 4, 5])
+                cbar2.set_ticklabels(['valid', 'correlation less than min', 'drift speed larger than max', 'invalid',
+                                      'invalid (filter)'])
+                cbar2.ax.tick_params(labelsize=25)
+                ax2.coastlines(resolution='50m')
+                ax2.set_extent(ci.barent_extent, crs=ccrs.PlateCarree())
+                ax2.set_title('data status, green means good', fontsize=25)
+                plt.savefig(f'./plots/ice divergence/divergence-{start:%Y%m%d%H%M}_to_{stop:%Y%m%d%H%M}.png',
+                            bbox_inches='tight')
+                plt.close(fig)
+                profiling.progress(start, product['time'].size)
+
+
+def derived_drift(eumetsat, date):
+    # displacement (km), its length, divergence and shear of date from a single read of the displacement
+    dX, dY = eumetsat.get_disp(date)
+    return {'dX': dX, 'dY': dY, 'speed': (dX ** 2 + dY ** 2) ** .5, 'div': eumetsat.ice_div(date, (dX, dY)),
+            'shear': eumetsat.ice_shear(date, (dX, dY))}
 
 
 class Eumetsat:
-    def __init__(self, extent):
+    def __init__(self, extent, on_disk=False):
         self.drift_width = {ci.barent_extent: .008, ci.arctic_extent: None}
         self.drift_scale = {ci.barent_extent: 5, ci.arctic_extent: 10}
         cols = {ci.barent_extent: 6, ci.arctic_extent: 4}
@@ -155,7 +242,13 @@ class Eumetsat:
 
         self.time = None
         self.skip = 2
+        self.prefetch_days = 4
         self.ds_drift = nc.Dataset('./data/drift_combined.nc')
+        # derived drift fields of the last derived_cache_size dates, on_disk: all dates are also kept in ./pickles
+        self.derived_days = collections.OrderedDict()
+        self.derived_cache_size = 32
+        self.on_disk = on_disk
+        self.derived_dir = './pickles/eumetsat_drift'
 
         for path in self.path_list:
             if path == '.DS_Store':
@@ -169,18 +262,19 @@ class Eumetsat:
         self.lon, self.lat = dummy['lon'][:], dummy['lat'][:]
         self.xc, self.yc = 1000*dummy['xc'][:], 1000*dummy['yc'][:]
         self.lonlat_mask = ~lonlat_mask(self.extent, self.lon, self.lat)
+        # only the box around the extent is read, the cells outside of the extent are NaN anyway
+        self.region = regions.region('eumetsat', self.extent)
 
     def get_disp(self, date):
         # choose the right data set corresponding to date
         ds = self.data_sets[dscience.string_time_to_datetime(date) + datetime.timedelta(days=1)]
 
         # Get Variables for ice displacement in km
-        # set masked values to NaN
-        dY = ds['dY'][0, :]
-        dY[dY.mask] = np.nan
+        # fill values are NaN already, cells outside of the extent are set to NaN
+        with profiling.span('Eumetsat read displacement', 'io'):
+            dY = regions.read(ds['dY'], 0, self.region)
+            dX = regions.read(ds['dX'], 0, self.region)
         dY[self.lonlat_mask] = np.nan
-        dX = ds['dX'][0, :]
-        dX[dX.mask] = np.nan
         dX[self.lonlat_mask] = np.nan
 
         # correct dY for different axis
@@ -188,18 +282,57 @@ class Eumetsat:
             dY = -dY
         return dX, dY
 
+    def derived_file(self, date):
+        return f'{self.derived_dir}/{self.file.replace(" ", "_")}_{date}.npz'
+
+    def derived(self, dates):
+        # (date, derived_drift fields) of all dates. Dates that are neither in memory nor on disk are computed ahead in
+        # a background process. The most recent dates stay in memory (least recently used first out), so repeated
+        # plots of a date range read and difference every date only once.
+        missing = [date for date in dict.fromkeys(dates) if date not in self.derived_days and
+                   not (self.on_disk and os.path.isfile(self.derived_file(date)))]
+        pending = set(missing)
+        computed = prefetch.prefetch(missing, derived_drift, setup=partial(Eumetsat, self.extent),
+                                     ahead=self.prefetch_days)
+        try:
+            for date in dates:
+                if date in self.derived_days:
+                    self.derived_days.move_to_end(date)
+                    yield date, self.derived_days[date]
+                    continue
+
+                if date in pending:
+                    fields = next(computed)[1]
+                    pending.discard(date)
+                    if self.on_disk:
+                        os.makedirs(self.derived_dir, exist_ok=True)
+                        np.savez(self.derived_file(date), **fields)
+                elif self.on_disk and os.path.isfile(self.derived_file(date)):
+                    with np.load(self.derived_file(date)) as stored:
+                        fields = dict(stored)
+                else:
+                    # dropped from the cache since the start of this loop
+                    fields = derived_drift(self, date)
+                self.derived_days[date] = fields
+                while len(self.derived_days) > self.derived_cache_size:
+                    self.derived_days.popitem(last=False)
+                yield date, fields
+        finally:
+            computed.close()
+
     def get_drift(self, date):
         d1 = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 12, 0, 0, 0) - datetime.timedelta(days=1)
         self.time = self.ds_drift['time']
         t1 = cftime.date2index(d1, self.time)
 
         # return drift speed in m/s
-        return [1000 * self.ds_drift['dX'][t1] / 172800, 1000 * self.ds_drift['dY'][t1] / 172800]
+        return [1000 * regions.read(self.ds_drift['dX'], t1, self.region) / 172800,
+                1000 * regions.read(self.ds_drift['dY'], t1, self.region) / 172800]
         pass
 
-    def ice_div(self, date):
-        # choose the right data set corresponding to date
-        dX, dY = self.get_disp(date)
+    def ice_div(self, date, disp=None):
+        # choose the right data set corresponding to date, disp: displacement of date if it is already loaded
+        dX, dY = disp if disp is not None else self.get_disp(date)
         # observation time (48h) in seconds
         dt = 172800
 
@@ -210,13 +343,14 @@ class Eumetsat:
         # distance between two cells is always 62.5 km (both x,y direction)
         #du, dv = matrix_neighbour_diff(u, v)
 
-        du, dv = matrix_neighbour_diff(u, v)
+        with profiling.span('Eumetsat divergence', 'compute'):
+            du, dv = matrix_neighbour_diff(u, v)
 
         return (du + dv)/125
 
-    def ice_shear(self, date):
+    def ice_shear(self, date, disp=None):
         # choose the right data set corresponding to date
-        dX, dY = self.get_disp(date)
+        dX, dY = disp if disp is not None else self.get_disp(date)
         # observation time (48h) in seconds
         dt = 172800
 
@@ -227,27 +361,28 @@ class Eumetsat:
         # distance between two cells is always 62.5 km (both x,y direction)
         # du, dv = matrix_neighbour_diff(u, v)
 
-        hy = np.empty((dY.shape[0], 1))
-        vx = np.empty((1, dX.shape[1]))
-        hy[:], vx[:] = np.nan, np.nan
-        up1 = np.hstack((np.hstack((u, hy)), hy))
-        vp1 = np.vstack((vx, np.vstack((vx, v))))
-        up1, vp1 = np.delete(up1, 0, 1), np.delete(vp1, -1, 0)
-        up1, vp1 = np.delete(up1, 0, 1), np.delete(vp1, -1, 0)
-        du, dv = up1 - u, vp1 - v
+        with profiling.span('Eumetsat shear', 'compute'):
+            hy = np.empty((dY.shape[0], 1))
+            vx = np.empty((1, dX.shape[1]))
+            hy[:], vx[:] = np.nan, np.nan
+            up1 = np.hstack((np.hstack((u, hy)), hy))
+            vp1 = np.vstack((vx, np.vstack((vx, v))))
+            up1, vp1 = np.delete(up1, 0, 1), np.delete(vp1, -1, 0)
+            up1, vp1 = np.delete(up1, 0, 1), np.delete(vp1, -1, 0)
+            du, dv = up1 - u, vp1 - v
 
         return (du - dv) / 125
 
     def plot_div(self, dates):
         divs = []
         cap = 0
-        for date in dates:
-            div = self.ice_div(date)
-            cap = max([cap, abs(div.min()), abs(div.max())])
+        for date, fields in self.derived(dates):
+            div = fields['div']
+            cap = max([cap, abs(np.nanmin(div)), abs(np.nanmax(div))])
             divs.append(div)
 
         for date, div in zip(dates, divs):
-            print(date)
+            profiling.progress(date, len(dates))
             fig, ax = plot.setup_plot(self.extent)
             im = ax.pcolormesh(self.lon, self.lat, div, transform=ccrs.PlateCarree(), vmax=cap, vmin=-cap, cmap='bwr')
             ax.set_title(f'Ice divergence in 1/s \n {dscience.string_time_to_datetime(date)}', fontsize=25)
@@ -262,14 +397,13 @@ class Eumetsat:
         cap = 0
         factor = 1000 / 172800
         images = []
-        for date in dates:
-            quiv = self.get_disp(date)
-            quivs.append(quiv)
-            lengths.append((quiv[0]**2 + quiv[1]**2)**.5)
-            cap = max([cap, lengths[-1].max()])
+        for date, fields in self.derived(dates):
+            quivs.append((fields['dX'], fields['dY']))
+            lengths.append(fields['speed'])
+            cap = max([cap, np.nanmax(lengths[-1])])
 
         for date, quiv, length in zip(dates, quivs, lengths):
-            print(date)
+            profiling.progress(date, len(dates))
             print(self.xc.shape, self.yc.shape)
             fig, ax = plot.setup_plot(self.extent)
             im = ax.quiver(self.xc, self.yc, quiv[0] * factor, quiv[1] * factor, length * factor, scale=10, clim=(None, cap * factor),
@@ -302,19 +436,18 @@ class Eumetsat:
         im = None
         lon, lat = None, None
         dim = (50, 50)
-        for date in dates:
-            quiv = self.get_disp(date)
-            quivs.append(quiv)
-            lengths.append((quiv[0] ** 2 + quiv[1] ** 2) ** .5)
-            q_cap = max([q_cap, lengths[-1].max()])
+        for date, fields in self.derived(dates):
+            quivs.append((fields['dX'], fields['dY']))
+            lengths.append(fields['speed'])
+            q_cap = max([q_cap, np.nanmax(lengths[-1])])
 
             Wind, resize = plot.ds_from_var('wind_quiver', date)
-            lat_dir, lon_dir = Wind.get_quiver(date)
+            lat_dir, lon_dir = leads.era5_day('wind_quiver', date, 'get_quiver', regrid=True)
             lon, lat = resize(Wind.lon, dim), resize(Wind.lat, dim)
             wind_quiv = resize(lon_dir, dim), resize(lat_dir, dim)
             wind_quivs.append(wind_quiv)
             w_lenghts.append((wind_quiv[0] ** 2 + wind_quiv[1] ** 2) ** .5)
-            w_cap = max([w_cap, w_lenghts[-1].max()])
+            w_cap = max([w_cap, np.nanmax(w_lenghts[-1])])
 
         for i in range(int(len(dates) / 6)):
             fig, axs = self.setup_plot()
@@ -347,13 +480,12 @@ class Eumetsat:
         d_cap = 0
         factor = 1000 / 172800
         im = None
-        for date in dates:
-            quiv = self.get_disp(date)
-            div = self.ice_div(date)
-            quivs.append(quiv)
-            lengths.append((quiv[0] ** 2 + quiv[1] ** 2) ** .5)
-            q_cap = max([q_cap, lengths[-1].max()])
-            d_cap = max([d_cap, abs(div.min()), abs(div.max())])
+        for date, fields in self.derived(dates):
+            div = fields['div']
+            quivs.append((fields['dX'], fields['dY']))
+            lengths.append(fields['speed'])
+            q_cap = max([q_cap, np.nanmax(lengths[-1])])
+            d_cap = max([d_cap, abs(np.nanmin(div)), abs(np.nanmax(div))])
             divs.append(div)
 
         for i in range(int(len(dates)/self.ncols)):
@@ -386,13 +518,12 @@ class Eumetsat:
         d_cap = 0
         factor = 1000 / 172800
         im = None
-        for date in dates:
-            quiv = self.get_disp(date)
-            vort = self.ice_shear(date)
-            quivs.append(quiv)
-            lengths.append((quiv[0] ** 2 + quiv[1] ** 2) ** .5)
-            q_cap = max([q_cap, lengths[-1].max()])
-            d_cap = max([d_cap, abs(vort.min()), abs(vort.max())])
+        for date, fields in self.derived(dates):
+            vort = fields['shear']
+            quivs.append((fields['dX'], fields['dY']))
+            lengths.append(fields['speed'])
+            q_cap = max([q_cap, np.nanmax(lengths[-1])])
+            d_cap = max([d_cap, abs(np.nanmin(vort)), abs(np.nanmax(vort))])
             vorts.append(vort)
 
         for i in range(int(len(dates)/self.ncols)):
@@ -424,13 +555,13 @@ class Eumetsat:
         d_cap = 0
         im = None
         lon, lat = leads.CoordinateGrid().lon, leads.CoordinateGrid().lat
-        m_lon, m_lat = leads.Era5('msl').lon, leads.Era5('msl').lat
+        m_lon, m_lat = leads.era5('msl').lon, leads.era5('msl').lat
         path = None
 
-        for date in dates:
-            msl = leads.Era5('msl').get_variable(date)
-            div = self.ice_div(date)
-            d_cap = max([d_cap, abs(div.min()), abs(div.max())])
+        for date, fields in self.derived(dates):
+            msl = leads.era5_day('msl', date)
+            div = fields['div']
+            d_cap = max([d_cap, abs(np.nanmin(div)), abs(np.nanmax(div))])
             divs.append(div)
             msls.append(msl)
 
@@ -471,19 +602,19 @@ class Eumetsat:
         q_cap = 0
         im = None
         lon, lat = leads.CoordinateGrid().lon, leads.CoordinateGrid().lat
-        m_lon, m_lat = leads.Era5('msl').lon, leads.Era5('msl').lat
+        m_lon, m_lat = leads.era5('msl').lon, leads.era5('msl').lat
         factor = 100
         path = None
         print(self.xc.size)
         self.xc, self.yc = self.xc[::self.skip], self.yc[::self.skip]
 
         for date in dates:
-            msl = leads.Era5('msl').get_variable_drift(date)
+            msl = leads.era5_day('msl', date, 'get_variable_drift')
             quiv = self.get_drift(date)
             msls.append(msl)
             quivs.append(quiv)
             lengths.append((quiv[0] ** 2 + quiv[1] ** 2) ** .5)
-            q_cap = max([q_cap, lengths[-1].max()])
+            q_cap = max([q_cap, np.nanmax(lengths[-1])])
 
             if new:
                 lead.append(leads.Lead(date).new_leads())
@@ -538,10 +669,8 @@ class GeneralEumetsat:
         ds = nc.Dataset(self.path)
 
         # get displacement
-        self.dX = ds['dX'][0, :].T * 1000
-        self.dY = ds['dY'][0, :].T * 1000
-        self.dY[self.dY.mask] = np.nan
-        self.dX[self.dX.mask] = np.nan
+        self.dX = loaders.read(ds['dX'], 0).T * 1000
+        self.dY = loaders.read(ds['dY'], 0).T * 1000
         if float(ds.product_version) < 1.4:
             self.dY = -self.dY
 
@@ -663,6 +792,10 @@ def divergence_test():
 
 
 if __name__ == '__main__':
+    # CMEMS divergence product, the plots of IceDivergence read it
+    # IceDivergence().build_product(processes=4)
+    # IceDivergence().ice_div()
+
     # all plots related to ice drift Barent Sea
     # all_dates = dscience.time_delta('20200102', '20200429')
     # Eumetsat(ci.barent_extent).plot_drift_leads(all_dates, True)
@@ -0,0 +1,289 @@
+# Job runner. Instead of editing the __main__ blocks of lead_cyc_analysis, budgets, ice_divergence and plot, an
+# analysis is described in a JSON job file and run from the command line:
+#
+#   python jobs.py job.json                     run the outputs of the job
+#   python jobs.py job.json --dry-run           print the stages that would run
+#   python jobs.py job.json --force composite   recompute a cached stage (and everything that uses it)
+#   python jobs.py --list                       stages of all analyses
+#
+#   {"analysis": "lead_cyc", "date1": "20021105", "date2": "20220430", "extent": "arctic_extent",
+#    "sic_filter": 95, "delta_days": 3, "collect_ice_div": true, "checkpoint_days": 100,
+#    "outputs": ["plot_clustered_leads", {"stage": "plot_trends", "field": "cycs", "aggregate": "month"}]}
+#
+# extent is the name of an extent in case_information or a list [lon1, lon2, lat1, lat2]. An output is the name of a
+# stage or a dict of the stage name and its keyword arguments. Every analysis is a small graph of stages, a stage gets
+# the results of the stages it requires. Results of cached stages are pickled in ./pickles/jobs and reused by later
+# runs of a job with the same settings. Stages that stream over the dates (composite, budgets) work in chunks of
+# checkpoint_days days and pickle their accumulators after every chunk, an interrupted run continues after the last
+# finished chunk.
+import argparse
+import hashlib
+import json
+import os
+import pickle
+from functools import partial
+import case_information as ci
+import composites
+import data_science as ds
+import budgets
+import ice_divergence
+import lead_cyc_analysis as lca
+import plot
+
+job_path = './pickles/jobs'
+
+
+def save_checkpoint(path, state):
+    # write to a temporary file first, a crash while writing must not destroy the last checkpoint
+    with open(f'{path}.tmp', 'wb') as filehandler:
+        pickle.dump(state, filehandler)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as pickle_in:
+        return pickle.load(pickle_in)
+
+
+def chunks(n_dates, start, size, overlap=0):
+    # (first, last + 1) index pairs of the remaining chunks of size days, chunks share overlap days
+    for first in range(start, n_dates - overlap, size):
+        yield first, min(first + size + overlap, n_dates)
+
+
+class Stage:
+    def __init__(self, run, requires=(), cached=True, checkpointed=False):
+        # run(job, inputs, **args) -> result, inputs maps the names of the required stages to their results.
+        # Checkpointed stages also get checkpoint=path of their checkpoint file.
+        self.run = run
+        self.requires = tuple(requires)
+        self.cached = cached
+        self.checkpointed = checkpointed
+
+
+class Job:
+    def __init__(self, config):
+        self.config = dict(config)
+        self.analysis = config['analysis']
+        if self.analysis not in pipelines:
+            raise ValueError(f'unknown analysis {self.analysis}, choose from {sorted(pipelines)}')
+        self.stages = pipelines[self.analysis]
+
+        self.date1, self.date2 = config['date1'], config['date2']
+        self.dates = ds.time_delta(self.date1, self.date2)
+        extent = config.get('extent', 'arctic_extent')
+        self.extent = getattr(ci, extent) if isinstance(extent, str) else tuple(extent)
+        self.sic_filter = float(config.get('sic_filter', 95.))
+        self.delta_days = int(config.get('delta_days', 3))
+        self.collect_ice_div = bool(config.get('collect_ice_div', True))
+        self.checkpoint_days = int(config.get('checkpoint_days', 100))
+
+        self.outputs = []
+        for output in config.get('outputs', []):
+            output = {'stage': output} if isinstance(output, str) else dict(output)
+            name = output.pop('stage')
+            if name not in self.stages:
+                raise ValueError(f'unknown stage {name} of {self.analysis}, choose from {sorted(self.stages)}')
+            self.outputs.append((name, output))
+
+        # results are only shared between jobs that agree on everything except outputs and chunk size
+        settings = {key: value for key, value in self.config.items() if key not in ['outputs', 'checkpoint_days']}
+        digest = hashlib.md5(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:8]
+        self.key = f'{self.analysis}_{self.dates[0]}_{self.dates[-1]}_{digest}'
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def path(self, stage, args=None):
+        suffix = '_' + hashlib.md5(json.dumps(args, sort_keys=True).encode()).hexdigest()[:8] if args else ''
+        return f'{job_path}/{self.key}_{stage}{suffix}.pkl'
+
+    def order(self):
+        # stages needed for the outputs, every stage after the stages it requires
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f'cyclic requirement of stage {name}')
+            visiting.add(name)
+            for required in self.stages[name].requires:
+                visit(required)
+            visiting.discard(name)
+            order.append(name)
+
+        for name, _ in self.outputs:
+            visit(name)
+        return order
+
+    def run(self, force=(), dry_run=False):
+        # run the stages in order, forced stages and the stages depending on them are recomputed
+        os.makedirs(job_path, exist_ok=True)
+        args = dict(self.outputs)
+        results, stale = {}, set(force)
+
+        for name in self.order():
+            stage = self.stages[name]
+            if stale & set(stage.requires):
+                stale.add(name)
+            path = self.path(name, args.get(name))
+            if stage.cached and name not in stale and os.path.isfile(path):
+                print(f'{name}: cached {path}')
+                if not dry_run:
+                    with open(path, 'rb') as pickle_in:
+                        results[name] = pickle.load(pickle_in)
+                continue
+
+            print(f'{name}: run')
+            if dry_run:
+                continue
+            if name in stale and os.path.isfile(f'{path}.ckpt'):
+                os.remove(f'{path}.ckpt')
+            inputs = {required: results[required] for required in stage.requires}
+            kwargs = dict(args.get(name, {}), **({'checkpoint': f'{path}.ckpt'} if stage.checkpointed else {}))
+            results[name] = stage.run(self, inputs, **kwargs)
+            if stage.cached:
+                with open(path, 'wb') as filehandler:
+                    pickle.dump(results[name], filehandler)
+                if os.path.isfile(f'{path}.ckpt'):
+                    os.remove(f'{path}.ckpt')
+        return results
+
+    def lead_cyc_analysis(self, date1=None, date2=None):
+        A = lca.Analysis(date1 if date1 else self.date1, date2 if date2 else self.date2, self.extent,
+                         self.collect_ice_div)
+        A.sic_filter, A.delta_days = self.sic_filter, self.delta_days
+        return A
+
+
+# lead_cyc: composites of lead fraction and divergence with and without cyclones, trends
+
+def lead_cyc_composite(job, inputs, checkpoint):
+    # composite of all days, the composites of the chunks are merged, cyc_prior looks back beyond the chunk start
+    state = load_checkpoint(checkpoint)
+    if state is None:
+        state = {'next': 0, 'composite': composites.Composite()}
+    else:
+        print(f'resume after {job.dates[state["next"] - 1]}')
+
+    for first, last in chunks(len(job.dates), state['next'], job.checkpoint_days):
+        A = job.lead_cyc_analysis(job.dates[first], job.dates[last - 1])
+        state['composite'].merge(A.composite())
+        state['next'] = last
+        save_checkpoint(checkpoint, state)
+    return state['composite']
+
+
+def lead_cyc_clustered(job, inputs):
+    return job.lead_cyc_analysis().clustered_means(inputs['composite'])
+
+
+def lead_cyc_plot_clustered(job, inputs):
+    job.lead_cyc_analysis().plot_clustered_leads(clustered=inputs['clustered_leads'])
+
+
+def lead_cyc_pixel_store(job, inputs, field='leads'):
+    # the store is kept in ./pickles by Analysis.pixel_store itself
+    job.lead_cyc_analysis().pixel_store(field)
+
+
+def lead_cyc_trends(job, inputs, field='leads', aggregate='season', processes=None, memory_mb=256):
+    return job.lead_cyc_analysis().trend_maps(field, aggregate, processes, memory_mb)
+
+
+def lead_cyc_plot_trends(job, inputs, field='leads', aggregate='season', alpha=.05, vmax=None):
+    job.lead_cyc_analysis().plot_trends(field, aggregate, alpha, vmax)
+
+
+# budgets: daily sea ice budgets of the drift product
+
+budget_fields = ['advs', 'divs', 'ints', 'ress', 'adv_cap', 'div_cap', 'int_cap', 'res_cap']
+
+
+def budget_series(job, inputs, checkpoint):
+    # chunks overlap by one day, the first day of a chunk only provides the sic of the day before
+    state = load_checkpoint(checkpoint)
+    if state is None:
+        ice_data = budgets.IceData(job.extent)
+        state = {'next': 0, 'dates': [], **{field: getattr(ice_data, field) for field in budget_fields}}
+    else:
+        print(f'resume after {job.dates[state["next"]]}')
+
+    for first, last in chunks(len(job.dates), state['next'], job.checkpoint_days, overlap=1):
+        ice_data = budgets.IceData(job.extent)
+        for field in budget_fields:
+            setattr(ice_data, field, state[field])
+        state['dates'] += ice_data.get_budgets(job.dates[first], job.dates[last - 1])
+        state.update({field: getattr(ice_data, field) for field in budget_fields})
+        state['next'] = last - 1
+        save_checkpoint(checkpoint, state)
+    return state
+
+
+def budget_plot(job, inputs, monthly=False):
+    ice_data = budgets.IceData(job.extent)
+    for field in budget_fields:
+        setattr(ice_data, field, inputs['budgets'][field])
+    ice_data.plot_budget_maps(inputs['budgets']['dates'], monthly)
+
+
+# eumetsat: drift, divergence and vorticity maps of the OSI SAF drift, one method of ice_divergence.Eumetsat per stage,
+# the derived drift fields are kept on disk so the stages of a job share them
+
+def eumetsat_plot(method, job, inputs, **kwargs):
+    getattr(ice_divergence.Eumetsat(job.extent, on_disk=True), method)(job.dates, **kwargs)
+
+
+# plot: maps and time series of plot.py
+
+def regional_plot(job, inputs, variable=('leads',)):
+    plot.RegionalPlot(job.date1, job.date2, list(variable), job.extent)
+
+
+def variables_against_time(job, inputs, var1='leads', var2='cyclone_occurence', rolling_avg=True, w=7):
+    plot.variables_against_time(job.date1, job.date2, job.extent, var1, var2, rolling_avg=rolling_avg, w=w)
+
+
+pipelines = {
+    'lead_cyc': {'composite': Stage(lead_cyc_composite, checkpointed=True),
+                 'clustered_leads': Stage(lead_cyc_clustered, ['composite']),
+                 'plot_clustered_leads': Stage(lead_cyc_plot_clustered, ['clustered_leads'], cached=False),
+                 'pixel_store': Stage(lead_cyc_pixel_store, cached=False),
+                 'trend_maps': Stage(lead_cyc_trends, ['pixel_store'], cached=False),
+                 'plot_trends': Stage(lead_cyc_plot_trends, ['trend_maps'], cached=False)},
+    'budgets': {'budgets': Stage(budget_series, checkpointed=True),
+                'plot_budgets': Stage(budget_plot, ['budgets'], cached=False)},
+    'eumetsat': {method: Stage(partial(eumetsat_plot, method), cached=False)
+                 for method in ['plot_div', 'plot_drift', 'plot_drift_wind', 'plot_drift_div', 'plot_drift_vort',
+                                'plot_div_leads', 'plot_drift_leads']},
+    'plot': {'regional_plot': Stage(regional_plot, cached=False),
+             'variables_against_time': Stage(variables_against_time, cached=False)},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the analysis described in a JSON job file.')
+    parser.add_argument('job', nargs='?', help='path of the job file')
+    parser.add_argument('--force', nargs='+', default=[], help='recompute these stages even if they are cached')
+    parser.add_argument('--dry-run', action='store_true', help='only print the stages that would run')
+    parser.add_argument('--list', action='store_true', help='list the stages of all analyses')
+    args = parser.parse_args()
+
+    if args.list:
+        for analysis, stages in pipelines.items():
+            print(analysis)
+            for name, stage in stages.items():
+                print(f'    {name}' + (f' <- {", ".join(stage.requires)}' if stage.requires else ''))
+        return
+    if args.job is None:
+        parser.error('a job file is required')
+    Job.from_file(args.job).run(force=args.force, dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
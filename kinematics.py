@@ -0,0 +1,102 @@
+# Wind kinematics on the regular lat/lon grid of ERA5. Divergence, relative vorticity and the curl of the wind stress
+# are computed on the sphere,
+#
+#   div  = 1 / (R cos(lat)) * (du/dlon + d(v cos(lat))/dlat)
+#   vort = 1 / (R cos(lat)) * (dv/dlon - d(u cos(lat))/dlat)
+#
+# with centred differences, a periodic longitude axis and the cos(lat) metric terms computed once per grid. Whole
+# (time, lat, lon) stacks are processed at once, e.g. all 6-hourly steps of a season:
+#
+#   times, fields = kinematics.era5_steps('20191101', '20200430', fields=('div', 'curl'))
+#   div = kinematics.SphericalGrid.era5().divergence(u10, v10)         # single (lat, lon) field
+#
+# The wind stress is the bulk formula tau = rho_air * c_drag * |U| * U with a constant drag coefficient.
+import datetime
+import cftime
+import numpy as np
+import leads
+import precision
+import regions
+
+earth_radius = 6371000.
+rho_air = 1.25
+c_drag = 1.3e-3
+
+
+class SphericalGrid:
+    _era5 = None
+
+    def __init__(self, lon, lat):
+        # 1d longitude and latitude axes in degrees, latitudes may be descending
+        lon, lat = np.ma.filled(lon, np.nan).astype(np.float64), np.ma.filled(lat, np.nan).astype(np.float64)
+        self.lam, self.phi = np.deg2rad(lon), np.deg2rad(lat)
+        self.dlam = abs(self.lam[1] - self.lam[0])
+        self.periodic = abs(self.dlam * len(lon) - 2 * np.pi) < 1e-6
+
+        # metric terms, NaN on the pole rows where 1 / cos(lat) is undefined
+        self.cos = np.cos(self.phi)[:, None]
+        pole = np.abs(self.cos) < 1e-10
+        with np.errstate(divide='ignore'):
+            self.inv_r_cos = np.where(pole, np.nan, 1 / (earth_radius * self.cos))
+
+    @classmethod
+    def era5(cls):
+        # grid of ERA5_METAs.nc, shared by all callers
+        if cls._era5 is None:
+            data_set = leads.era5('wind_quiver')
+            cls._era5 = cls(data_set.lon[0], data_set.lat[:, 0])
+        return cls._era5
+
+    def d_lon(self, f):
+        # centred difference along the last axis, wrapped around the globe if the grid is periodic
+        if self.periodic:
+            return (np.roll(f, -1, axis=-1) - np.roll(f, 1, axis=-1)) / (2 * self.dlam)
+        return np.gradient(f, self.lam, axis=-1)
+
+    def d_lat(self, f):
+        # centred difference along the second to last axis, one sided on the first and last row
+        return np.gradient(f, self.phi, axis=-2)
+
+    def divergence(self, u, v):
+        return self.inv_r_cos * (self.d_lon(u) + self.d_lat(v * self.cos))
+
+    def vorticity(self, u, v):
+        return self.inv_r_cos * (self.d_lon(v) - self.d_lat(u * self.cos))
+
+    def stress_curl(self, u, v):
+        speed = np.sqrt(u ** 2 + v ** 2)
+        return self.vorticity(rho_air * c_drag * speed * u, rho_air * c_drag * speed * v)
+
+
+operators = {'div': SphericalGrid.divergence, 'vort': SphericalGrid.vorticity, 'curl': SphericalGrid.stress_curl}
+
+
+def kinematics(u, v, grid, fields=('div', 'vort', 'curl'), block=124):
+    # (time, lat, lon) stacks of u and v -> {field: (time, lat, lon) stack in precision.dtype}. The differences are
+    # taken in float64 for block time steps at once (124 steps are a month of 6-hourly data).
+    out = {field: np.empty(u.shape, dtype=precision.dtype) for field in fields}
+    for t in range(0, u.shape[0], block):
+        u_block = np.asarray(u[t:t + block], dtype=np.float64)
+        v_block = np.asarray(v[t:t + block], dtype=np.float64)
+        for field in fields:
+            out[field][t:t + block] = operators[field](grid, u_block, v_block)
+    return out
+
+
+def era5_steps(date1, date2, fields=('div', 'vort', 'curl'), region=None, block=124):
+    # all 6-hourly steps from date1 00:00 to date2 18:00, read in one go, region: box of regions.region('era5', extent)
+    data_set = leads.era5('wind_quiver', region=region)
+    d1 = datetime.datetime(int(date1[:4]), int(date1[4:6]), int(date1[6:]), 0)
+    d2 = datetime.datetime(int(date2[:4]), int(date2[4:6]), int(date2[6:]), 18)
+    t1, t2 = cftime.date2index([d1, d2], data_set.time)
+    times = cftime.num2date(data_set.time[t1:t2 + 1], data_set.time.units,
+                            getattr(data_set.time, 'calendar', 'standard'))
+
+    u = regions.read(data_set.u10, slice(t1, t2 + 1), region, dtype=precision.dtype)
+    v = regions.read(data_set.v10, slice(t1, t2 + 1), region, dtype=precision.dtype)
+    return times, kinematics(u, v, SphericalGrid.era5(), fields, block)
+
+
+if __name__ == '__main__':
+    # times, fields = era5_steps('20191201', '20191231')
+    pass
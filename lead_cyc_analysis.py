@@ -1,3 +1,7 @@
+import datetime
+import os
+import cftime
+import netCDF4 as nc
 import numpy as np
 import case_information as ci
 import leads
@@ -5,9 +9,19 @@ import matplotlib.pyplot as plt
 import data_science as ds
 import cartopy.crs as ccrs
 from datetime import date, timedelta
-from scipy.stats import ttest_ind
 import pickle
 import ice_divergence as ice_div
+import catalog
+import composites
+import loaders
+import precision
+import profiling
+import significance
+import trends
+import pixel_store as ps
+import prefetch
+from functools import partial
+from multiprocessing import Pool
 
 
 class Analysis:
@@ -23,47 +37,49 @@ class Analysis:
 
         self.collect_ice_div = collect_ice_div
         self.missing_dates = []
+        self.catalog = catalog.DataCatalog.get()
+        # days read ahead by collect_leads_cycs, 0 reads in the main process
+        self.prefetch_days = 4
 
     def collect_leads_cycs(self, return_for_export=False):
-        # print(self.dates)
+        # days without lead, cyclone or sic data are not loaded but masked with NaN up front, the other days are read
+        # ahead in a background process (prefetch_days days at most) while the current day is processed
+        self.missing_dates = self.catalog.missing(self.dates, 'lead', 'cyc', 'sic')
+        available = [date for date in self.dates if date not in self.missing_dates]
+        days = prefetch.prefetch(available, partial(load_lead_cyc_day, delta_days=self.delta_days,
+                                                    collect_ice_div=self.collect_ice_div), ahead=self.prefetch_days)
         for date in self.dates:
-            print(date)
-            # load class
-            leadally = leads.LeadAllY(date)
-            # get lead data
-            lead_data = leadally.lead_data
-            lead_data[100 * leadally.sic_data <= self.sic_filter] = np.nan
-            self.leads.append(lead_data)
-
-            # get cyclone data from current and last day
-            # cyc = .01 * leads.Era5Regrid('cyclone_occurence').get_variable(date).data
-            cyc = 1.0 * leadally.cyc_data
-
-            # cluster cells as cyclone if cyclone frequency >= .5
-            cyc[cyc <= .25] = np.nan
-            cyc[cyc > .25] = 1.
-
+            if date in self.missing_dates:
+                for collection in [self.leads, self.cycs, self.cycs_past] + [self.divs] * self.collect_ice_div:
+                    collection.append(precision.full(self.lat.shape))
+                continue
+            profiling.progress(date, len(self.dates))
+            _, day = next(days)
+            with profiling.span('sic filter and cyclone threshold', 'compute'):
+                # get lead data
+                lead_data = day['lead']
+                lead_data[100 * day['sic'] <= self.sic_filter] = np.nan
+                self.leads.append(lead_data)
+
+                # get cyclone data from current and last day
+                # cyc = .01 * leads.Era5Regrid('cyclone_occurence').get_variable(date).data
+                cyc = day['cyc']
+
+                # cluster cells as cyclone if cyclone frequency >= .5
+                cyc[cyc <= .25] = np.nan
+                cyc[cyc > .25] = 1.
+
+            # cyclone today or on one of the delta_days days before
             cyc_past = np.copy(cyc)
-            for i in range(1, self.delta_days + 1):
-                past_day = ds.datetime_to_string(ds.string_time_to_datetime(date) - timedelta(days=i))
-                cyc_p = 1. * leads.LeadAllY(past_day).cyc_data
-                cyc_p[cyc_p <= .25] = np.nan
-                cyc_p[cyc_p > .25] = 1.
-                cyc_p[cyc_past == 1.] = 1.
-                cyc_past = np.copy(cyc_p)
+            cyc_past[day['cyc_prior']] = 1.
 
             self.cycs.append(cyc)
             self.cycs_past.append(cyc_past)
 
             if self.collect_ice_div:
-                # load ice divergence data and coords
-                try:
-                    self.divs.append(leadally.ice_div.T)
-                except FileNotFoundError:
-                    print('Could not find date: ', date)
-                    print('Add empty array to list, should not affect results')
-                    self.divs.append(np.empty(self.divs[-1].shape))
-                    self.missing_dates.append(date)
+                # missing drift data is NaN in leadally.ice_div
+                self.divs.append(day['div'])
+        days.close()
 
         if self.missing_dates:
             print('missing dates: ', self.missing_dates)
@@ -75,45 +91,111 @@ class Analysis:
         # get average lead fraction for all time instances with cyclone (today and/or yesterday), without cyclone
         self.collect_leads_cycs()
         print('finished collecting\nstart clustering')
+        if not matrix3d:
+            # means only need the composite sums, no masked copies of the days
+            return self.clustered_means(self.composite())
+
         no_cyc_leads, cyc_leads, no_cyc_prior_leads, cyc_prior_leads = [], [], [], []
         no_cyc_divs, cyc_divs = [], []
 
-        for lead, cyc, cyc_past, div in zip(self.leads, self.cycs, self.cycs_past, self.divs):
-            no_cyc_lead, cyc_lead, cyc_prior_lead, no_cyc_prior_lead = np.copy(lead), np.copy(lead), np.copy(
-                lead), np.copy(lead)
-
-            no_cyc_lead[~np.isnan(cyc)] = np.nan
-            cyc_lead[np.isnan(cyc)] = np.nan
-            cyc_prior_lead[np.isnan(cyc_past)] = np.nan
-            no_cyc_prior_lead[~np.isnan(cyc_past)] = np.nan
-
-            no_cyc_leads.append(no_cyc_lead)
-            cyc_leads.append(cyc_lead)
-            cyc_prior_leads.append(cyc_prior_lead)
-            no_cyc_prior_leads.append(no_cyc_prior_lead)
-
-            if self.collect_ice_div:
-                no_cyc_div, cyc_div = np.copy(div), np.copy(div)
-                no_cyc_div[~np.isnan(cyc_past)] = np.nan
-                cyc_div[np.isnan(cyc_past)] = np.nan
-                no_cyc_divs.append(no_cyc_div)
-                cyc_divs.append(cyc_div)
-
-        if matrix3d and self.collect_ice_div:
-            return np.array(no_cyc_leads), np.array(cyc_leads), np.array(cyc_prior_leads), np.array(no_cyc_prior_leads), \
-                   np.array(no_cyc_divs), np.array(cyc_divs)
-
-        elif matrix3d:
-            return np.array(no_cyc_leads), np.array(cyc_leads), np.array(cyc_prior_leads), np.array(no_cyc_prior_leads)
-
-        elif self.collect_ice_div:
-            return np.nanmean(np.array(no_cyc_leads), axis=0), np.nanmean(np.array(cyc_leads), axis=0), \
-                   np.nanmean(np.array(cyc_prior_leads), axis=0), np.nanmean(np.array(no_cyc_prior_leads), axis=0), \
-                   np.nanmean(np.array(no_cyc_divs), axis=0), np.nanmean(np.array(cyc_divs), axis=0)
+        with profiling.span('composites', 'compute'):
+            divs = self.divs if self.collect_ice_div else [None] * len(self.leads)
+            for lead, cyc, cyc_past, div in zip(self.leads, self.cycs, self.cycs_past, divs):
+                no_cyc_lead, cyc_lead, cyc_prior_lead, no_cyc_prior_lead = np.copy(lead), np.copy(lead), np.copy(
+                    lead), np.copy(lead)
+
+                no_cyc_lead[~np.isnan(cyc)] = np.nan
+                cyc_lead[np.isnan(cyc)] = np.nan
+                cyc_prior_lead[np.isnan(cyc_past)] = np.nan
+                no_cyc_prior_lead[~np.isnan(cyc_past)] = np.nan
+
+                no_cyc_leads.append(no_cyc_lead)
+                cyc_leads.append(cyc_lead)
+                cyc_prior_leads.append(cyc_prior_lead)
+                no_cyc_prior_leads.append(no_cyc_prior_lead)
+
+                if self.collect_ice_div:
+                    no_cyc_div, cyc_div = np.copy(div), np.copy(div)
+                    no_cyc_div[~np.isnan(cyc_past)] = np.nan
+                    cyc_div[np.isnan(cyc_past)] = np.nan
+                    no_cyc_divs.append(no_cyc_div)
+                    cyc_divs.append(cyc_div)
+
+        # cubes stay in the data dtype
+        if self.collect_ice_div:
+            return precision.stack(no_cyc_leads), precision.stack(cyc_leads), precision.stack(cyc_prior_leads), \
+                   precision.stack(no_cyc_prior_leads), precision.stack(no_cyc_divs), precision.stack(cyc_divs)
 
         else:
-            return np.nanmean(np.array(no_cyc_leads), axis=0), np.nanmean(np.array(cyc_leads), axis=0), \
-                   np.nanmean(np.array(cyc_prior_leads), axis=0), np.nanmean(np.array(no_cyc_prior_leads), axis=0)
+            return precision.stack(no_cyc_leads), precision.stack(cyc_leads), precision.stack(cyc_prior_leads), \
+                   precision.stack(no_cyc_prior_leads)
+
+    def clustered_means(self, comp):
+        # mean maps of cluster_leads from the composite of the collected days (or a merged composite of several runs)
+        names = ['no_cyc', 'cyc', 'cyc_prior', 'no_cyc_prior']
+        names_div = ['no_cyc_prior', 'cyc_prior'] if self.collect_ice_div else []
+        return tuple([comp.mean('leads', c) for c in names] + [comp.mean('divs', c) for c in names_div])
+
+    @staticmethod
+    def cyc_conditions(cyc, cyc_past):
+        # cyclone conditions of one day: cyclone today / within the last delta_days
+        return {'no_cyc': np.isnan(cyc), 'cyc': ~np.isnan(cyc),
+                'cyc_prior': ~np.isnan(cyc_past), 'no_cyc_prior': np.isnan(cyc_past)}
+
+    def composite(self, conditions=None, pairs=None):
+        # Composites of the collected days in one pass. conditions maps extra condition names to functions
+        # f(lead, cyc, cyc_past, div) -> boolean grid, they are added to the cyclone conditions. Without pairs leads are
+        # composited for all conditions, divergence for the cyc_prior/no_cyc_prior conditions and the extra ones.
+        if not self.leads:
+            self.collect_leads_cycs()
+        conditions = conditions if conditions else {}
+        if pairs is None:
+            pairs = [('leads', c) for c in ['no_cyc', 'cyc', 'cyc_prior', 'no_cyc_prior']]
+            pairs += [('divs', c) for c in ['no_cyc_prior', 'cyc_prior']] * self.collect_ice_div
+            pairs += [(f, c) for c in conditions for f in ['leads'] + ['divs'] * self.collect_ice_div]
+
+        comp = composites.Composite(pairs)
+        with profiling.span('composites', 'compute'):
+            divs = self.divs if self.collect_ice_div else [None] * len(self.leads)
+            for lead, cyc, cyc_past, div in zip(self.leads, self.cycs, self.cycs_past, divs):
+                day_conditions = self.cyc_conditions(cyc, cyc_past)
+                for name, func in conditions.items():
+                    day_conditions[name] = func(lead, cyc, cyc_past, div)
+                fields = {'leads': lead} if div is None else {'leads': lead, 'divs': div}
+                comp.add(fields, day_conditions)
+        return comp
+
+    def period(self, date1, date2):
+        # analysis of another period with the same settings
+        A = Analysis(date1, date2, self.extent, self.collect_ice_div)
+        A.delta_days, A.sic_filter, A.prefetch_days = self.delta_days, self.sic_filter, self.prefetch_days
+        return A
+
+    def stored_composite(self):
+        # Composite (default pairs) of all dates, pickled per start and end date together with its dates. Without a
+        # stored composite of exactly these dates, the longest one of the same start date that ends earlier is extended
+        # by the new days and stored under the new end date, so adding a season reads one season.
+        prefix = f'composite_{self.collect_ice_div}_{self.sic_filter}_{self.delta_days}_{self.dates[0]}_'
+        path = f'./pickles/{prefix}{self.dates[-1]}.pkl'
+        if os.path.isfile(path):
+            with open(path, 'rb') as pickle_in:
+                return pickle.load(pickle_in)['composite']
+
+        stored = {'dates': [], 'composite': composites.Composite()}
+        earlier = sorted(f for f in os.listdir('./pickles')
+                         if f.startswith(prefix) and f.endswith('.pkl') and f[len(prefix):-4] < self.dates[-1])
+        if earlier:
+            with open(f'./pickles/{earlier[-1]}', 'rb') as pickle_in:
+                stored = pickle.load(pickle_in)
+        n = len(stored['dates'])
+        assert stored['dates'] == list(self.dates[:n]), f'{earlier[-1]} does not hold the first dates of {path}'
+
+        print(f'extend stored composite by {len(self.dates) - n} days')
+        stored['composite'].merge(self.period(self.dates[n], self.dates[-1]).composite())
+        stored['dates'] = list(self.dates)
+        with open(path, 'wb') as filehandler:
+            pickle.dump(stored, filehandler)
+        return stored['composite']
 
     def export_clustered_leads(self, m3d):
         with open(f'./pickles/clustered_leads_m3d={m3d}_{self.collect_ice_div}_{self.sic_filter}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}.pkl', 'wb') as filehandler:
@@ -171,24 +253,24 @@ class Analysis:
         self.nrows, self.ncols = 2, 2
         fig, ([ax1, ax2], [ax3, ax4]) = self.setup_plot()
 
-        im1 = ax1.pcolormesh(self.lon, self.lat, np.nanstd(cyc, axis=0), vmin=0, vmax=.5,
+        im1 = ax1.pcolormesh(self.lon, self.lat, precision.nanstd(cyc, axis=0), vmin=0, vmax=.5,
                              transform=ccrs.PlateCarree(),
                              cmap='Oranges')
         ax1.set_title('cyc (std)', fontsize=20)
         fig.colorbar(im1, ax=ax1, orientation='vertical')
 
-        im2 = ax2.pcolormesh(self.lon, self.lat, np.nanstd(no_cyc, axis=0), vmin=0, vmax=.5,
+        im2 = ax2.pcolormesh(self.lon, self.lat, precision.nanstd(no_cyc, axis=0), vmin=0, vmax=.5,
                              transform=ccrs.PlateCarree(), cmap='Oranges')
         fig.colorbar(im2, ax=ax2, orientation='vertical')
         ax2.set_title(f'no cyc (std)', fontsize=20)
 
-        im3 = ax3.pcolormesh(self.lon, self.lat, np.nanstd(cyc_prior, axis=0), vmin=0, vmax=.5,
+        im3 = ax3.pcolormesh(self.lon, self.lat, precision.nanstd(cyc_prior, axis=0), vmin=0, vmax=.5,
                              transform=ccrs.PlateCarree(),
                              cmap='Oranges')
         ax3.set_title('cyc prior (std)', fontsize=20)
         fig.colorbar(im3, ax=ax3, orientation='vertical')
 
-        im4 = ax4.pcolormesh(self.lon, self.lat, np.nanstd(no_cyc_prior, axis=0), vmin=0, vmax=.5,
+        im4 = ax4.pcolormesh(self.lon, self.lat, precision.nanstd(no_cyc_prior, axis=0), vmin=0, vmax=.5,
                              transform=ccrs.PlateCarree(), cmap='Oranges')
         fig.colorbar(im4, ax=ax4, orientation='vertical')
         ax4.set_title(f'no cyc prior (std)', fontsize=20)
@@ -196,16 +278,19 @@ class Analysis:
         plt.tight_layout()
         plt.savefig(f'./plots/analysis/clustered_leads_std_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
-    def plot_clustered_leads(self, from_pickle=False):
+    def plot_clustered_leads(self, from_pickle=False, clustered=None):
+        # clustered: mean maps of cluster_leads computed elsewhere, e.g. by a job of jobs.py
         self.nrows, self.ncols = 2, 3
-        if from_pickle:
+        if clustered is not None:
+            no_cyc, cyc, cyc_prior, no_cyc_prior = clustered[:4]
+        elif from_pickle:
             with open(f'./pickles/clustered_leads_{self.sic_filter}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}.pkl', 'rb') as pickle_in:
                 no_cyc, cyc, cyc_prior, no_cyc_prior = pickle.load(pickle_in)
                 print(no_cyc.shape)
-                no_cyc, cyc = np.nanmean(no_cyc, axis=0), np.nanmean(cyc, axis=0)
-                cyc_prior, no_cyc_prior = np.nanmean(cyc_prior, axis=0), np.nanmean(no_cyc_prior, axis=0)
+                no_cyc, cyc = precision.nanmean(no_cyc, axis=0), precision.nanmean(cyc, axis=0)
+                cyc_prior, no_cyc_prior = precision.nanmean(cyc_prior, axis=0), precision.nanmean(no_cyc_prior, axis=0)
         else:
-            no_cyc, cyc, cyc_prior, no_cyc_prior = self.cluster_leads()
+            no_cyc, cyc, cyc_prior, no_cyc_prior = self.clustered_means(self.stored_composite())[:4]
 
         fig, axs = self.setup_plot()
         ax1, ax2, ax3, ax4, ax5, ax6 = axs[0, 0], axs[0, 1], axs[1, 0], axs[1, 1], axs[0, 2], axs[1, 2]
@@ -237,7 +322,8 @@ class Analysis:
         plt.tight_layout()
         plt.savefig(f'./plots/analysis/deep time/clustered_leads_sicfilter{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
-    def plot_clustered_div_significant(self, from_pickle=False):
+    def plot_clustered_div_significant(self, from_pickle=False, method='bootstrap', block_days=10, n_resamples=1000,
+                                       alpha=.1):
         path = f'./pickles/clustered_leads_m3d=True_True_{self.sic_filter}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}.pkl'
         print(path)
         if from_pickle:
@@ -245,19 +331,20 @@ class Analysis:
                 no_cyc, cyc, cyc_prior, no_cyc_prior, no_cyc_div, cyc_div = pickle.load(pickle_in)
 
         else:
-            no_cyc, cyc, cyc_prior, no_cyc_prior, no_cyc_div, cyc_div = self.cluster_leads()
+            no_cyc, cyc, cyc_prior, no_cyc_prior, no_cyc_div, cyc_div = self.cluster_leads(matrix3d=True)
 
-        # perform T-test on divergence data cyclone vs. no cyclone
-        ttest = ttest_ind(cyc_div, no_cyc_div, nan_policy='omit', equal_var=False, axis=0)
-        pvalues, statistics = ttest.__getattribute__('pvalue'), ttest.__getattribute__('statistic')
+        # block bootstrap of divergence data cyclone vs. no cyclone, significance with FDR control
+        res = significance.resampling_test(cyc_div, no_cyc_div, method=method, block_days=block_days,
+                                           n_resamples=n_resamples, alpha=alpha)
+        pvalues = res['pvalues']
         print(cyc_div.shape)
 
         self.nrows, self.ncols = 1, 2
         fig, (ax1, ax2) = self.setup_plot()
 
-        im1 = ax1.pcolormesh(self.lon, self.lat, statistics, transform=ccrs.PlateCarree(),
+        im1 = ax1.pcolormesh(self.lon, self.lat, res['diff'], vmin=-3.e-7, vmax=3.e-7, transform=ccrs.PlateCarree(),
                              cmap='coolwarm')
-        ax1.set_title(f'T-test', fontsize=20)
+        ax1.set_title(f'cyc - no cyc ({method})', fontsize=20)
         fig.colorbar(im1, ax=ax1)
 
         im2 = ax2.pcolormesh(self.lon, self.lat, pvalues, vmin=0., vmax=1., transform=ccrs.PlateCarree())
@@ -269,13 +356,12 @@ class Analysis:
             f'./plots/analysis/significancy_div_{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
         # plot only the significant results
-        cyc_div, no_cyc_div = np.nanmean(np.array(cyc_div), axis=0), np.nanmean(np.array(no_cyc_div), axis=0)
-        diff = cyc_div - no_cyc_div
+        diff = np.copy(res['diff'])
         self.nrows, self.ncols = 1, 1
         fig, ax = self.setup_plot()
-        diff[pvalues >= .2] = np.nan
+        diff[~res['significant']] = np.nan
         im1 = ax.pcolormesh(self.lon, self.lat, diff, vmin=-3.e-7, vmax=3.e-7, transform=ccrs.PlateCarree(), cmap='coolwarm')
-        ax.set_title(f'ice divergence, cyc - no cyc, values with p < 0.2', fontsize=20)
+        ax.set_title(f'ice divergence, cyc - no cyc, significant at FDR {alpha}', fontsize=20)
         fig.colorbar(im1, ax=ax)
         plt.tight_layout()
         plt.savefig(
@@ -294,7 +380,7 @@ class Analysis:
 
         fig, (ax1, ax2, ax3) = self.setup_plot()
 
-        im1 = ax1.pcolormesh(self.lon, self.lat, np.nanmean(self.divs, axis=0), vmin=-6.e-07, vmax=6.e-07,
+        im1 = ax1.pcolormesh(self.lon, self.lat, precision.nanmean(self.divs, axis=0), vmin=-6.e-07, vmax=6.e-07,
                              transform=ccrs.PlateCarree(), cmap='bwr')
         ax1.set_title('ice divergence', fontsize=20)
         fig.colorbar(im1, ax=ax1, orientation='vertical', fraction=0.046, pad=0.04)
@@ -341,14 +427,69 @@ class Analysis:
         plt.savefig(
             f'./plots/analysis/deep time/clustered_leads_clustered_div_sicfilter{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
+    def multi_lag_composites(self, max_lag=6):
+        # Composites for all delta_days from 0 to max_lag in one pass over the data. A per pixel 'days since last
+        # cyclone' field is carried from day to day, cyclone within the last L days is since <= L. Days before a date
+        # that are not part of self.dates (start of the range, season gaps) only contribute their cyclone data.
+        # Returns the Composite, the cyc_prior - no_cyc_prior maps of leads (and divergence) for every lag and a
+        # summary per lag.
+        since, last_day = None, None
+        comp = composites.Composite()
+
+        for date in self.dates:
+            dt_date = ds.string_time_to_datetime(date)
+            first = dt_date - timedelta(days=max_lag)
+            if last_day is not None and last_day >= first:
+                first = last_day + timedelta(days=1)
+            for i in range((dt_date - first).days):
+                since = self.update_since(since, ds.datetime_to_string(first + timedelta(days=i)))
+            last_day = dt_date
+
+            if not self.catalog.available(date, 'lead', 'cyc', 'sic'):
+                since = self.update_since(since, None)
+                continue
+            profiling.progress(date, len(self.dates))
+            leadally = leads.LeadAllY(date, data_catalog=self.catalog)
+            since = self.update_since(since, leadally.cyc_data > .25)
+
+            with profiling.span('composites', 'compute'):
+                lead_data = leadally.lead_data
+                lead_data[100 * leadally.sic_data <= self.sic_filter] = np.nan
+                conditions = {'cyc': since == 0, 'no_cyc': since > 0}
+                for lag in range(max_lag + 1):
+                    conditions[f'cyc_prior_{lag}'] = since <= lag
+                    conditions[f'no_cyc_prior_{lag}'] = since > lag
+                fields = {'leads': lead_data}
+                if self.collect_ice_div:
+                    fields['divs'] = leadally.ice_div.T
+                comp.add(fields, conditions)
+
+        diffs, summary = {}, {}
+        for lag in range(max_lag + 1):
+            diffs[lag] = {f: comp.mean(f, f'cyc_prior_{lag}') - comp.mean(f, f'no_cyc_prior_{lag}')
+                          for f in ['leads'] + ['divs'] * self.collect_ice_div}
+            diff_0 = comp.mean('leads', 'cyc') - comp.mean('leads', 'no_cyc')
+            summary[lag] = {'mean_diff': float(np.nanmean(diffs[lag]['leads'])),
+                            'mean_diff_to_lag0': float(np.nanmean(diffs[lag]['leads'] - diff_0)),
+                            'n_cyc_prior': int(comp.count('leads', f'cyc_prior_{lag}').sum()),
+                            'n_no_cyc_prior': int(comp.count('leads', f'no_cyc_prior_{lag}').sum())}
+        return comp, diffs, summary
+
+    def update_since(self, since, cyc):
+        # advance the days since last cyclone field by one day, cyc is the boolean cyclone grid of that day, a date
+        # string to load it or None if there is no cyclone data for that day
+        if isinstance(cyc, str):
+            cyc = cyclone_mask(cyc, self.lat.shape, self.catalog)
+        if since is None:
+            since = np.full(self.lat.shape, np.inf, dtype=precision.dtype)
+        since += 1
+        if cyc is not None:
+            since[cyc] = 0
+        return since
+
     def compare_deltadays(self):
-        img = []
-        for i in range(1, 7):
-            print(i)
-            self.leads, self.cycs, self.cycs_past = [], [], []
-            self.delta_days = i
-            _, _, cyc_prior, no_cyc_prior, _, _ = self.cluster_leads()
-            img.append(cyc_prior - no_cyc_prior)
+        _, diffs, _ = self.multi_lag_composites(max_lag=6)
+        img = [diffs[i]['leads'] for i in range(1, 7)]
         # img = np.array(img)
 
         '''for i in range(len(img) - 1):
@@ -374,25 +515,20 @@ class Analysis:
         fig, ax = plt.subplots()
         ax.set_xlabel('days prior')
         ax.set_ylabel('mean difference to days prior = 0')
+        _, _, summary = self.multi_lag_composites(max_lag=6)
         for i in range(0, 7):
-            print(i)
-            self.leads, self.cycs, self.cycs_past = [], [], []
-            self.delta_days = i
-            no_cyc, cyc, cyc_prior, no_cyc_prior = self.cluster_leads()
-
-            diff = cyc_prior - no_cyc_prior - (cyc - no_cyc)
-            ax.scatter(i, np.nanmean(diff), c='steelblue')
+            ax.scatter(i, summary[i]['mean_diff_to_lag0'], c='steelblue')
 
         plt.tight_layout()
         plt.savefig(f'./plots/analysis/compare_deltad_graph_{self.dates[0]}_{self.dates[-1]}')
 
     def plot_average_cyc_lead(self):
         self.collect_leads_cycs()
-        self.cycs = np.array(self.cycs)
-        self.leads = np.array(self.leads)
+        self.cycs = precision.stack(self.cycs)
+        self.leads = precision.stack(self.leads)
         self.cycs[np.isnan(self.cycs)] = 0
 
-        mean_l, mean_c = np.nanmean(self.leads, axis=0), np.nanmean(self.cycs, axis=0)
+        mean_l, mean_c = precision.nanmean(self.leads, axis=0), precision.nanmean(self.cycs, axis=0)
         self.nrows, self.ncols = 1, 2
         fig, ax = self.setup_plot()
 
@@ -438,22 +574,23 @@ class Analysis:
         plt.savefig(
             f'./plots/analysis/ndata_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
-    def significance_test(self):
+    def significance_test(self, method='bootstrap', block_days=10, n_resamples=1000, alpha=.1):
         path = f'./pickles/clustered_leads_m3d=True_True_{self.sic_filter}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}.pkl'
         print(path)
         with open(path, 'rb') as pickle_in:
-            _, _, cyc_prior, no_cyc_prior = pickle.load(pickle_in)
+            cyc_prior, no_cyc_prior = pickle.load(pickle_in)[2:4]
 
         print(cyc_prior.shape, no_cyc_prior.shape)
-        ttest = ttest_ind(cyc_prior, no_cyc_prior, nan_policy='omit', equal_var=False, axis=0)
-        pvalues, statistics = ttest.__getattribute__('pvalue'), ttest.__getattribute__('statistic')
-        print(statistics.shape)
+        # block resampling keeps the autocorrelation of the days, FDR control replaces a fixed p cut-off
+        res = significance.resampling_test(cyc_prior, no_cyc_prior, method=method, block_days=block_days,
+                                           n_resamples=n_resamples, alpha=alpha)
+        pvalues = res['pvalues']
 
         self.nrows, self.ncols = 1, 2
         fig, (ax1, ax2) = self.setup_plot()
 
-        im1 = ax1.pcolormesh(self.lon, self.lat, statistics, vmax=10, vmin=-10, transform=ccrs.PlateCarree(), cmap='coolwarm')
-        ax1.set_title(f'T-test', fontsize=20)
+        im1 = ax1.pcolormesh(self.lon, self.lat, res['diff'], vmax=.1, vmin=-.1, transform=ccrs.PlateCarree(), cmap='coolwarm')
+        ax1.set_title(f'cyc prior - no cyc prior ({method})', fontsize=20)
         fig.colorbar(im1, ax=ax1)
 
         im2 = ax2.pcolormesh(self.lon, self.lat, pvalues, vmax=1., transform=ccrs.PlateCarree(), cmap='gray')
@@ -464,29 +601,27 @@ class Analysis:
         plt.savefig(f'./plots/analysis/significancy_{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
         # plot only the significant results
-        cyc_prior, no_cyc_prior = np.nanmean(np.array(cyc_prior), axis=0), np.nanmean(np.array(no_cyc_prior), axis=0)
-        diff = cyc_prior - no_cyc_prior
+        diff = np.copy(res['diff'])
         self.nrows, self.ncols = 1, 1
         fig, ax = self.setup_plot()
-        diff[pvalues >= .1] = np.nan
+        diff[~res['significant']] = np.nan
         im1 = ax.pcolormesh(self.lon, self.lat, diff, transform=ccrs.PlateCarree(), vmin=-.1, vmax=.1, cmap='coolwarm')
-        ax1.set_title(f'T-test', fontsize=20)
+        ax.set_title(f'cyc prior - no cyc prior, significant at FDR {alpha}', fontsize=20)
         fig.colorbar(im1, ax=ax)
         plt.tight_layout()
         plt.savefig(
             f'./plots/analysis/signif_res_{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
-    def difference_time_window_sig(self):
-        with open(f'./pickles/clustered_leads_{self.sic_filter}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}.pkl',
-                  'rb') as pickle_in:
-            _, _, cyc_prior, no_cyc_prior = pickle.load(pickle_in)
+    def difference_time_window_sig(self, split_date=None):
+        # Welch t-test of the lead fraction before and after split_date (middle of the dates by default) from the
+        # stored composites of both periods, a fixed split_date only reads the new days when the record grows
+        split_date = split_date if split_date else self.dates[len(self.dates) // 2]
+        first = self.period(self.dates[0], catalog.shift_date(split_date, -1)).stored_composite()
+        second = self.period(split_date, self.dates[-1]).stored_composite()
 
-        regime_shift_ind = int(cyc_prior.shape[0] / 2)
-
-        for mat, title in zip([cyc_prior, no_cyc_prior], ['cyc', 'no_cyc']):
-            ttest = ttest_ind(mat[:regime_shift_ind], mat[regime_shift_ind:], nan_policy='omit', equal_var=False)
-            pvalues, statistics = ttest.__getattribute__('pvalue'), ttest.__getattribute__('statistic')
-            print(statistics.reshape(self.lon.shape))
+        for condition, title in [('cyc_prior', 'cyc'), ('no_cyc_prior', 'no_cyc')]:
+            statistics, pvalues = first.ttest('leads', condition, other=second)
+            print(statistics)
 
             self.nrows, self.ncols = 1, 2
             fig, (ax1, ax2) = self.setup_plot()
@@ -505,8 +640,7 @@ class Analysis:
                 f'./plots/analysis/timesplit_{title}_{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
             # plot only the significant results
-            diff1, diff2 = np.nanmean(np.array(mat[:regime_shift_ind]), axis=0), np.nanmean(np.array(mat[regime_shift_ind:]), axis=0)
-            diff = diff2 - diff1
+            diff = second.mean('leads', condition) - first.mean('leads', condition)
             self.nrows, self.ncols = 1, 1
             fig, ax = self.setup_plot()
             diff[pvalues >= .1] = np.nan
@@ -523,8 +657,8 @@ class Analysis:
             _, _, cyc_prior, no_cyc_prior = pickle.load(pickle_in)
 
         regime_shift_ind = int(cyc_prior.shape[0] / 2)
-        cyc_prior1, cyc_prior2 = np.nanmean(cyc_prior[:regime_shift_ind], axis=0), np.nanmean(cyc_prior[regime_shift_ind:], axis=0)
-        no_cyc_prior1, no_cyc_prior2 = np.nanmean(no_cyc_prior[:regime_shift_ind], axis=0), np.nanmean(no_cyc_prior[regime_shift_ind:], axis=0)
+        cyc_prior1, cyc_prior2 = precision.nanmean(cyc_prior[:regime_shift_ind], axis=0), precision.nanmean(cyc_prior[regime_shift_ind:], axis=0)
+        no_cyc_prior1, no_cyc_prior2 = precision.nanmean(no_cyc_prior[:regime_shift_ind], axis=0), precision.nanmean(no_cyc_prior[regime_shift_ind:], axis=0)
 
         diff_cyc = cyc_prior2 - cyc_prior1
         diff_no_cyc = no_cyc_prior2 - no_cyc_prior1
@@ -539,24 +673,52 @@ class Analysis:
         plt.savefig(
             f'./plots/analysis/timesplit_diff_{int(self.sic_filter)}_{self.delta_days}_{self.dates[0]}_{self.dates[-1]}')
 
-    def climatology(self):
-        # collect data
+    def trend_maps(self, field='leads', aggregate='season', processes=None, memory_mb=256):
+        # Per pixel OLS, Theil-Sen and Mann-Kendall trends of the seasonal (monthly, yearly) lead fraction or cyclone
+        # frequency instead of splitting the record in two halves. Computed from the pixel store and pickled.
+        path = f'./pickles/trends_{field}_{aggregate}_{self.sic_filter}_{self.dates[0]}_{self.dates[-1]}.pkl'
         try:
-            with open(f'./pickles/collections_{self.sic_filter}_{self.dates[0]}_{self.dates[-1]}.pkl', 'rb') as pickle_in:
-                print('Try to import collection')
-                self.leads, self.cycs = pickle.load(pickle_in)
-                print('done')
+            with open(path, 'rb') as pickle_in:
+                return pickle.load(pickle_in)
         except FileNotFoundError:
-            print('could not find collection \n try to create collection and restart')
-            self.export_collection()
-            print('done')
-            self.climatology()
-            return 'Finished with exception'
+            print('could not find trend maps \n try to compute trend maps')
+
+        statistic = 'frequency' if field == 'cycs' else 'mean'
+        res = trends.pixel_trends(self.pixel_store(field), aggregate=aggregate, statistic=statistic,
+                                  processes=processes, memory_mb=memory_mb)
+        with open(path, 'wb') as filehandler:
+            pickle.dump(res, filehandler)
+        return res
+
+    def plot_trends(self, field='leads', aggregate='season', alpha=.05, vmax=None):
+        # OLS and Theil-Sen slope per decade, Theil-Sen only where the Mann-Kendall test is significant at FDR alpha
+        res = self.trend_maps(field, aggregate)
+        significant = significance.fdr_bh(res['mk_p'], alpha)
+        ols_slope, sen_slope = 10 * res['ols_slope'], 10 * res['sen_slope']
+        sen_slope[~significant] = np.nan
+        vmax = vmax if vmax else np.nanpercentile(np.abs(ols_slope), 98)
 
-        # transform to numpy array
-        self.leads, self.cycs = np.array(self.leads), np.array(self.cycs)
-        N, M = 100, 150
-        lon, lat = round(self.lon[N, M]), round(self.lat[N, M])
+        self.nrows, self.ncols = 1, 2
+        fig, (ax1, ax2) = self.setup_plot()
+        im = ax1.pcolormesh(self.lon, self.lat, ols_slope, transform=ccrs.PlateCarree(), vmin=-vmax, vmax=vmax,
+                            cmap='coolwarm')
+        ax1.set_title(f'OLS trend per decade', fontsize=20)
+        ax2.pcolormesh(self.lon, self.lat, sen_slope, transform=ccrs.PlateCarree(), vmin=-vmax, vmax=vmax,
+                       cmap='coolwarm')
+        ax2.set_title(f'Theil-Sen trend, MK significant', fontsize=20)
+        fig.colorbar(im, ax=[ax1, ax2])
+        plt.savefig(f'./plots/analysis/trend_{field}_{aggregate}_{int(self.sic_filter)}_{self.dates[0]}_{self.dates[-1]}')
+
+    def pixel_store(self, field):
+        # Open the pixel-major store of field ('leads' or 'cycs') for the dates of this analysis, build it if necessary.
+        # Both stores are created at once, reading every day only once. Stores are kept per first date, a later end
+        # date only reads the new days and appends them.
+        paths = {f: f'./pickles/pixel_store_{f}_{self.sic_filter}_{self.dates[0]}' for f in ['leads', 'cycs']}
+        return ps.PixelStore.open(paths, field, self.dates, partial(ps.lead_cyc_fields, sic_filter=self.sic_filter))
+
+    def climatology(self):
+        # read single pixel time series from the pixel-major store instead of loading the whole collection
+        store = self.pixel_store('leads')
 
         fig, axs = plt.subplots(4, 1, figsize=(15, 7))
 
@@ -566,7 +728,7 @@ class Analysis:
 
             ax.set_title(f'lon: {lon}, lat: {lat}')
             n_Time = 175
-            ax.bar(ds.string_time_to_datetime(self.dates)[:n_Time], self.leads[:n_Time, N, M])
+            ax.bar(ds.string_time_to_datetime(self.dates)[:n_Time], store.series(N, M)[:n_Time])
 
         plt.tight_layout()
         plt.savefig('climatology_test2.png')
@@ -598,47 +760,89 @@ class Analysis:
         plt.savefig('./plots/analysis/n_points.png')
 
 
-def multi_year_average_lead_cyc(mean='day', plot=True):
-    dates = ds.time_delta('20021101', '20151231')
-    dt_dates = ds.string_time_to_datetime(dates)
-    lead_data, cyc_data, time = [], [], []
-
-    for date in dates:
-        ds_obj = leads.LeadAllY(date)
-        lead_data.append(ds_obj.lead_data)
-        cyc_data.append(ds_obj.cyc_data)
-
-    cyc_data, lead_data = np.array(cyc_data), np.array(lead_data)
-    if mean == 'day':
-        print('h')
-        mean_cyc = []
-        mean_lead = []
-
-        for lead, cyc in zip(lead_data, cyc_data):
-            mean_cyc.append(np.nanmean(cyc))
-            mean_lead.append(np.nanmean(lead))
-
-        time = dt_dates
-
-    elif mean == 'month':
-        mean_cyc, current_cyc = [], []
-        mean_lead, current_lead = [], []
-        prev_month = dt_dates[0].month
-
-        for lead, cyc, date in zip(lead_data, cyc_data, dt_dates):
-            month = date.month
-
-            if month == prev_month:
-                current_cyc.append(cyc)
-                current_lead.append(lead)
-            else:
-                mean_cyc.append(np.nanmean(current_cyc))
-                mean_lead.append(np.nanmean(current_lead))
-                time.append(f'{date.year - 2000}/{date.month}')
+def load_lead_cyc_day(date, delta_days=3, collect_ice_div=True):
+    # Everything collect_leads_cycs needs of one day: lead fraction, sic, cyclone occurrence, ice divergence and the
+    # cyclone mask of the delta_days days before (days without lead, cyc or sic data are skipped as before).
+    data_catalog = catalog.DataCatalog.get()
+    leadally = leads.LeadAllY(date, data_catalog=data_catalog)
+    cyc_prior = np.zeros(leadally.lead_data.shape, dtype=bool)
+    for i in range(1, delta_days + 1):
+        past_day = catalog.shift_date(date, -i)
+        if data_catalog.available(past_day, 'lead', 'cyc', 'sic'):
+            cyc_prior |= cyclone_mask(past_day, cyc_prior.shape, data_catalog)
+    return {'lead': leadally.lead_data, 'sic': leadally.sic_data, 'cyc': precision.as_data(leadally.cyc_data, copy=True),
+            'div': leadally.ice_div.T if collect_ice_div else None, 'cyc_prior': cyc_prior}
+
+
+def cyclone_mask(date, shape, data_catalog=None):
+    # boolean cyclone grid (occurrence > .25) of date on the lead grid, None if there is no cyclone data
+    data_catalog = data_catalog if data_catalog else catalog.DataCatalog.get()
+    if not data_catalog.available(date, 'cyc'):
+        return None
+    ds_cyc = nc.Dataset(catalog.cyc_path)
+    d = cftime.date2index(datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 9), ds_cyc['time'])
+    return loaders.read(ds_cyc['cyclone_occurence'], d).reshape(shape) > .25
+
+
+def area_weights(lat, lat_ts=70.):
+    # Relative cell area of the polar stereographic lead grid (true scale at lat_ts), used as weights for spatial means
+    return ((1 + np.sin(np.radians(lat))) / (1 + np.sin(np.radians(lat_ts)))) ** 2
+
+
+def _daily_spatial_sums(dates, weights):
+    # Reduce every day to the weighted sum and the sum of weights of lead fraction and cyclone occurrence as soon as it
+    # is loaded. Runs in a worker process, one call per year.
+    sums = []
+    data_catalog = catalog.DataCatalog.get()
+    for date in data_catalog.filter(dates, 'lead', 'cyc', 'sic'):
+        ds_obj = leads.LeadAllY(date, data_catalog=data_catalog)
+        day = [date]
+        for data in [ds_obj.lead_data, ds_obj.cyc_data]:
+            valid = ~np.isnan(data) & (weights > 0)
+            day += [np.sum(weights[valid] * data[valid]), np.sum(weights[valid])]
+        sums.append(day)
+    return sums
+
+
+def stream_multi_year_average(date1='20021101', date2='20151231', mean='day', weighted=False, extent=None,
+                              processes=None):
+    # Daily or monthly spatial means of lead fraction and cyclone occurrence. Only a handful of scalars per day are
+    # kept in memory, years are processed in parallel.
+    dates = ds.time_delta(date1, date2)
+    lon, lat = leads.CoordinateGridAllY().lon, leads.CoordinateGridAllY().lat
+    weights = area_weights(lat) if weighted else np.ones(lat.shape)
+    if extent:
+        weights = weights * ice_div.lonlat_mask(extent, lon, lat)
+    weights = np.ma.filled(weights, 0.)
+
+    years = sorted(set(d[:4] for d in dates))
+    with Pool(processes) as pool:
+        per_year = pool.starmap(_daily_spatial_sums, [([d for d in dates if d[:4] == y], weights) for y in years])
+
+    # group by day or month on the fly
+    mean_lead, mean_cyc, time = [], [], []
+    key, acc = None, None
+    for date, lead_sum, lead_w, cyc_sum, cyc_w in [day for year in per_year for day in year]:
+        dt_date = ds.string_time_to_datetime(date)
+        new_key = dt_date if mean == 'day' else f'{dt_date.year - 2000}/{dt_date.month}'
+        if new_key != key:
+            if key is not None:
+                mean_lead.append(acc[0] / acc[1] if acc[1] else np.nan)
+                mean_cyc.append(acc[2] / acc[3] if acc[3] else np.nan)
+                time.append(key)
+            key, acc = new_key, np.zeros(4)
+        acc += [lead_sum, lead_w, cyc_sum, cyc_w]
+
+    if key is not None:
+        mean_lead.append(acc[0] / acc[1] if acc[1] else np.nan)
+        mean_cyc.append(acc[2] / acc[3] if acc[3] else np.nan)
+        time.append(key)
+
+    return mean_lead, mean_cyc, time
 
-                current_cyc, current_lead = [], []
 
-            prev_month = month
+def multi_year_average_lead_cyc(mean='day', plot=True):
+    mean_lead, mean_cyc, time = stream_multi_year_average('20021101', '20151231', mean=mean)
 
     if plot:
         # mean_lead, mean_cyc, time = multy_year_average_lead_cyc(mean='month')
@@ -686,6 +890,7 @@ if __name__ == '__main__':
     # A.export_clustered_leads(True)
     # A.significance_test()
     # A.difference_time_window()
+    # A.plot_trends('leads')
 
     '''for i in range(0, 9):
         A = Analysis(f'201{i}1105', f'201{i+1}0430')
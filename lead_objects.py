@@ -0,0 +1,154 @@
+# Leads as objects. The daily lead fraction of LeadAllY (sic filtered like in lead_cyc_analysis) is thresholded and the
+# connected pixels are labelled with scipy.ndimage.label. All region properties come from bincounts of the labels: pixel
+# count, true area (cell area of the 12.5 km polar stereographic grid) and open water area, centroid, mean lead
+# fraction, cyclone overlap and length, width and orientation of the ellipse with the same second moments. Days are
+# segmented in parallel, the result is one compact table with a row per lead object.
+#
+#   LO = LeadObjects('20021105', '20220430')
+#   LO.segment()
+#   LO.export()
+import pickle
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+import catalog
+import data_science as ds
+import leads
+import lead_cyc_analysis as lca
+import profiling
+
+
+def region_properties(labels, n, lead, cyc, cell_area, scale):
+    # Properties of the objects 1..n of a label grid. scale is the true length of a grid cell in km, lengths and
+    # widths are sqrt(12 * eigenvalues) of the pixel covariance (exact for rectangles, a pixel counts as unit square).
+    flat = labels.ravel()
+    inside = flat > 0
+    lab = flat[inside] - 1
+    rows, cols = np.divmod(np.flatnonzero(inside), labels.shape[1])
+
+    def total(weights=None):
+        return np.bincount(lab, weights, minlength=n)
+
+    count = total()
+    row_c, col_c = total(rows) / count, total(cols) / count
+    dr, dc = rows - row_c[lab], cols - col_c[lab]
+    mu_rr, mu_cc, mu_rc = total(dr * dr) / count + 1 / 12, total(dc * dc) / count + 1 / 12, total(dr * dc) / count
+
+    half_diff = (mu_cc - mu_rr) / 2
+    root = np.sqrt(half_diff ** 2 + mu_rc ** 2)
+    mean_scale = total(scale.ravel()[inside]) / count
+
+    props = {'n_pixels': count.astype(np.int32),
+             'area': total(cell_area.ravel()[inside]),
+             'lead_area': total(cell_area.ravel()[inside] * lead.ravel()[inside]),
+             'row': row_c, 'col': col_c,
+             'length': np.sqrt(12 * ((mu_cc + mu_rr) / 2 + root)) * mean_scale,
+             'width': np.sqrt(12 * np.maximum((mu_cc + mu_rr) / 2 - root, 0)) * mean_scale,
+             # angle of the major axis to the grid columns (x axis) in degrees, rows counted downwards
+             'orientation': np.degrees(.5 * np.arctan2(2 * mu_rc, mu_cc - mu_rr)),
+             'mean_fraction': total(lead.ravel()[inside]) / count,
+             'cyc_overlap': total(cyc.ravel()[inside] > .25) / count}
+    return props
+
+
+def segment_day(date, threshold=.5, sic_filter=95., structure=None, min_pixels=1, cell_area=None, scale=None,
+                lon=None, lat=None, data_catalog=None):
+    # table of the lead objects of one day
+    leadally = leads.LeadAllY(date, data_catalog=data_catalog)
+    lead = leadally.lead_data
+    lead[100 * leadally.sic_data <= sic_filter] = np.nan
+
+    with np.errstate(invalid='ignore'):
+        labels, n = ndimage.label(lead >= threshold, structure=structure)
+    if n == 0:
+        return pd.DataFrame()
+
+    props = region_properties(labels, n, lead, leadally.cyc_data, cell_area, scale)
+    keep = props['n_pixels'] >= min_pixels
+    table = pd.DataFrame({key: values[keep] for key, values in props.items()})
+
+    # lon/lat of the pixel nearest to the centroid
+    r, c = np.round(table['row']).astype(int), np.round(table['col']).astype(int)
+    table.insert(0, 'label', np.arange(1, n + 1, dtype=np.int32)[keep])
+    table.insert(0, 'date', np.int32(date))
+    table['lon'], table['lat'] = lon[r, c], lat[r, c]
+    return table
+
+
+def _segment_days(args):
+    dates, kwargs = args
+    data_catalog = catalog.DataCatalog.get()
+    tables = [segment_day(date, data_catalog=data_catalog, **kwargs)
+              for date in data_catalog.filter(dates, 'lead', 'cyc', 'sic')]
+    tables = [table for table in tables if not table.empty]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+class LeadObjects:
+    def __init__(self, date1, date2, threshold=.5, sic_filter=95., min_pixels=1, structure=None):
+        # structure: connectivity of the lead pixels, default connects all 8 neighbours, since leads are thin and often
+        # only touch diagonally
+        self.dates = ds.time_delta(date1, date2)
+        self.threshold = threshold
+        self.sic_filter = sic_filter
+        self.min_pixels = min_pixels
+        self.structure = structure if structure is not None else ndimage.generate_binary_structure(2, 2)
+
+        grid = leads.CoordinateGridAllY()
+        self.lon, self.lat = np.ma.filled(grid.lon, np.nan), np.ma.filled(grid.lat, np.nan)
+        weights = lca.area_weights(self.lat)
+        # true area in km^2 and true side length in km of the 12.5 km polar stereographic cells
+        self.cell_area = np.nan_to_num(12.5 ** 2 * weights)
+        self.scale = np.nan_to_num(12.5 * np.sqrt(weights))
+        self.objects = None
+
+    def segment(self, processes=None, days_per_task=30):
+        # label all days in parallel, chunks of days_per_task days per task, results in date order
+        kwargs = {'threshold': self.threshold, 'sic_filter': self.sic_filter, 'structure': self.structure,
+                  'min_pixels': self.min_pixels, 'cell_area': self.cell_area, 'scale': self.scale,
+                  'lon': self.lon, 'lat': self.lat}
+        tasks = [(self.dates[i:i + days_per_task], kwargs) for i in range(0, len(self.dates), days_per_task)]
+
+        if processes == 1:
+            tables = list(map(_segment_days, tasks))
+        else:
+            with Pool(processes) as pool:
+                tables = []
+                for table, task in zip(pool.imap(_segment_days, tasks), tasks):
+                    for date in task[0]:
+                        profiling.progress(date, len(self.dates))
+                    tables.append(table)
+
+        tables = [table for table in tables if not table.empty]
+        objects = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+        # compact table: single precision for the properties
+        floats = objects.select_dtypes(np.float64).columns
+        self.objects = objects.astype({column: np.float32 for column in floats})
+        return self.objects
+
+    def daily_statistics(self):
+        # number of leads, their total and mean area and mean length per day
+        return self.objects.groupby('date').agg(n_leads=('label', 'size'), area=('area', 'sum'),
+                                                mean_area=('area', 'mean'), mean_length=('length', 'mean'))
+
+    def export(self, path=None):
+        path = path if path else f'./pickles/lead_objects_{self.threshold}_{self.sic_filter}_{self.dates[0]}_' \
+                                 f'{self.dates[-1]}.pkl'
+        with open(path, 'wb') as filehandler:
+            pickle.dump(self.objects, filehandler)
+
+    def load(self, path=None):
+        path = path if path else f'./pickles/lead_objects_{self.threshold}_{self.sic_filter}_{self.dates[0]}_' \
+                                 f'{self.dates[-1]}.pkl'
+        with open(path, 'rb') as pickle_in:
+            self.objects = pickle.load(pickle_in)
+        return self.objects
+
+
+if __name__ == '__main__':
+    # LO = LeadObjects('20021105', '20220430')
+    # LO.segment()
+    # LO.export()
+    # print(LO.daily_statistics())
+    pass
@@ -1,3 +1,4 @@
+import collections
 import datetime
 import data_science as ds
 import cftime
@@ -7,16 +8,23 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 import case_information as ci
+import catalog
+import composites
+import kinematics
+import precision
+import profiling
+import regions
 import cartopy.crs as ccrs
 
 
 class Lead:
-    def __init__(self, date):
-        # import lead fraction data
+    def __init__(self, date, region=None):
+        # import lead fraction data, region: only its box is read (regions.region('lead', extent)), NaN elsewhere
         self.date = date
+        self.region = region
         path = f'./data/leads/{self.date}.nc'
         ds_lead = nc.Dataset(path)
-        self.lead_frac = ds_lead['Lead Fraction'][:]
+        self.lead_frac = regions.read(ds_lead['Lead Fraction'], region=region)
         self.old_shape = self.lead_frac.shape
 
         # assign instances later needed
@@ -38,19 +46,15 @@ class Lead:
         self.lead_data[self.lead_data > 1] = np.nan
         self.lead_data[self.lead_data < 0] = np.nan
 
-    def new_leads(self):
-        prior_date = ds.string_time_to_datetime(self.date)
-        prior_date -= datetime.timedelta(days=1)
-        prior_date = ds.datetime_to_string(prior_date)
-        try:
-            lead1 = Lead(prior_date).lead_data
-            lead2 = self.lead_data
-            new_lead = lead2 - lead1
-
-            return 100 * new_lead.clip(min=0)
-        except FileNotFoundError:
+    def new_leads(self, data_catalog=None):
+        prior_date = catalog.shift_date(self.date, -1)
+        data_catalog = data_catalog if data_catalog else catalog.DataCatalog.get()
+        if not data_catalog.available(prior_date, 'lead_2020'):
             print(f'No data available for date prior {ds.string_time_to_datetime(self.date)}.')
-            print('I could therefor not calculate the new leads.')
+            print('New leads are masked for this date.')
+            return precision.full(self.lead_data.shape)
+
+        return lead_change(read_lead_data(prior_date, self.region), self.lead_data)[0]
 
 
 class CoordinateGrid:
@@ -105,17 +109,22 @@ class CoordinateGrid:
         plt.show()
 
 
+def daily_sum(variable, t1, t2, region=None, flat=False):
+    # sum of the time steps t1 to t2 (inclusive) of a netCDF variable, read in one go and accumulated in acc_dtype
+    return np.sum(regions.read(variable, slice(t1, t2 + 1), region, flat), axis=0, dtype=precision.acc_dtype)
+
+
 class Era5:
-    def __init__(self, variable):
-        # import air pressure data
+    def __init__(self, variable, region=None):
+        # import air pressure data, region: only its box is read (regions.region('era5', extent)), NaN elsewhere
         self.var = variable
+        self.region = region
         variable_dict = {'msl': 'data/ERA5_METAs.nc', 'wind': 'data/ERA5_METAs.nc',
                          't2m': 'data/ERA5_METAs.nc', 'siconc': 'data/ERA5_METAs.nc',
                          'cyclone_occurence': 'data/ERA5_METAs.nc', 'wind_quiver': 'data/ERA5_METAs.nc'}
 
         path = variable_dict[self.var]
         data_set = nc.Dataset(path)
-        print(data_set)
 
         # Assign variables
         if self.var == 'wind_quiver':
@@ -138,17 +147,15 @@ class Era5:
         t1, t2 = cftime.date2index([d1, d2], self.time)
         # Calculate mean variable of the given date
         if self.var == 'wind_quiver':
-            mean_u10, mean_v10 = np.zeros(self.u10[0].shape), np.zeros(self.v10[0].shape)
-            for t in range(t1, t2 + 1):
-                mean_u10 += self.u10[t]
-                mean_v10 += self.v10[t]
-            return .25 * mean_u10, .25 * mean_v10
+            with profiling.span('era5 daily mean', 'io'):
+                mean_u10 = daily_sum(self.u10, t1, t2, self.region)
+                mean_v10 = daily_sum(self.v10, t1, t2, self.region)
+            return precision.as_data(.25 * mean_u10), precision.as_data(.25 * mean_v10)
 
         else:
-            mean_var = np.zeros(self.variable[0].shape)
-            for t in range(t1, t2 + 1):
-                mean_var = np.add(mean_var, self.variable[t])
-            return ds.variable_manip(self.var, .25 * mean_var)
+            with profiling.span('era5 daily mean', 'io'):
+                mean_var = daily_sum(self.variable, t1, t2, self.region)
+            return precision.as_data(ds.variable_manip(self.var, .25 * mean_var))
 
     def get_variable_drift(self, date):
         # Get time index
@@ -158,10 +165,8 @@ class Era5:
         t1, t2 = cftime.date2index([d1, d2], self.time)
 
         # Calculate mean variable of the given date
-        mean_var = np.zeros(self.variable[0].shape)
-        for t in range(t1, t2 + 1):
-            mean_var = np.add(mean_var, self.variable[t])
-        return ds.variable_manip(self.var, 1/len(list(range(t1, t2 + 1))) * mean_var)
+        mean_var = daily_sum(self.variable, t1, t2, self.region)
+        return precision.as_data(ds.variable_manip(self.var, 1/len(list(range(t1, t2 + 1))) * mean_var))
 
     def get_quiver(self, date):
         # Get time index
@@ -171,42 +176,44 @@ class Era5:
         t1, t2 = cftime.date2index([d1, d2], self.time)
 
         # Calculate mean variable of the given date
-        mean_v10 = np.zeros(self.v10[0].shape)
-        mean_u10 = np.zeros(self.u10[0].shape)
-        for t in range(t1, t2 + 1):
-            mean_v10 = np.add(mean_v10, self.v10[t])
-            mean_u10 = np.add(mean_u10, self.u10[t])
-        return .25 * mean_v10, .25 * mean_u10
+        mean_v10, mean_u10 = daily_sum(self.v10, t1, t2, self.region), daily_sum(self.u10, t1, t2, self.region)
+        return precision.as_data(.25 * mean_v10), precision.as_data(.25 * mean_u10)
 
     def get_var_diff(self, date1, date2):
         dates = ds.time_delta(date1, date2)
 
-        avg = np.zeros(self.variable[0].shape)
+        avg = precision.zeros_acc(self.variable.shape[1:])
         for date in dates:
             avg += self.get_variable(date)
 
-        self.var_avg = avg / len(dates)
+        self.var_avg = precision.as_data(avg / len(dates))
 
     def get_div(self, date):
+        # divergence of the daily mean wind in 1/s on the sphere (variable 'wind_quiver')
         u10, v10 = self.get_variable(date)
-        du, dv = id.matrix_neighbour_diff(u10, v10)
-        return (du + dv)/60000
+        return precision.as_data(kinematics.SphericalGrid.era5().divergence(u10.astype(np.float64),
+                                                                            v10.astype(np.float64)))
 
 
 class Era5Regrid:
-    def __init__(self, variable):
-        # import air pressure data
+    def __init__(self, variable, region=None):
+        # import air pressure data, region: box of the lead grid to read (regions.region('lead', extent))
+        self.region = region
         variable_dict = {'msl': 'data/ERA5_METAs_remapbil.nc', 'wind': 'data/ERA5_METAs_remapbil.nc',
                          't2m': 'data/ERA5_METAs_remapbil.nc', 'siconc': 'data/ERA5_METAs_remapbil.nc',
                          'cyclone_occurence': 'data/ERA5_METAs_remapbil.nc',
                          'wind_quiver': 'data/ERA5_METAs_remapbil.nc'}
 
         self.var = variable
-        path = variable_dict[self.var]
-
-        data_set = nc.Dataset(path)
-        print(data_set)
         self.shape = Lead('20200101').old_shape
+        # the winter 2019 is in its own file, both files are opened once and shared by all dates
+        self.data_sets = {}
+        self.use_file(variable_dict[self.var])
+
+    def use_file(self, path):
+        if path not in self.data_sets:
+            self.data_sets[path] = nc.Dataset(path)
+        data_set = self.data_sets[path]
         self.time = data_set['time']
         self.lon = np.reshape(data_set.variables['lon'], self.shape)
         self.lat = np.reshape(data_set.variables['lat'], self.shape)
@@ -217,102 +224,109 @@ class Era5Regrid:
         else:
             self.variable = data_set.variables[self.var]
 
-    def get_variable(self, date):
-        dt_date = ds.string_time_to_datetime(date)
-        print(dt_date)
-        if dt_date.year == 2019:
-            variable_dict = {'msl': 'data/ERA5_METAw_remapbil.nc', 'wind': 'data/ERA5_METAw_remapbil.nc',
-                             't2m': 'data/ERA5_METAw_remapbil.nc', 'siconc': 'data/ERA5_METAw_remapbil.nc',
-                             'cyclone_occurence': 'data/ERA5_METAw_remapbil.nc',
-                             'wind_quiver': 'data/ERA5_METAw_remapbil.nc'}
-            path = variable_dict[self.var]
-
-            data_set = nc.Dataset(path)
-            self.shape = Lead('20200101').old_shape
-            self.time = data_set['time']
-            self.lon = np.reshape(data_set.variables['lon'], self.shape)
-            self.lat = np.reshape(data_set.variables['lat'], self.shape)
-
-            if self.var == 'wind_quiver':
-                self.u10 = data_set.variables['u10']
-                self.v10 = data_set.variables['v10']
-            else:
-                self.variable = data_set.variables[self.var]
+    def use_date(self, date):
+        self.use_file('data/ERA5_METAw_remapbil.nc' if date[:4] == '2019' else 'data/ERA5_METAs_remapbil.nc')
 
+    def get_variable(self, date):
+        self.use_date(date)
         d1 = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 0, 0, 0, 0)
         d2 = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 18, 0, 0, 0)
         t1, t2 = cftime.date2index([d1, d2], self.time)
 
-        new_shape = self.lon.shape
-        mean_variable = np.zeros(new_shape)
-        for t in range(t1, t2 + 1):
-            add_msl = np.reshape(self.variable[t], self.shape)
-            mean_variable = np.add(mean_variable, add_msl)
-        return ds.variable_manip(self.var, .25 * mean_variable)
+        mean_variable = np.reshape(daily_sum(self.variable, t1, t2, self.region, flat=True), self.shape)
+        return precision.as_data(ds.variable_manip(self.var, .25 * mean_variable))
 
     def get_quiver(self, date):
+        self.use_date(date)
         d1 = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 0, 0, 0, 0)
         d2 = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 18, 0, 0, 0)
         t1, t2 = cftime.date2index([d1, d2], self.time)
 
-        new_shape = self.lon.shape
-        mean_v10 = np.zeros(new_shape)
-        mean_u10 = np.zeros(new_shape)
-        for t in range(t1, t2 + 1):
-            add_v10 = np.reshape(self.v10[t], self.shape)
-            add_u10 = np.reshape(self.u10[t], self.shape)
-            mean_v10 = np.add(mean_v10, add_v10)
-            mean_u10 = np.add(mean_u10, add_u10)
-        return .25 * mean_v10, .25 * mean_u10
+        mean_v10 = np.reshape(daily_sum(self.v10, t1, t2, self.region, flat=True), self.shape)
+        mean_u10 = np.reshape(daily_sum(self.u10, t1, t2, self.region, flat=True), self.shape)
+        return precision.as_data(.25 * mean_v10), precision.as_data(.25 * mean_u10)
+
+
+# Era5 and Era5Regrid data sets are opened once per (variable, grid, region) and shared by all plots. Daily fields are
+# kept in a bounded cache, so overlays and repeated panels of the same day (e.g. the msl contours of every lead panel)
+# are read only once. Cached fields are read-only, copy them before changing them in place.
+era5_cache_size = 64
+_era5_data_sets = {}
+_era5_days = collections.OrderedDict()
+
+
+def era5(variable, regrid=False, region=None):
+    # Era5(variable, region), or Era5Regrid on the lead grid with regrid=True
+    key = (variable, regrid, region)
+    if key not in _era5_data_sets:
+        _era5_data_sets[key] = (Era5Regrid if regrid else Era5)(variable, region)
+    return _era5_data_sets[key]
+
+
+def era5_day(variable, date, method='get_variable', regrid=False, region=None):
+    # daily field method(date) of era5(variable, regrid, region), e.g. method='get_quiver' or 'get_variable_drift'
+    key = (variable, date, method, regrid, region)
+    if key in _era5_days:
+        _era5_days.move_to_end(key)
+        return _era5_days[key]
+
+    field = getattr(era5(variable, regrid, region), method)(date)
+    for array in field if isinstance(field, tuple) else (field,):
+        array.flags.writeable = False
+    _era5_days[key] = field
+    while len(_era5_days) > era5_cache_size:
+        _era5_days.popitem(last=False)
+    return field
 
 
 class LeadAllY:
-    def __init__(self, date, path=None):
-        # import lead fraction data
+    def __init__(self, date, path=None, data_catalog=None, region=None):
+        # import lead fraction data, region: only its box is read (regions.region('lead_ally', extent)), NaN elsewhere
         self.date = date[:4] + '_' + date[4:]
-        dt_date = ds.string_time_to_datetime(date)
-        dt_datem1, dt_datep1 = dt_date - datetime.timedelta(days=1), dt_date + datetime.timedelta(days=1)
-        datem1, datep1 = ds.datetime_to_string(dt_datem1), ds.datetime_to_string(dt_datep1)
-        path_lead = f'./data/DailyArcticLeadFraction_12p5km_Rheinlaender/data/LeadFraction_12p5km_{self.date}.nc'
-        path_cyc = f'./data/CO_2_remapbil.nc'
-        path_sic = f'./data/ERA5_SIC_2000_2019_remapbil.nc'
-        path_drift = f'./data/ice drift/Eumetsat/2010-2022-remapbil/'
-        path_drift += f'remapbil_ice_drift_nh_polstere-625_multi-oi_{datem1}1200-{datep1}1200.nc'
-        ds_lead = nc.Dataset(path_lead)
-        ds_cyc = nc.Dataset(path_cyc)
-        ds_sic = nc.Dataset(path_sic)
-
-        if path:
-            path_drift = path
-        try:
+        data_catalog = data_catalog if data_catalog else catalog.DataCatalog.get()
+        path_drift = path if path else catalog.drift_path(date)
+        ds_lead = nc.Dataset(catalog.lead_path(date))
+        ds_cyc = nc.Dataset(catalog.cyc_path)
+        ds_sic = nc.Dataset(catalog.sic_path)
+
+        # only open drift files the catalog knows about
+        ds_drift = None
+        if path or data_catalog.available(date, 'drift'):
             ds_drift = nc.Dataset(path_drift)
-        except FileNotFoundError:
-            ds_drift = None
 
         dt_date = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:]), 9, 0, 0)
         d = cftime.date2index(dt_date, ds_cyc['time'])
         d_sic = cftime.date2index(dt_date, ds_sic['time'])
 
-        self.lead_data = ds_lead['Lead Fraction'][:]
+        with profiling.span('read lead/cyc/sic', 'io'):
+            self.lead_data = regions.read(ds_lead['Lead Fraction'], region=region)
+            # cyclones and sic are stored as (time, ncells) of the lead grid
+            self.cyc_data = regions.read(ds_cyc['cyclone_occurence'], d, region, flat=True)
+            self.sic_data = regions.read(ds_sic['siconc'], d_sic, region, flat=True)
+
         self.lead_data[self.lead_data == 1] = np.nan
-        self.cyc_data = ds_cyc['cyclone_occurence'][d]
         self.cyc_data = self.cyc_data.reshape(self.lead_data.shape)
-        self.sic_data = ds_sic['siconc'][d_sic]
         self.sic_data = self.sic_data.reshape(self.lead_data.shape)
 
-        try:
-            self.u = ds_drift['dX'][:].reshape(self.lead_data.shape).T * 1000/172800
-            self.v = ds_drift['dY'][:].reshape(self.lead_data.shape).T * 1000/172800
-            self.u[self.u.mask] = np.nan
-            self.v[self.v.mask] = np.nan
-            self.ice_div = id.divergence(np.array([self.u, self.v]), [12000, -12000])
-        except ValueError:
-            print('could not find ice divergence data')
-            pass
-        except TypeError:
-            print(f'failed to collect ice drift data for {self.date}')
-            self.u, self.v = np.empty(self.lead_data.shape), np.empty(self.lead_data.shape)
-            self.ice_div = np.empty(self.lead_data.shape)
+        # missing drift is masked with NaN instead of uninitialised arrays, so it does not leak into composites
+        self.u, self.v = precision.full(self.lead_data.shape), precision.full(self.lead_data.shape)
+        self.ice_div = precision.full(self.lead_data.shape)
+        if ds_drift is None:
+            print(f'no ice drift data for {self.date}')
+        else:
+            try:
+                # the remapped drift is stored transposed to the lead grid
+                drift_region = region.T if region is not None else None
+                with profiling.span('read drift', 'io'):
+                    dX = regions.read(ds_drift['dX'], 0, drift_region, flat=True)
+                    dY = regions.read(ds_drift['dY'], 0, drift_region, flat=True)
+                self.u = dX.reshape(self.lead_data.shape).T * 1000/172800
+                self.v = dY.reshape(self.lead_data.shape).T * 1000/172800
+                with profiling.span('drift divergence', 'compute'):
+                    self.ice_div = id.divergence(np.array([self.u, self.v]), [12000, -12000])
+            except ValueError:
+                print('could not find ice divergence data')
+                pass
 
         '''try:
             print('normal:')
@@ -349,11 +363,57 @@ class CoordinateGridAllY:
         np.savetxt('xvals.txt', self.lon.flatten(), delimiter=' ')
 
 
-def lead_avg(date1, date2):
-    dates = ds.time_delta(date1, date2)
-    leads_list = np.array([Lead(date).new_leads() for date in dates])
+def read_lead_data(date, region=None):
+    # lead fraction of the 2020 lead files without the land, water and cloud flags, i.e. Lead(date).lead_data
+    with nc.Dataset(catalog.lead_2020_path(date)) as ds_lead:
+        lead_frac = regions.read(ds_lead['Lead Fraction'], region=region)
+    lead_frac[(lead_frac > 1) | (lead_frac < 0)] = np.nan
+    return lead_frac
+
+
+def lead_change(lead1, lead2):
+    # lead opening (positive difference) and closing (negative difference, as positive values) from lead1 to lead2 in %
+    diff = lead2 - lead1
+    return 100 * diff.clip(min=0), 100 * (-diff).clip(min=0)
+
+
+def lead_changes(dates, data_catalog=None, include_first=True):
+    # Stream (date, opening, closing) of every date against the day before it, every file is read once and only the
+    # previous day is kept. Over consecutive dates that day is the previous date, after a gap in dates it is read.
+    # With include_first=False the first date is only read as start. Days without data or without data on the day
+    # before are NaN.
+    data_catalog = data_catalog if data_catalog else catalog.DataCatalog.get()
+    previous, previous_date = None, None
+
+    for n, date in enumerate(dates):
+        prior_date = catalog.shift_date(date, -1)
+        if (n > 0 or include_first) and previous_date != prior_date:
+            previous = read_lead_data(prior_date) if data_catalog.available(prior_date, 'lead_2020') else None
+        current = read_lead_data(date) if data_catalog.available(date, 'lead_2020') else None
+        if n > 0 or include_first:
+            if previous is None or current is None:
+                print(f'No lead data available for {date} or the day before, lead changes are masked for this date.')
+                shape = next((d.shape for d in [current, previous] if d is not None), None)
+                shape = shape if shape else CoordinateGrid().lat.shape
+                yield date, precision.full(shape), precision.full(shape)
+            else:
+                yield (date,) + lead_change(previous, current)
+        previous, previous_date = current, date
+
 
-    return np.nanmean(leads_list, axis=0)
+def lead_change_avg(date1, date2, data_catalog=None):
+    # average lead opening and closing in % per day between date1 and date2 from running accumulators
+    comp = composites.Composite()
+    condition = None
+    for date, opening, closing in lead_changes(ds.time_delta(date1, date2), data_catalog):
+        condition = np.ones(opening.shape, dtype=bool) if condition is None else condition
+        comp.add({'opening': opening, 'closing': closing}, {'all': condition})
+    return comp.mean('opening', 'all'), comp.mean('closing', 'all')
+
+
+def lead_avg(date1, date2):
+    # average lead opening in % per day
+    return lead_change_avg(date1, date2)[0]
 
 
 def lead_avg_diff(date, avg):
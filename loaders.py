@@ -0,0 +1,59 @@
+# Reading netCDF variables as plain float arrays instead of MaskedArrays. Auto masking and scaling of netCDF4 are
+# switched off, invalid values (_FillValue, missing_value, outside of valid_range/valid_min/valid_max, the netCDF
+# default fill value) are found on the raw data and replaced by NaN in one step after scale_factor/add_offset are
+# applied. The result is in precision.dtype unless another dtype is given.
+import netCDF4 as nc
+import numpy as np
+import precision
+
+
+def _attributes(var):
+    return {name: var.getncattr(name) for name in var.ncattrs()}
+
+
+def invalid_mask(var, raw, attrs=None):
+    # boolean array of the raw (packed) values that are no valid data according to the CF attributes of var
+    attrs = _attributes(var) if attrs is None else attrs
+    invalid = np.zeros(raw.shape, dtype=bool)
+
+    fill_value = attrs.get('_FillValue')
+    if fill_value is None and raw.dtype.str[1:] not in ['i1', 'u1']:
+        # netCDF4 masks the default fill value too, except for byte types
+        fill_value = nc.default_fillvals.get(raw.dtype.str[1:])
+    if fill_value is not None:
+        invalid |= raw == np.asarray(fill_value, dtype=raw.dtype)
+
+    if 'missing_value' in attrs:
+        invalid |= np.isin(raw, np.atleast_1d(attrs['missing_value']).astype(raw.dtype))
+
+    valid_min, valid_max = attrs.get('valid_min'), attrs.get('valid_max')
+    if 'valid_range' in attrs:
+        valid_min, valid_max = attrs['valid_range']
+    if valid_min is not None:
+        invalid |= raw < valid_min
+    if valid_max is not None:
+        invalid |= raw > valid_max
+
+    return invalid
+
+
+def read(var, index=slice(None), dtype=None):
+    # var[index] as plain array of dtype with NaN for all invalid values, works for variables of any data set
+    mask, scale = var.mask, var.scale
+    var.set_auto_maskandscale(False)
+    try:
+        raw = np.asarray(var[index])
+    finally:
+        var.set_auto_mask(mask)
+        var.set_auto_scale(scale)
+
+    attrs = _attributes(var)
+    invalid = invalid_mask(var, raw, attrs)
+
+    data = raw.astype(dtype if dtype else precision.dtype)
+    if 'scale_factor' in attrs:
+        data *= data.dtype.type(attrs['scale_factor'])
+    if 'add_offset' in attrs:
+        data += data.dtype.type(attrs['add_offset'])
+    data[invalid] = np.nan
+    return data
@@ -14,7 +14,7 @@ class Multiplot:
         self.dates = ds.time_delta(date1, date2)
         self.extent = extent
         self.lon, self.lat = leads.CoordinateGrid().lon, leads.CoordinateGrid().lat
-        self.regr_lon, self.regr_lat = leads.Era5('msl').lon, leads.Era5('msl').lat
+        self.regr_lon, self.regr_lat = leads.era5('msl').lon, leads.era5('msl').lat
 
     def setup_plot(self):
         # create figure and base map
@@ -32,7 +32,7 @@ class Multiplot:
         cap = 0
 
         for date in self.dates:
-            div = leads.Era5('wind_quiver').get_div(date)
+            div = leads.era5_day('wind_quiver', date, 'get_div')
             divs.append(div)
             plt.imshow(div)
             cap = max(cap, np.nanmax(div), abs(np.nanmin(div)))
@@ -46,7 +46,7 @@ class Multiplot:
                 print(date)
                 im1 = a1.pcolormesh(self.lon, self.lat, 100*leads.Lead(date).lead_data, transform=ccrs.PlateCarree(),
                                     cmap='cool')
-                cim = a1.contour(self.regr_lon, self.regr_lat, leads.Era5('msl').get_variable(date),
+                cim = a1.contour(self.regr_lon, self.regr_lat, leads.era5_day('msl', date),
                                  transform=ccrs.PlateCarree(), cmap='Oranges_r', levels=10)
                 a1.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
                 a1.set_title(ds.string_time_to_datetime(date), fontsize=15)
@@ -70,7 +70,7 @@ class Multiplot:
         cap = 0
 
         for date in self.dates:
-            w_speed = leads.Era5('wind').get_variable(date)
+            w_speed = leads.era5_day('wind', date)
             w_speeds.append(w_speed)
             plt.imshow(w_speed)
             cap = max(cap, np.nanmax(w_speed))
@@ -85,7 +85,7 @@ class Multiplot:
                 # plot lead fraction
                 im1 = a1.pcolormesh(self.lon, self.lat, 100 * leads.Lead(date).lead_data, transform=ccrs.PlateCarree(),
                                     cmap='cool')
-                cim = a1.contour(self.regr_lon, self.regr_lat, leads.Era5('msl').get_variable(date),
+                cim = a1.contour(self.regr_lon, self.regr_lat, leads.era5_day('msl', date),
                                  transform=ccrs.PlateCarree(), cmap='Oranges_r', levels=10)
                 a1.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
                 a1.set_title(ds.string_time_to_datetime(date), fontsize=15)
@@ -111,7 +111,7 @@ class Multiplot:
         mcap = 0
 
         for date in self.dates:
-            t2m = leads.Era5('t2m').get_variable(date)
+            t2m = leads.era5_day('t2m', date)
             t2ms.append(t2m)
             plt.imshow(t2m)
             cap = max(cap, np.nanmax(t2m))
@@ -127,7 +127,7 @@ class Multiplot:
                 # plot lead fraction
                 im1 = a1.pcolormesh(self.lon, self.lat, 100 * leads.Lead(date).lead_data, transform=ccrs.PlateCarree(),
                                     cmap='cool')
-                cim = a1.contour(self.regr_lon, self.regr_lat, leads.Era5('msl').get_variable(date),
+                cim = a1.contour(self.regr_lon, self.regr_lat, leads.era5_day('msl', date),
                                  transform=ccrs.PlateCarree(), cmap='Oranges_r', levels=10)
                 a1.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
                 a1.set_title(ds.string_time_to_datetime(date), fontsize=15)
@@ -151,7 +151,7 @@ class Multiplot:
         cycs = []
 
         for date in self.dates:
-            cyc = leads.Era5('cyclone_occurence').get_variable(date)
+            cyc = leads.era5_day('cyclone_occurence', date)
             cycs.append(cyc)
             plt.imshow(cyc)
 
@@ -165,7 +165,7 @@ class Multiplot:
                 # plot lead fraction
                 im1 = a1.pcolormesh(self.lon, self.lat, 100 * leads.Lead(date).lead_data, transform=ccrs.PlateCarree(),
                                     cmap='cool')
-                cim = a1.contour(self.regr_lon, self.regr_lat, leads.Era5('msl').get_variable(date),
+                cim = a1.contour(self.regr_lon, self.regr_lat, leads.era5_day('msl', date),
                                  transform=ccrs.PlateCarree(), cmap='Oranges_r', levels=10)
                 a1.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
                 a1.set_title(ds.string_time_to_datetime(date), fontsize=15)
@@ -173,7 +173,7 @@ class Multiplot:
                 # plot second variable
                 im2 = a2.pcolormesh(self.regr_lon, self.regr_lat, cyc, vmin=0, vmax=100,
                                     transform=ccrs.PlateCarree(), cmap='Greys', alpha=.4)
-                cim = a2.contour(self.regr_lon, self.regr_lat, leads.Era5('msl').get_variable(date),
+                cim = a2.contour(self.regr_lon, self.regr_lat, leads.era5_day('msl', date),
                                  transform=ccrs.PlateCarree(), cmap='Oranges_r', levels=10)
                 a2.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
 
@@ -192,7 +192,7 @@ class Multiplot:
         sics = []
 
         for date in self.dates:
-            sic = leads.Era5('siconc').get_variable(date)
+            sic = leads.era5_day('siconc', date)
             sics.append(sic)
             plt.imshow(sic)
 
@@ -206,7 +206,7 @@ class Multiplot:
                 # plot lead fraction
                 im1 = a1.pcolormesh(self.lon, self.lat, 100 * leads.Lead(date).lead_data, transform=ccrs.PlateCarree(),
                                     cmap='cool')
-                cim = a1.contour(self.regr_lon, self.regr_lat, leads.Era5('msl').get_variable(date),
+                cim = a1.contour(self.regr_lon, self.regr_lat, leads.era5_day('msl', date),
                                  transform=ccrs.PlateCarree(), cmap='Oranges_r', levels=10)
                 a1.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
                 a1.set_title(ds.string_time_to_datetime(date), fontsize=15)
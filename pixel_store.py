@@ -0,0 +1,225 @@
+# Pixel-major storage of daily grids. The time axis is the fastest axis and the grid is cut into spatial tiles, so the
+# whole time series of one pixel (or a small patch inside one tile) is a single contiguous read from disk.
+import os
+import pickle
+import numpy as np
+import leads
+import catalog
+import precision
+import profiling
+
+
+def lead_cyc_fields(date, sic_filter=95.):
+    # Same preprocessing as Analysis.collect_leads_cycs for lead fraction and cyclone occurrence of one day.
+    # Days that are missing in the data catalog are NaN.
+    if not catalog.DataCatalog.get().available(date, 'lead', 'cyc', 'sic'):
+        shape = leads.CoordinateGridAllY().lat.shape
+        return {'leads': precision.full(shape), 'cycs': precision.full(shape)}
+
+    leadally = leads.LeadAllY(date)
+    lead_data = leadally.lead_data
+    lead_data[100 * leadally.sic_data <= sic_filter] = np.nan
+
+    cyc = precision.as_data(leadally.cyc_data, copy=True)
+    cyc[cyc <= .25] = np.nan
+    cyc[cyc > .25] = 1.
+
+    return {'leads': lead_data, 'cycs': cyc}
+
+
+def drift_fields(date):
+    # ice divergence of the drift product on the lead grid (orientation as in Analysis.collect_leads_cycs)
+    shape = leads.CoordinateGridAllY().lat.shape
+    if not catalog.DataCatalog.get().available(date, 'lead', 'cyc', 'sic', 'drift'):
+        return {'divs': precision.full(shape)}
+    return {'divs': leads.LeadAllY(date).ice_div.T}
+
+
+class PixelStore:
+    def __init__(self, path, mode='r', n_dates=None):
+        # path is the prefix of the store, data is kept in '{path}.npy' and the description in '{path}_meta.pkl'.
+        # The time axis of the file can be longer than the stored dates (spare capacity for appending days), n_dates
+        # restricts the store to its first n_dates dates.
+        self.path = path
+        with open(f'{path}_meta.pkl', 'rb') as pickle_in:
+            meta = pickle.load(pickle_in)
+
+        self.dates = meta['dates'][:n_dates]
+        self.shape = meta['shape']
+        self.tile = meta['tile']
+        data = np.load(f'{path}.npy', mmap_mode=mode)
+        self.capacity = data.shape[-1]
+        self.data = data[..., :len(self.dates)]
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(f'{path}.npy') and os.path.isfile(f'{path}_meta.pkl')
+
+    @staticmethod
+    def tiled_shape(shape, tile):
+        # number of tiles in y and x direction, the grid is padded with NaN up to a multiple of the tile size
+        return -(-shape[0] // tile[0]), -(-shape[1] // tile[1])
+
+    @staticmethod
+    def to_tiles(block, tile):
+        # (time, y, x) -> (tile_y, tile_x, y in tile, x in tile, time)
+        nt, ny, nx = block.shape
+        nty, ntx = PixelStore.tiled_shape((ny, nx), tile)
+        padded = np.full((nt, nty * tile[0], ntx * tile[1]), np.nan, dtype=np.float32)
+        padded[:, :ny, :nx] = block
+        padded = padded.reshape(nt, nty, tile[0], ntx, tile[1])
+        return padded.transpose(1, 3, 2, 4, 0)
+
+    @staticmethod
+    def _write_days(paths, dates, loader, offset, open_store, tile, block_days):
+        # Write the days of dates to the time steps offset, offset + 1, ... of the stores, open_store(field, shape)
+        # returns the memmap of a field. Days are buffered in blocks, so each pixel gets written block_days values at a
+        # time instead of a single value.
+        stores, buffers = {}, {}
+
+        for t0 in range(0, len(dates), block_days):
+            block_dates = dates[t0:t0 + block_days]
+            for n, date in enumerate(block_dates):
+                profiling.progress(date, len(dates))
+                fields = loader(date)
+                for field in paths:
+                    if field not in stores:
+                        stores[field] = open_store(field, fields[field].shape)
+                    if field not in buffers:
+                        buffers[field] = np.full((block_days,) + fields[field].shape, np.nan, dtype=np.float32)
+
+                    buffers[field][n] = np.ma.filled(fields[field].astype(np.float32), np.nan)
+
+            t = offset + t0
+            for field in paths:
+                stores[field][..., t:t + len(block_dates)] = PixelStore.to_tiles(buffers[field][:len(block_dates)],
+                                                                                 tile)
+
+        for store in stores.values():
+            store.flush()
+
+    @staticmethod
+    def build(paths, dates, loader, tile=(32, 32), block_days=64, capacity=None):
+        # Build one store per field returned by loader(date) -> {field: 2d array} while reading every day only once.
+        # paths maps the field names to the store prefixes. capacity: length of the time axis of the files if days
+        # are going to be appended later, len(dates) by default. The meta data is written after all days, a store
+        # without it is incomplete and gets rebuilt.
+        for path in paths.values():
+            if os.path.isfile(f'{path}_meta.pkl'):
+                os.remove(f'{path}_meta.pkl')
+        shapes = {}
+
+        def open_store(field, shape):
+            nty, ntx = PixelStore.tiled_shape(shape, tile)
+            shapes[field] = shape
+            return np.lib.format.open_memmap(f'{paths[field]}.npy', mode='w+', dtype=np.float32,
+                                             shape=(nty, ntx, tile[0], tile[1], max(len(dates), capacity or 0)))
+
+        PixelStore._write_days(paths, dates, loader, 0, open_store, tile, block_days)
+        for field, path in paths.items():
+            with open(f'{path}_meta.pkl', 'wb') as filehandler:
+                pickle.dump({'dates': list(dates), 'shape': shapes[field], 'tile': tile}, filehandler)
+        return {field: PixelStore(path) for field, path in paths.items()}
+
+    @staticmethod
+    def grow(path, capacity):
+        # copy the store to a file with a longer time axis, tile row by tile row
+        old = np.load(f'{path}.npy', mmap_mode='r')
+        new = np.lib.format.open_memmap(f'{path}.grow.npy', mode='w+', dtype=old.dtype,
+                                        shape=old.shape[:-1] + (capacity,))
+        for ty in range(old.shape[0]):
+            new[ty, ..., :old.shape[-1]] = old[ty]
+        new.flush()
+        del old, new
+        os.replace(f'{path}.grow.npy', f'{path}.npy')
+
+    @staticmethod
+    def extend(paths, dates, loader, block_days=64, growth=1.5):
+        # Append the days of dates that follow the stored dates to the stores of paths (built together, so they hold
+        # the same dates), only the new days are read. A full time axis grows by the factor growth, so the following
+        # extensions are written in place. The dates of the meta data are updated last, an interrupted extension leaves
+        # the store as it was.
+        stores = {field: PixelStore(path) for field, path in paths.items()}
+        first = next(iter(stores.values()))
+        stored = first.dates
+        if list(dates[:len(stored)]) != stored:
+            raise ValueError(f'dates do not continue the stored dates {stored[0]} - {stored[-1]}')
+        new_dates = list(dates[len(stored):])
+        if not new_dates:
+            return stores
+
+        for field, store in stores.items():
+            if len(dates) > store.capacity:
+                print(f'grow pixel store {paths[field]}')
+                PixelStore.grow(paths[field], max(len(dates), int(growth * store.capacity)))
+
+        def open_store(field, shape):
+            return np.load(f'{paths[field]}.npy', mmap_mode='r+')
+
+        PixelStore._write_days(paths, new_dates, loader, len(stored), open_store, first.tile, block_days)
+        for field, store in stores.items():
+            with open(f'{paths[field]}_meta.pkl', 'wb') as filehandler:
+                pickle.dump({'dates': list(dates), 'shape': store.shape, 'tile': store.tile}, filehandler)
+        return {field: PixelStore(path) for field, path in paths.items()}
+
+    @staticmethod
+    def open(paths, field, dates, loader, block_days=64):
+        # Store of field holding exactly dates, built if necessary. Stores are found by their first date: a store of an
+        # earlier run is extended by the new days, a longer one is opened restricted to dates.
+        if not PixelStore.exists(paths[field]):
+            print('could not find pixel store \n try to create pixel store')
+            return PixelStore.build(paths, dates, loader, block_days=block_days)[field]
+        stored = PixelStore(paths[field]).dates
+        if len(dates) > len(stored):
+            return PixelStore.extend(paths, dates, loader, block_days)[field]
+        if stored[:len(dates)] != list(dates):
+            raise ValueError(f'dates do not match the stored dates {stored[0]} - {stored[-1]}')
+        return PixelStore(paths[field], n_dates=len(dates))
+
+    def series(self, row, col):
+        # full time series of one pixel
+        return np.array(self.data[row // self.tile[0], col // self.tile[1], row % self.tile[0], col % self.tile[1]])
+
+    def patch(self, rows, cols):
+        # time series of all pixels in rows x cols (slices), returns an array of shape (y, x, time). A patch that lies
+        # within one tile is one read of that tile's block.
+        rows = range(*rows.indices(self.shape[0]))
+        cols = range(*cols.indices(self.shape[1]))
+        out = np.empty((len(rows), len(cols), len(self.dates)), dtype=np.float32)
+
+        for ty in range(rows.start // self.tile[0], (rows.stop - 1) // self.tile[0] + 1):
+            r0, r1 = max(rows.start, ty * self.tile[0]), min(rows.stop, (ty + 1) * self.tile[0])
+            for tx in range(cols.start // self.tile[1], (cols.stop - 1) // self.tile[1] + 1):
+                c0, c1 = max(cols.start, tx * self.tile[1]), min(cols.stop, (tx + 1) * self.tile[1])
+                out[r0 - rows.start:r1 - rows.start, c0 - cols.start:c1 - cols.start] = \
+                    self.data[ty, tx, r0 - ty * self.tile[0]:r1 - ty * self.tile[0],
+                              c0 - tx * self.tile[1]:c1 - tx * self.tile[1]]
+        return out
+
+    def tiles(self):
+        # iterate over all tiles, yields the (rows, cols) slices of the grid and the (y, x, time) data of the tile
+        nty, ntx = self.data.shape[:2]
+        for ty in range(nty):
+            for tx in range(ntx):
+                rows = slice(ty * self.tile[0], min((ty + 1) * self.tile[0], self.shape[0]))
+                cols = slice(tx * self.tile[1], min((tx + 1) * self.tile[1], self.shape[1]))
+                yield rows, cols, np.array(self.data[ty, tx, :rows.stop - rows.start, :cols.stop - cols.start])
+
+    def pixel_statistic(self, func):
+        # Apply func (reducing the last axis, e.g. np.nanmean) to all pixel time series, tile by tile.
+        out = None
+        for rows, cols, block in self.tiles():
+            res = func(block, axis=-1)
+            if out is None:
+                out = np.full(self.shape, np.nan, dtype=res.dtype)
+            out[rows, cols] = res
+        return out
+
+
+if __name__ == '__main__':
+    # import data_science as ds
+    # dates = ds.time_delta('20021105', '20220430')
+    # stores = PixelStore.build({'leads': './pickles/pixel_store_leads', 'cycs': './pickles/pixel_store_cycs'}, dates,
+    #                           lead_cyc_fields)
+    # print(stores['leads'].series(150, 150))
+    pass
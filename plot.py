@@ -1,10 +1,13 @@
 import case_information as ci
+import climatology
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import leads
 import data_science as ds
 import numpy as np
 import helpful_functions as hf
+import profiling
+from functools import partial
 from scipy.stats import gaussian_kde
 
 
@@ -13,7 +16,8 @@ def show_plot(fig, file_name, show):
     if show:
         plt.show()
     else:
-        plt.savefig(file_name, bbox_inches='tight')
+        with profiling.span('savefig', 'render'):
+            plt.savefig(file_name, bbox_inches='tight')
         plt.close(fig)
 
 
@@ -200,20 +204,30 @@ def lead_plot(grid, lead, fig, ax, show_cbar):
     return im
 
 
+_lead_baselines = {}
+
+
+def lead_baseline(date1, date2):
+    # mean lead opening of a window, computed once for all panels
+    if (date1, date2) not in _lead_baselines:
+        _lead_baselines[(date1, date2)] = leads.lead_avg(date1, date2)
+    return _lead_baselines[(date1, date2)]
+
+
 def ds_from_var(variable, date):
     re = None
     if variable == 'wind_quiver':
         from skimage.transform import resize
         re = resize
-        data_set = leads.Era5Regrid(leads.Lead(date), 'wind_quiver')  # With this Era5Regrid-class is tested
+        data_set = leads.era5('wind_quiver', regrid=True)
     elif variable == 'siconc_diff':
-        data_set = leads.Era5('siconc')
+        data_set = leads.era5('siconc')
     elif variable == 'wind_diff':
-        data_set = leads.Era5('wind')
+        data_set = leads.era5('wind')
     elif variable == 'lead_diff':
         data_set = leads.Lead(date)
     else:
-        data_set = leads.Era5(variable)
+        data_set = leads.era5(variable)
 
     return data_set, re
 
@@ -225,29 +239,30 @@ def variable_plot(date, fig, ax, variable, show_cbar):
     im = None
 
     if Var.style == 'contour':
-        cim = ax.contour(data_set.lon, data_set.lat, data_set.get_variable(date), cmap=Var.cmap,
+        cim = ax.contour(data_set.lon, data_set.lat, leads.era5_day(variable, date), cmap=Var.cmap,
                          alpha=Var.alpha, transform=ccrs.PlateCarree(), levels=10)
         ax.clabel(cim, inline=True, fontsize=15, inline_spacing=10)
     elif Var.style == 'quiver':
-        lat_dir, lon_dir = data_set.get_quiver(date)
+        lat_dir, lon_dir = leads.era5_day(variable, date, 'get_quiver', regrid=True)
         dim = (50, 50)
         lon, lat = resize(data_set.lon, dim), resize(data_set.lat, dim)
         v10, u10 = resize(lon_dir, dim), resize(lat_dir, dim)
         im = ax.quiver(lon, lat, v10, u10, np.sqrt(v10**2+u10**2), transform=ccrs.PlateCarree(), cmap=Var.cmap, scale=150,
                        width=.008, pivot='mid', clim=(0.0, 25.0))  # scale=40, scale_units='inches'
     elif variable == 'siconc_diff' or variable == 'wind_diff':
-        # prev_date = ds.string_time_to_datetime(date)
-        # prev_date = ds.datetime_to_string(prev_date - datetime.timedelta(days=1))
-        data_set.get_var_diff('20200214', '20200225')
-        im = ax.pcolormesh(data_set.lon, data_set.lat, np.subtract(data_set.get_variable(date), data_set.var_avg),
+        # anomaly to the day of year climatology of the whole ERA5 record
+        anomaly = climatology.AnomalyLoader(partial(leads.era5_day, data_set.var), 'era5', data_set.var)
+        im = ax.pcolormesh(data_set.lon, data_set.lat, anomaly(date),
                            alpha=Var.alpha, cmap=Var.cmap, transform=ccrs.PlateCarree(), vmin=-20.0, vmax=20.0)
     elif variable == 'lead_diff':
-        avg = leads.lead_avg('20200201', '20200229')
+        # new leads compared to the mean lead opening of February 2020. The lead files cover a single season, a day of
+        # year climatology of them would contain about one sample per day, the day itself.
+        anomaly = np.subtract(data_set.new_leads(), lead_baseline('20200201', '20200229'))
         lon, lat = leads.CoordinateGrid().lon, leads.CoordinateGrid().lat
-        im = ax.pcolormesh(lon, lat, np.subtract(leads.Lead(date).new_leads(), avg), vmin=-80.0, vmax=80.0,
+        im = ax.pcolormesh(lon, lat, anomaly, vmin=-80.0, vmax=80.0,
                            alpha=Var.alpha, cmap=Var.cmap, transform=ccrs.PlateCarree())
     else:
-        im = ax.pcolormesh(data_set.lon, data_set.lat, data_set.get_variable(date), alpha=Var.alpha, cmap=Var.cmap,
+        im = ax.pcolormesh(data_set.lon, data_set.lat, leads.era5_day(variable, date), alpha=Var.alpha, cmap=Var.cmap,
                            transform=ccrs.PlateCarree())
         # im.set_clim(0, 25)
     if show_cbar and im:
@@ -311,8 +326,8 @@ def variable_pixel_pixel(date1, date2, extent):
     for date in dates:
         print(date)
         lead = leads.Lead(date)
-        cyc = leads.Era5Regrid(lead, 'cyclone_occurence').get_variable(date)[mask]
-        sic = leads.Era5Regrid(lead, 'siconc').get_variable(date)[mask]
+        cyc = leads.era5_day('cyclone_occurence', date, regrid=True)[mask]
+        sic = leads.era5_day('siconc', date, regrid=True)[mask]
         lead = lead.new_leads()[mask]
 
         lead, cyc, sic = hf.filter_by_sic(lead, cyc, sic, 85)
@@ -348,10 +363,10 @@ def variable_pixel_pixel_density(date1, date2, extent):
         for date in dates:
             print(date)
             lead = leads.Lead(date)
-            cyc = leads.Era5Regrid(lead, 'cyclone_occurence').get_variable(date)[mask]
+            cyc = leads.era5_day('cyclone_occurence', date, regrid=True)[mask]
             cyc_mask = cyc == cyc_freq
             cyc = cyc[cyc_mask]
-            sic = leads.Era5Regrid(lead, 'siconc').get_variable(date)[mask][cyc_mask]
+            sic = leads.era5_day('siconc', date, regrid=True)[mask][cyc_mask]
             lead = lead.lead_data[mask][cyc_mask]
             #lead, cyc, sic = hf.filter_by_sic(lead, cyc, sic, 90)
 
@@ -0,0 +1,40 @@
+# Floating point policy. Lead fraction, cyclone occurrence, sic and drift fields are kept in `dtype` from loading to the
+# composites (the lead files store float32, so nothing is lost), sums over many days are accumulated in `acc_dtype`.
+# precision.set_policy(np.float64) restores full double precision everywhere.
+import numpy as np
+
+dtype = np.float32
+acc_dtype = np.float64
+
+
+def set_policy(data=np.float32, accumulate=np.float64):
+    global dtype, acc_dtype
+    dtype, acc_dtype = np.dtype(data).type, np.dtype(accumulate).type
+
+
+def as_data(array, copy=False):
+    # cast to the data dtype, masked arrays stay masked and no copy is made if the dtype already fits
+    return array.astype(dtype, copy=copy)
+
+
+def full(shape, fill_value=np.nan):
+    return np.full(shape, fill_value, dtype=dtype)
+
+
+def zeros_acc(shape):
+    # accumulator for sums over many time steps
+    return np.zeros(shape, dtype=acc_dtype)
+
+
+def stack(arrays):
+    # (time, y, x) cube of a list of daily fields without promoting them
+    return np.array(arrays, dtype=dtype)
+
+
+def nanmean(array, axis=None):
+    # accumulate in acc_dtype, return in the data dtype
+    return np.nanmean(array, axis=axis, dtype=acc_dtype).astype(dtype)
+
+
+def nanstd(array, axis=None):
+    return np.nanstd(array, axis=axis, dtype=acc_dtype).astype(dtype)
@@ -0,0 +1,110 @@
+# Read-ahead for loops over dates. A background process loads the next days while the main process computes on the
+# current one. The arrays of a loaded day are copied into shared memory blocks, only their names, shapes and dtypes go
+# through the bounded queue, so at most `ahead` days are waiting in memory and the days arrive in the order of dates.
+#
+#   for date, day in prefetch.prefetch(dates, load_day, ahead=4):
+#       ...
+#
+# load(date) (or load(context, date) with context = setup() created once in the worker) must be picklable, i.e. a
+# module level function, a class or a functools.partial of those. It may return arrays, masked arrays, scalars and
+# dicts/lists/tuples of them. ahead=0 loads in the main process without a worker. If profiling is enabled, the spans
+# and bytes read of the worker are sent along with every day and merged into the profiler of the main process.
+import multiprocessing as mp
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import profiling
+
+
+class _Shared:
+    def __init__(self, name, shape, dtype):
+        self.name, self.shape, self.dtype = name, shape, dtype
+
+
+def _encode(obj):
+    # move the arrays of obj to shared memory, the worker does not keep them
+    if isinstance(obj, np.ma.MaskedArray):
+        return np.ma.MaskedArray, _encode(obj.data), _encode(np.ma.getmaskarray(obj))
+    if isinstance(obj, np.ndarray):
+        shm = shared_memory.SharedMemory(create=True, size=max(obj.nbytes, 1))
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        # the main process unlinks the block once it is read
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        shm.close()
+        return _Shared(shm.name, obj.shape, obj.dtype.str)
+    if isinstance(obj, dict):
+        return {key: _encode(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_encode(value) for value in obj)
+    return obj
+
+
+def _decode(obj, release=False):
+    # copy the arrays out of shared memory and free the blocks, release=True only frees them
+    if isinstance(obj, tuple) and len(obj) == 3 and obj[0] is np.ma.MaskedArray:
+        data, mask = _decode(obj[1], release), _decode(obj[2], release)
+        return None if release else np.ma.MaskedArray(data, mask=mask)
+    if isinstance(obj, _Shared):
+        shm = shared_memory.SharedMemory(name=obj.name)
+        array = None if release else np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf).copy()
+        shm.close()
+        shm.unlink()
+        return array
+    if isinstance(obj, dict):
+        return {key: _decode(value, release) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_decode(value, release) for value in obj)
+    return obj
+
+
+def _producer(dates, load, setup, queue, profile):
+    try:
+        # own profiler of the worker, a forked worker must not send the counts of the main process again
+        if profile:
+            profiling.enable()
+        else:
+            profiling.disable()
+        context = setup() if setup is not None else None
+        for date in dates:
+            day = load(context, date) if setup is not None else load(date)
+            queue.put(('day', date, (_encode(day), profiling.take())))
+        queue.put(('done', None, None))
+    except Exception:
+        queue.put(('error', None, traceback.format_exc()))
+
+
+def prefetch(dates, load, setup=None, ahead=4):
+    # yields (date, loaded day) for all dates in order
+    if ahead == 0:
+        context = setup() if setup is not None else None
+        for date in dates:
+            yield date, load(context, date) if setup is not None else load(date)
+        return
+
+    queue = mp.Queue(maxsize=ahead)
+    worker = mp.Process(target=_producer, args=(list(dates), load, setup, queue, profiling.enabled()), daemon=True)
+    worker.start()
+    try:
+        while True:
+            with profiling.span('prefetch wait', 'io'):
+                kind, date, day = queue.get()
+            if kind == 'done':
+                break
+            if kind == 'error':
+                raise RuntimeError(f'prefetch worker failed:\n{day}')
+            day, counts = day
+            profiling.merge(counts)
+            yield date, _decode(day)
+    finally:
+        # loop left early (break or exception): stop the worker and free the days that are still queued
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+        while True:
+            try:
+                kind, _, day = queue.get(timeout=.1)
+            except Exception:
+                break
+            if kind == 'day':
+                _decode(day[0], release=True)
+        queue.close()
@@ -0,0 +1,160 @@
+# Instrumentation for long analysis runs. Named timing spans are grouped in stages ('io', 'compute', 'render'), bytes
+# read and processed days are counted, so a run can tell where the time goes. When profiling is not enabled span()
+# returns one shared no-op context manager and the counters return right away, so it can stay in the code.
+#
+#   profiling.enable(progress=True)
+#   Analysis('20140105', '20191229').cluster_leads()
+#   profiling.write_summary('./profile.json')     # or .csv
+import contextlib
+import csv
+import json
+import resource
+import sys
+import time
+
+_profiler = None
+_null_span = contextlib.nullcontext()
+
+
+def peak_rss_mb():
+    # ru_maxrss is given in kB on linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+class Profiler:
+    def __init__(self, progress=False):
+        self.progress = progress
+        self.spans = {}
+        self.bytes_read = 0
+        self.days = 0
+        self.t0 = time.perf_counter()
+
+    def add(self, name, stage, seconds):
+        entry = self.spans.setdefault(name, {'stage': stage, 'calls': 0, 'seconds': 0.})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+
+    def day_done(self, date, total=None):
+        self.days += 1
+        if not self.progress:
+            return
+        elapsed = time.perf_counter() - self.t0
+        rate = self.days / elapsed if elapsed else 0.
+        line = f'{date} | {self.days}' + (f'/{total}' if total else '') + f' days | {rate:.2f} days/s'
+        if total and rate:
+            line += f' | ETA {time.strftime("%H:%M:%S", time.gmtime(max(total - self.days, 0) / rate))}'
+        print(line, flush=True)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.t0
+        stages = {}
+        for entry in self.spans.values():
+            stages[entry['stage']] = stages.get(entry['stage'], 0.) + entry['seconds']
+        return {'elapsed_s': elapsed, 'days': self.days, 'days_per_s': self.days / elapsed if elapsed else 0.,
+                'bytes_read': self.bytes_read, 'mb_per_s': self.bytes_read / 2 ** 20 / elapsed if elapsed else 0.,
+                'peak_rss_mb': peak_rss_mb(), 'stages': stages, 'spans': self.spans}
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'stage', 't0')
+
+    def __init__(self, profiler, name, stage):
+        self.profiler, self.name, self.stage = profiler, name, stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, self.stage, time.perf_counter() - self.t0)
+        return False
+
+
+def enable(progress=False):
+    global _profiler
+    _profiler = Profiler(progress)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def enabled():
+    return _profiler is not None
+
+
+def span(name, stage='compute'):
+    # with profiling.span('LeadAllY', 'io'): ...
+    if _profiler is None:
+        return _null_span
+    return _Span(_profiler, name, stage)
+
+
+def add_bytes(*arrays):
+    # count the bytes of freshly read arrays (or plain byte counts)
+    if _profiler is None:
+        return
+    _profiler.bytes_read += sum(a if isinstance(a, int) else getattr(a, 'nbytes', 0) for a in arrays)
+
+
+def progress(date, total=None):
+    # replaces print(date) in the day loops, prints days/s and ETA instead if live progress is on
+    if _profiler is None or not _profiler.progress:
+        print(date)
+    if _profiler is not None:
+        _profiler.day_done(date, total)
+
+
+def tick(date, total=None):
+    # count a processed day in loops that do not print their progress
+    if _profiler is not None:
+        _profiler.day_done(date, total)
+
+
+def take():
+    # spans and bytes counted since the last take(), reset afterwards. Used by worker processes to send their counts
+    # to the main process, None if profiling is not enabled.
+    if _profiler is None:
+        return None
+    counts = (_profiler.spans, _profiler.bytes_read)
+    _profiler.spans, _profiler.bytes_read = {}, 0
+    return counts
+
+
+def merge(counts):
+    # add the counts of take() in another process, their time overlaps with the spans of this process
+    if _profiler is None or counts is None:
+        return
+    spans, bytes_read = counts
+    for name, entry in spans.items():
+        own = _profiler.spans.setdefault(name, {'stage': entry['stage'], 'calls': 0, 'seconds': 0.})
+        own['calls'] += entry['calls']
+        own['seconds'] += entry['seconds']
+    _profiler.bytes_read += bytes_read
+
+
+def summary():
+    return _profiler.summary() if _profiler else {}
+
+
+def write_summary(path):
+    # json (everything) or csv (one row per span), nothing is written when profiling is not enabled
+    summ = summary()
+    if not summ:
+        return summ
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['span', 'stage', 'calls', 'seconds', 'share'])
+            for name, entry in sorted(summ['spans'].items(), key=lambda s: -s[1]['seconds']):
+                writer.writerow([name, entry['stage'], entry['calls'], f'{entry["seconds"]:.4f}',
+                                 f'{entry["seconds"] / summ["elapsed_s"]:.4f}'])
+            for key in ['elapsed_s', 'days', 'days_per_s', 'bytes_read', 'mb_per_s', 'peak_rss_mb']:
+                writer.writerow([key, '', '', summ[key], ''])
+    else:
+        with open(path, 'w') as f:
+            json.dump(summ, f, indent=2)
+    return summ
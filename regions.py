@@ -0,0 +1,157 @@
+# Hyperslab reads for regional analyses. Instead of reading the pan-Arctic grids and setting everything outside of an
+# extent to NaN afterwards, the minimal row/column box of the cells inside the extent is planned once per grid and
+# extent, and only that box is read from the netCDF files. The result still has the shape of the full grid (NaN
+# outside of the box), so all grids, masks and stencils of the calling code stay valid.
+#
+#   region = regions.region('eumetsat', ci.barent_extent)
+#   dX = regions.read(ds['dX'], 0, region)                   # (yc, xc) variable
+#   cyc = regions.read(ds_cyc['cyclone_occurence'], d, region, flat=True)    # grid stored row by row in ncells
+#
+# Cells inside the extent are the cells lonlat_mask selects, with longitudes wrapped to [-180, 180), so the 0 - 360
+# longitudes of ERA5 work too. On the periodic longitude axis of ERA5 a box across the 0 meridian is read as two slices.
+import os
+import cartopy.crs as ccrs
+import netCDF4 as nc
+import numpy as np
+import leads
+import loaders
+import profiling
+
+_regions = {}
+
+
+def inside(extent, lon, lat):
+    # cells of the extent, like ice_divergence.lonlat_mask but independent of the longitude convention
+    lon = (np.asarray(lon, dtype=np.float64) + 180) % 360 - 180
+    lon_min, lon_max = min(extent[:2]), max(extent[:2])
+    if lon_max - lon_min >= 360:
+        in_lon = np.ones(lon.shape, dtype=bool)
+    else:
+        in_lon = (lon >= lon_min) & (lon <= lon_max)
+    return in_lon & (lat >= min(extent[2:])) & (lat <= max(extent[2:]))
+
+
+def index_range(used, pad, periodic=False):
+    # slices of the indices of used (1d boolean) widened by pad. On a periodic axis the range may wrap around the end,
+    # then it is split into two slices.
+    n = len(used)
+    idx = np.flatnonzero(used)
+    if not periodic:
+        return [slice(int(max(idx[0] - pad, 0)), int(min(idx[-1] + 1 + pad, n)))]
+
+    # the complement of the largest circular gap between used indices
+    gaps = np.diff(np.append(idx, idx[0] + n))
+    g = np.argmax(gaps)
+    if gaps[g] <= 2 * pad + 1:
+        return [slice(0, n)]
+    start, stop = idx[(g + 1) % len(idx)] - pad, idx[g] + 1 + pad
+    start, stop = int(start % n), int(stop % n if stop % n else n)
+    if start < stop:
+        return [slice(start, stop)]
+    return [slice(start, n), slice(0, stop)]
+
+
+class Region:
+    def __init__(self, shape, rows, cols):
+        # full (y, x) shape of the grid, slice of the rows and list of slices of the columns of the box
+        self.shape = tuple(shape)
+        self.rows = rows
+        self.cols = list(cols)
+
+    @property
+    def T(self):
+        # box of the transposed grid, e.g. of a drift field stored with x as the slow axis
+        assert len(self.cols) == 1, 'a wrapped box can not be transposed'
+        return Region(self.shape[::-1], self.cols[0], [self.rows])
+
+    @property
+    def fraction(self):
+        # share of the grid cells that are read
+        return (self.rows.stop - self.rows.start) * sum(c.stop - c.start for c in self.cols) / np.prod(self.shape)
+
+    def read(self, var, index=(), flat=False, dtype=None):
+        # var[index] on the full grid with NaN outside of the box, only the box is read. flat: the grid is stored row by
+        # row in one dimension (ncells), then the whole rows of the box are read in one contiguous slice.
+        index = index if isinstance(index, tuple) else (index,)
+        if flat:
+            nx = self.shape[1]
+            band = loaders.read(var, index + (slice(self.rows.start * nx, self.rows.stop * nx),), dtype)
+            profiling.add_bytes(band)
+            band = band.reshape(band.shape[:-1] + (-1, nx))
+            pieces = [(cols, band[..., cols]) for cols in self.cols]
+        else:
+            pieces = [(cols, loaders.read(var, index + (self.rows, cols), dtype)) for cols in self.cols]
+            profiling.add_bytes(*[piece for _, piece in pieces])
+
+        out = np.full(pieces[0][1].shape[:-2] + self.shape, np.nan, dtype=pieces[0][1].dtype)
+        for cols, piece in pieces:
+            out[..., self.rows, cols] = piece
+        return out
+
+
+def plan(extent, lon, lat, pad=1, periodic=False):
+    # Region of the cells of extent on a 2d lon/lat grid (or 1d lon and lat axes). pad: extra cells around the box, so
+    # stencils at the edge of the extent see their neighbours. periodic: the columns are a closed longitude circle.
+    if lon.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+    used = inside(extent, np.ma.filled(lon, np.nan), np.ma.filled(lat, np.nan))
+    if not used.any():
+        raise ValueError(f'no grid cell inside of the extent {extent}')
+    rows = index_range(used.any(axis=1), pad)[0]
+    cols = index_range(used.any(axis=0), pad, periodic)
+    return Region(used.shape, rows, cols)
+
+
+def lead_ally_grid():
+    grid = leads.CoordinateGridAllY()
+    return grid.lon, grid.lat, False
+
+
+def lead_grid():
+    grid = leads.CoordinateGrid()
+    return grid.lon, grid.lat, False
+
+
+def era5_grid():
+    with nc.Dataset('./data/ERA5_METAs.nc') as data_set:
+        return data_set['longitude'][:], data_set['latitude'][:], True
+
+
+def eumetsat_grid():
+    # lon/lat of the first EUMETSAT/OSI SAF drift file, all files share the 62.5 km grid
+    directory = './data/ice drift/Eumetsat/2010-2022/'
+    path = next(p for p in sorted(os.listdir(directory)) if p.endswith('.nc'))
+    with nc.Dataset(directory + path) as data_set:
+        return data_set['lon'][:], data_set['lat'][:], False
+
+
+def drift_grid():
+    # the remapped ERA5 and drift files of IceData only have xc/yc of the 62.5 km polar stereographic drift grid
+    with nc.Dataset('./data/ERA5_METAs_remapbil_drift.nc') as data_set:
+        xx, yy = np.meshgrid(1000 * data_set['xc'][:], 1000 * data_set['yc'][:])
+    lonlat = ccrs.PlateCarree().transform_points(ccrs.NorthPolarStereo(-45, true_scale_latitude=70), xx, yy)
+    return lonlat[..., 0], lonlat[..., 1], False
+
+
+grids = {'lead_ally': lead_ally_grid, 'lead': lead_grid, 'era5': era5_grid, 'eumetsat': eumetsat_grid,
+         'drift': drift_grid}
+
+
+def region(grid, extent, pad=1):
+    # planned once per grid and extent, None (read everything) without extent
+    if extent is None:
+        return None
+    key = (grid, tuple(extent), pad)
+    if key not in _regions:
+        lon, lat, periodic = grids[grid]()
+        _regions[key] = plan(extent, lon, lat, pad, periodic)
+    return _regions[key]
+
+
+def read(var, index=(), region=None, flat=False, dtype=None):
+    # loaders.read of the whole variable without region, of the box of region otherwise, counts the bytes read
+    if region is not None:
+        return region.read(var, index, flat, dtype)
+    data = loaders.read(var, index if index != () else slice(None), dtype)
+    profiling.add_bytes(data)
+    return data
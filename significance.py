@@ -0,0 +1,103 @@
+# Resampling significance of composite differences. The days of the two composite cubes (NaN where a day does not belong
+# to the composite, as returned by Analysis.cluster_leads(matrix3d=True)) are grouped in blocks of consecutive days,
+# which keeps the temporal autocorrelation inside the resamples. Every block is reduced to per pixel sums and counts
+# once, a resample is then just a weight vector over the blocks, so all resamples of a pixel tile are two matrix
+# products. Tiles run in a process pool, the resample weights are drawn once from the seed, so the result does not
+# depend on the number of processes. Multiple testing over the pixels is handled with the Benjamini-Hochberg FDR.
+#
+#   res = significance.resampling_test(cyc_prior, no_cyc_prior, method='bootstrap', n_resamples=2000)
+#   diff[~res['significant']] = np.nan
+from multiprocessing import Pool
+import numpy as np
+
+
+def block_sums(cube, block_days):
+    # (time, y, x) -> per block NaN-sums and counts of shape (blocks, pixels), the last block may be shorter
+    nt = cube.shape[0]
+    flat = cube.reshape(nt, -1)
+    starts = np.arange(0, nt, block_days)
+    valid = ~np.isnan(flat)
+    sums = np.add.reduceat(np.where(valid, flat, 0), starts, axis=0, dtype=np.float64)
+    counts = np.add.reduceat(valid, starts, axis=0, dtype=np.float64)
+    return sums, counts
+
+
+def resample_weights(n_blocks, n_resamples, method, seed):
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        # how often every block is drawn (with replacement)
+        weights = np.zeros((n_resamples, n_blocks))
+        np.add.at(weights, (np.repeat(np.arange(n_resamples), n_blocks),
+                            rng.integers(0, n_blocks, n_resamples * n_blocks)), 1)
+        return weights
+    elif method == 'permutation':
+        # 1 keeps the group labels of a block, 0 swaps the two composites within the block
+        return rng.integers(0, 2, (n_resamples, n_blocks)).astype(np.float64)
+    raise ValueError(f'unknown method {method}')
+
+
+def _tile_pvalues(sums_a, counts_a, sums_b, counts_b, weights, method):
+    # p-values of the difference of the means of composite a and b for the pixels of one tile
+    with np.errstate(invalid='ignore', divide='ignore'):
+        diff = sums_a.sum(0) / counts_a.sum(0) - sums_b.sum(0) / counts_b.sum(0)
+
+        if method == 'bootstrap':
+            res = (weights @ sums_a) / (weights @ counts_a) - (weights @ sums_b) / (weights @ counts_b)
+            # recentred bootstrap distribution as null distribution
+            exceed = np.abs(res - diff) >= np.abs(diff)
+        else:
+            keep = 1 - weights
+            s_a, n_a = weights @ sums_a + keep @ sums_b, weights @ counts_a + keep @ counts_b
+            s_b, n_b = sums_a.sum(0) + sums_b.sum(0) - s_a, counts_a.sum(0) + counts_b.sum(0) - n_a
+            res = s_a / n_a - s_b / n_b
+            exceed = np.abs(res) >= np.abs(diff)
+
+    n_valid = np.sum(~np.isnan(res), axis=0)
+    exceed = np.sum(exceed & ~np.isnan(res), axis=0)
+    pvalues = (exceed + 1) / (n_valid + 1) if method == 'permutation' else exceed / np.maximum(n_valid, 1)
+    pvalues[np.isnan(diff) | (n_valid == 0)] = np.nan
+    return diff, pvalues
+
+
+def _tile_task(args):
+    return _tile_pvalues(*args)
+
+
+def fdr_bh(pvalues, alpha=.05):
+    # Benjamini-Hochberg: boolean mask of the pixels that are significant at false discovery rate alpha, NaN p-values
+    # are never significant
+    p = np.asarray(pvalues, dtype=np.float64)
+    flat = p.ravel()
+    valid = np.flatnonzero(~np.isnan(flat))
+    significant = np.zeros(flat.shape, dtype=bool)
+    if valid.size == 0:
+        return significant.reshape(p.shape)
+
+    order = valid[np.argsort(flat[valid])]
+    below = flat[order] <= alpha * np.arange(1, valid.size + 1) / valid.size
+    if below.any():
+        significant[order[:np.flatnonzero(below)[-1] + 1]] = True
+    return significant.reshape(p.shape)
+
+
+def resampling_test(cube_a, cube_b, method='bootstrap', block_days=10, n_resamples=1000, seed=0, alpha=.05,
+                    processes=None, tile=4096):
+    # Difference of the means of two composite cubes (time, y, x) over the same days with block bootstrap or block
+    # permutation p-values and the Benjamini-Hochberg significance mask.
+    shape = cube_a.shape[1:]
+    sums_a, counts_a = block_sums(cube_a, block_days)
+    sums_b, counts_b = block_sums(cube_b, block_days)
+    weights = resample_weights(sums_a.shape[0], n_resamples, method, seed)
+
+    tiles = [slice(p, p + tile) for p in range(0, sums_a.shape[1], tile)]
+    tasks = [(sums_a[:, s], counts_a[:, s], sums_b[:, s], counts_b[:, s], weights, method) for s in tiles]
+    if processes == 1:
+        results = list(map(_tile_task, tasks))
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_tile_task, tasks)
+
+    diff = np.concatenate([r[0] for r in results]).reshape(shape)
+    pvalues = np.concatenate([r[1] for r in results]).reshape(shape)
+    return {'diff': diff, 'pvalues': pvalues, 'significant': fdr_bh(pvalues, alpha), 'alpha': alpha,
+            'method': method, 'block_days': block_days, 'n_resamples': n_resamples}
@@ -0,0 +1,200 @@
+# Per pixel trends of (time, y, x) cubes or pixel stores: ordinary least squares slope with t-test p-value, Theil-Sen
+# slope (median of all pairwise slopes) and the Mann-Kendall test (with tie correction). Daily values are first reduced
+# to one value per season, month or year, then all pixels of a spatial tile are handled with array operations. The
+# pairwise differences of Theil-Sen and Mann-Kendall are formed for as many pixels at once as fit into memory_mb, tiles
+# run in a process pool, so the peak memory is about processes * memory_mb. Slopes are per year.
+#
+#   res = trends.pixel_trends(ps.PixelStore('./pickles/pixel_store_leads_95.0_20021105'), aggregate='season')
+#   res['sen_slope'][res['mk_p'] >= .05] = np.nan
+from multiprocessing import Pool
+import warnings
+import numpy as np
+from scipy.stats import norm, t as t_dist
+import pixel_store as ps
+
+
+def decimal_years(dates):
+    # 'YYYYMMDD' -> year with the day of the year as fraction
+    dates = np.array([f'{d[:4]}-{d[4:6]}-{d[6:]}' for d in dates], dtype='datetime64[D]')
+    years = dates.astype('datetime64[Y]')
+    length = ((years + 1).astype('datetime64[D]') - years.astype('datetime64[D]')).astype(float)
+    return years.astype(int) + 1970 + (dates - years.astype('datetime64[D]')).astype(float) / length
+
+
+def group_labels(dates, aggregate):
+    # label of every date, consecutive dates with the same label are averaged
+    if aggregate is None:
+        return list(dates)
+    if callable(aggregate):
+        return [aggregate(date) for date in dates]
+    if aggregate == 'season':
+        # winter season (Nov - Apr) named by the year of its November
+        return [int(d[:4]) if int(d[4:6]) >= 7 else int(d[:4]) - 1 for d in dates]
+    if aggregate == 'month':
+        return [d[:6] for d in dates]
+    if aggregate == 'year':
+        return [d[:4] for d in dates]
+    raise ValueError(f'unknown aggregate {aggregate}')
+
+
+def group_starts(labels):
+    # index of the first time step of every run of equal labels
+    return np.array([0] + [n for n in range(1, len(labels)) if labels[n] != labels[n - 1]])
+
+
+def aggregate_block(block, starts, statistic='mean', min_valid=.5):
+    # (pixels, time) -> (pixels, groups). 'mean' averages the valid values, 'frequency' is the fraction of time steps
+    # that are not NaN (cyclone occurrence is 1 or NaN). Groups with less than min_valid valid days are NaN for 'mean'.
+    valid = ~np.isnan(block)
+    lengths = np.diff(np.append(starts, block.shape[1]))
+    counts = np.add.reduceat(valid, starts, axis=1, dtype=np.float64)
+    if statistic == 'frequency':
+        return counts / lengths
+    sums = np.add.reduceat(np.where(valid, block, 0), starts, axis=1, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    means[counts < min_valid * lengths] = np.nan
+    return means
+
+
+def ols(y, t):
+    # y: (pixels, time) with NaN, t: (time,) -> slope, intercept and two sided p-value of the slope
+    valid = ~np.isnan(y)
+    n = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_mean = np.where(valid, t, 0).sum(axis=1) / n
+        y_mean = np.where(valid, y, 0).sum(axis=1) / n
+        dt = np.where(valid, t - t_mean[:, None], 0)
+        dy = np.where(valid, y - y_mean[:, None], 0)
+        sxx = np.sum(dt ** 2, axis=1)
+        slope = np.sum(dt * dy, axis=1) / sxx
+        intercept = y_mean - slope * t_mean
+
+        sse = np.sum((dy - slope[:, None] * dt) ** 2, axis=1)
+        stderr = np.sqrt(sse / (n - 2) / sxx)
+        pvalue = 2 * t_dist.sf(np.abs(slope / stderr), n - 2)
+    # constant series have a zero slope without significance
+    pvalue[(stderr == 0) & (slope == 0)] = 1.
+    pvalue[n < 3] = np.nan
+    return slope, intercept, pvalue
+
+
+def tie_sums(y):
+    # sum over the groups of tied values of t * (t - 1) * (2t + 5) for every pixel, NaN excluded
+    p, nt = y.shape
+    s = np.sort(y, axis=1)
+    valid = ~np.isnan(s)
+    new = np.ones(s.shape, dtype=bool)
+    new[:, 1:] = s[:, 1:] != s[:, :-1]
+    group = np.cumsum(new, axis=1) - 1 + (np.arange(p) * nt)[:, None]
+    ties = np.bincount(group[valid], minlength=p * nt).reshape(p, nt).astype(np.float64)
+    return np.sum(ties * (ties - 1) * (2 * ties + 5), axis=1)
+
+
+def sen_mann_kendall(y, t, memory_mb=256):
+    # Theil-Sen slope and intercept, Mann-Kendall S, z and p-value. The pairwise differences of chunk pixels at a time
+    # are formed, chunk is chosen so that they (and their slopes and signs) stay below memory_mb.
+    p, nt = y.shape
+    i, j = np.triu_indices(nt, 1)
+    dt = (t[j] - t[i]).astype(y.dtype)
+    chunk = max(1, int(memory_mb * 2 ** 20 // max(1, 4 * i.size * y.itemsize)))
+
+    slope, s = np.full(p, np.nan), np.zeros(p)
+    for c in range(0, p, chunk):
+        d = y[c:c + chunk, j] - y[c:c + chunk, i]
+        s[c:c + chunk] = np.nansum(np.sign(d), axis=1)
+        d /= dt
+        with warnings.catch_warnings():
+            # all-NaN pixels
+            warnings.simplefilter('ignore', RuntimeWarning)
+            slope[c:c + chunk] = np.nanmedian(d, axis=1)
+        del d
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        intercept = np.nanmedian(y - slope[:, None] * t, axis=1)
+
+    n = np.sum(~np.isnan(y), axis=1).astype(np.float64)
+    var = (n * (n - 1) * (2 * n + 5) - tie_sums(y)) / 18
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(var > 0, (s - np.sign(s)) / np.sqrt(var), 0.)
+    pvalue = 2 * norm.sf(np.abs(z))
+    pvalue[n < 3] = np.nan
+    z[n < 3] = np.nan
+    return slope, intercept, s, z, pvalue
+
+
+def block_trends(block, t, methods=('ols', 'sen', 'mk'), memory_mb=256):
+    # block: (pixels, time) -> {name: (pixels,)} for the requested methods
+    res = {}
+    if 'ols' in methods:
+        res['ols_slope'], res['ols_intercept'], res['ols_p'] = ols(block, t)
+    if 'sen' in methods or 'mk' in methods:
+        sen, intercept, s, z, p = sen_mann_kendall(block, t, memory_mb)
+        if 'sen' in methods:
+            res['sen_slope'], res['sen_intercept'] = sen, intercept
+        if 'mk' in methods:
+            res['mk_s'], res['mk_z'], res['mk_p'] = s, z, p
+    res['n'] = np.sum(~np.isnan(block), axis=1)
+    return res
+
+
+def _tile_task(args):
+    # tile of a pixel store (path, ty, tx, tile shape, number of dates) or of a cube (array of shape (time, y, x)), aggregated and reduced
+    source, starts, t, statistic, methods, memory_mb = args
+    if isinstance(source, tuple):
+        path, ty, tx, shape, n_dates = source
+        data = ps.PixelStore(path, n_dates=n_dates).data[ty, tx, :shape[0], :shape[1]]
+        block = np.array(data, dtype=np.float32).reshape(-1, data.shape[-1])
+    else:
+        block = np.moveaxis(source, 0, -1).reshape(-1, source.shape[0])
+    if starts is not None:
+        block = aggregate_block(block, starts, statistic)
+    return block_trends(block, t, methods, memory_mb)
+
+
+def pixel_trends(source, dates=None, aggregate='season', statistic='mean', methods=('ols', 'sen', 'mk'),
+                 processes=None, memory_mb=256, tile=(32, 32)):
+    # Trend maps of a PixelStore or a (time, y, x) cube with its dates. aggregate: 'season', 'month', 'year', a function
+    # date -> label or None for the raw time steps. Returns {name: (y, x) map} plus the aggregated time axis 't'.
+    is_store = isinstance(source, ps.PixelStore)
+    dates = source.dates if is_store and dates is None else dates
+    shape = source.shape if is_store else source.shape[1:]
+
+    years = decimal_years(dates)
+    if aggregate is None:
+        starts, t = None, years
+    else:
+        starts = group_starts(group_labels(dates, aggregate))
+        t = np.add.reduceat(years, starts) / np.diff(np.append(starts, len(dates)))
+
+    tasks, slices = [], []
+    tile = source.tile if is_store else tile
+    for ty in range(-(-shape[0] // tile[0])):
+        for tx in range(-(-shape[1] // tile[1])):
+            rows = slice(ty * tile[0], min((ty + 1) * tile[0], shape[0]))
+            cols = slice(tx * tile[1], min((tx + 1) * tile[1], shape[1]))
+            if is_store:
+                tile_source = (source.path, ty, tx, (rows.stop - rows.start, cols.stop - cols.start),
+                               len(source.dates))
+            else:
+                tile_source = source[:, rows, cols]
+            tasks.append((tile_source, starts, t, statistic, methods, memory_mb))
+            slices.append((rows, cols))
+
+    maps = {}
+
+    def collect(results):
+        for (rows, cols), res in zip(slices, results):
+            for name, values in res.items():
+                if name not in maps:
+                    maps[name] = np.zeros(shape, dtype=np.int32) if name == 'n' else np.full(shape, np.nan)
+                maps[name][rows, cols] = values.reshape(rows.stop - rows.start, cols.stop - cols.start)
+
+    if processes == 1:
+        collect(map(_tile_task, tasks))
+    else:
+        with Pool(processes) as pool:
+            collect(pool.imap(_tile_task, tasks))
+    maps['t'] = t
+    return maps